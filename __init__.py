@@ -21,12 +21,17 @@ from itools.gettext import MSG, register_domain
 
 # Import from ikaaro
 from ikaaro.access import AccessControl
+from ikaaro.database import Database
+from ikaaro.server import Server
 from ikaaro.user import User
 
 # Import from shop
 from root import Root
 from user import ShopUser
 import forms_generator
+import indexes
+import outbox
+import transactions
 from registry import register_shop_skin
 from shop import Shop
 from website import ShopWebSite
@@ -55,3 +60,14 @@ register_shop_skin(MSG(u'Default Skin'),
 # XXX Override Monkey patch itws
 # We want that public images on user profil are visible
 ShopUser.is_allowed_to_view = AccessControl.is_allowed_to_view
+
+# XXX Monkey patch ikaaro
+# The actions registered with "after_commit" are run once the transaction
+# is committed, forgotten if it is aborted (see shop.transactions)
+Database.save_changes = transactions.save_changes
+Database.abort_changes = transactions.abort_changes
+# The emails are sent by the shop-send-emails.py worker (see shop.outbox)
+Server.send_email = outbox.send_email
+# The search indexes are built in the background once the server is
+# started (see shop.indexes)
+Server.start = indexes.start
@@ -0,0 +1,368 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from standard library
+from bisect import bisect_left, insort
+from heapq import nsmallest
+
+# Import from itools
+from itools.core import LRUCache
+
+# Import from shop
+from indexes import BackgroundIndex, get_index, get_index_if_built
+from indexes import register_index
+from product_search import fold, get_words
+from transactions import after_commit
+from utils import get_parent_paths
+
+
+# The number of results by kind
+AUTOCOMPLETE_SIZES = {'category': 3, 'manufacturer': 3, 'product': 10}
+# The shortest prefix searched
+AUTOCOMPLETE_MIN_LENGTH = 2
+# Above this number of words starting with the prefix, the products are
+# scanned from the most popular, until there are enough results
+AUTOCOMPLETE_SCAN_MIN = 3000
+
+
+def get_keys(text):
+    """The words of the text (lowercase, without accents).
+    """
+    if not text:
+        return []
+    return [ fold(x) for x in get_words(text) ]
+
+
+
+class AutocompleteIndex(BackgroundIndex):
+    """
+    Prefix index of the titles (in every website language) of the
+    products, the categories and the manufacturers of a site root, and of
+    the references of the products.
+      - keys: sorted list of (word, abspath), the words starting with a
+        prefix are found by bisection
+      - items: {abspath: item}, the item being a dict with the keys:
+          kind, title (in the default language), titles ({language:
+          title}), href, reference, words, is_public, groups,
+          manufacturer, categories, popularity
+      - ranked: sorted list of (-popularity, title, abspath) of the public
+        products, the popularity of a product being its sold quantity
+      - others: the abspaths of the categories and the manufacturers
+      - nb_products: {category or manufacturer abspath: nb public
+        products}, the popularity of the categories and the manufacturers
+    The manufacturers are indexed with their first product.
+    The index is built in the background (see shop.indexes), then it is
+    updated each time a product or a category is indexed, moved or
+    deleted (once the transaction is committed). The results are cached
+    until one of their items changes.
+    """
+
+    def __init__(self):
+        BackgroundIndex.__init__(self)
+        self.keys = []
+        self.items = {}
+        self.ranked = []
+        self.others = set()
+        self.nb_products = {}
+        # {(words, group): results}
+        self.cache = LRUCache(500, 1000)
+
+
+    def get_formats(self, shop):
+        return ['category', shop.product_class.class_id]
+
+
+    def index_resource(self, resource):
+        if resource.class_id == 'category':
+            self.index_items([self.get_item(resource, 'category')])
+        else:
+            self.index_items(self.get_product_items(resource))
+
+
+    def end_rebuild(self):
+        self.keys.sort()
+        self.ranked.sort()
+        BackgroundIndex.end_rebuild(self)
+
+
+    #######################################################################
+    # Update
+    #######################################################################
+    def index_item(self, abspath, kind, title, href, words, **kw):
+        self.remove_item(abspath)
+        words = set(words)
+        item = {'kind': kind,
+                'title': title,
+                'titles': {},
+                'href': href,
+                'reference': None,
+                'words': words,
+                'is_public': True,
+                'groups': [],
+                'manufacturer': None,
+                'categories': [],
+                'popularity': 0}
+        item.update(kw)
+        self.items[abspath] = item
+        entries = [ (self.keys, (x, abspath)) for x in words ]
+        if kind != 'product':
+            self.others.add(abspath)
+        elif item['is_public']:
+            entries.append(
+                (self.ranked, (-item['popularity'], title, abspath)))
+            for path in item['categories'] + [item['manufacturer']]:
+                self.nb_products[path] = self.nb_products.get(path, 0) + 1
+        for entries_list, entry in entries:
+            if self.is_built:
+                insort(entries_list, entry)
+            else:
+                # Sorted at the end of the rebuild
+                entries_list.append(entry)
+        self._invalidate(item)
+        return item
+
+
+    def remove_item(self, abspath):
+        item = self.items.pop(abspath, None)
+        if item is None:
+            return None
+        entries = [ (self.keys, (x, abspath)) for x in item['words'] ]
+        if item['kind'] != 'product':
+            self.others.discard(abspath)
+        elif item['is_public']:
+            entries.append(
+                (self.ranked, (-item['popularity'], item['title'], abspath)))
+            for path in item['categories'] + [item['manufacturer']]:
+                self.nb_products[path] -= 1
+        for entries_list, entry in entries:
+            if self.is_built:
+                i = bisect_left(entries_list, entry)
+                if i < len(entries_list) and entries_list[i] == entry:
+                    del entries_list[i]
+            elif entry in entries_list:
+                # Not sorted yet
+                entries_list.remove(entry)
+        self._invalidate(item)
+        return item
+
+
+    def _invalidate(self, item):
+        """Remove from the cache the results the item may be part of (or
+        its categories and its manufacturer).
+        """
+        if not self.cache:
+            return
+        words = set(item['words'])
+        for path in item['categories'] + [item['manufacturer']]:
+            if path in self.items:
+                words.update(self.items[path]['words'])
+        for key in self.cache.keys():
+            for prefix in key[0]:
+                if not [ 1 for x in words if x.startswith(prefix) ]:
+                    break
+            else:
+                del self.cache[key]
+
+
+    def get_item(self, resource, kind, **kw):
+        """Return the arguments of "index_item" for the resource, indexed
+        with its titles in every language of its website.
+        """
+        site_root = resource.get_site_root()
+        languages = site_root.get_property('website_languages')
+        titles = dict([ (x, resource.get_title(language=x))
+                        for x in languages ])
+        words = []
+        for title in titles.itervalues():
+            words.extend(get_keys(title))
+        kw['titles'] = titles
+        return (str(resource.get_abspath()), kind, titles[languages[0]],
+                '/%s' % site_root.get_pathto(resource), words, kw)
+
+
+    def get_product_items(self, product):
+        """The items of the product and of its manufacturer.
+        """
+        site_root = product.get_site_root()
+        items = []
+        manufacturer = product.get_property('manufacturer') or None
+        if manufacturer:
+            resource = site_root.get_resource(manufacturer, soft=True)
+            if resource is not None:
+                items.append(self.get_item(resource, 'manufacturer'))
+                manufacturer = str(resource.get_abspath())
+        reference = product.get_property('reference')
+        item = self.get_item(product, 'product',
+                  reference=reference,
+                  is_public=(product.get_statename() == 'public'),
+                  groups=list(product.get_property('not_buyable_by_groups')),
+                  manufacturer=manufacturer,
+                  categories=get_parent_paths(product.get_abspath()) or [],
+                  popularity=product.get_property('sold-quantity') or 0)
+        if reference:
+            item[4].append(fold(unicode(reference, 'utf-8').lower()))
+        items.append(item)
+        return items
+
+
+    def index_items(self, items):
+        for abspath, kind, title, href, words, kw in items:
+            # The manufacturers are indexed with their first product
+            if kind == 'manufacturer' and abspath in self.items:
+                continue
+            self.index_item(abspath, kind, title, href, words, **kw)
+
+
+    def update_product(self, product):
+        after_commit(self._update, self.get_product_items(product))
+
+
+    def update_category(self, category):
+        after_commit(self._update, [self.get_item(category, 'category')])
+
+
+    def _update(self, items):
+        if self.is_built is False and self.is_building is False:
+            return
+        self.index_items(items)
+
+
+    def update_manufacturer(self, manufacturer):
+        """Index the new title of the manufacturer, if indexed.
+        """
+        item = self.get_item(manufacturer, 'manufacturer')
+        after_commit(self._update_manufacturer, item)
+
+
+    def _update_manufacturer(self, item):
+        abspath, kind, title, href, words, kw = item
+        if abspath in self.items:
+            self.index_item(abspath, kind, title, href, words, **kw)
+
+
+    def remove_path(self, abspath):
+        """Remove the item at the given path and all the items below.
+        """
+        after_commit(self._remove_path, str(abspath))
+
+
+    def _remove_path(self, abspath):
+        if self.is_built is False and self.is_building is False:
+            return
+        prefix = abspath.rstrip('/') + '/'
+        for path in self.items.keys():
+            if path == abspath or path.startswith(prefix):
+                self.remove_item(path)
+
+
+    #######################################################################
+    # Search
+    #######################################################################
+    def get_range(self, prefix):
+        """Return the slice of the keys starting with the prefix.
+        """
+        keys = self.keys
+        return (bisect_left(keys, (prefix,)),
+                bisect_left(keys, (prefix + u'\uffff',)))
+
+
+    def match(self, item, words):
+        """Tell whether the item has a word starting with each word.
+        """
+        for word in words:
+            if not [ 1 for x in item['words'] if x.startswith(word) ]:
+                return False
+        return True
+
+
+    def search(self, text, group=None):
+        """Return {kind: list of items} for the categories, manufacturers
+        and public products (not buyable by the group excluded) having a
+        word starting with each word of the text. The most popular first.
+        """
+        words = get_keys(text)
+        if len(u''.join(words)) < AUTOCOMPLETE_MIN_LENGTH:
+            return dict([ (x, []) for x in AUTOCOMPLETE_SIZES ])
+        key = (tuple(words), group)
+        results = self.cache.get(key)
+        if results is not None:
+            return results
+        # Start from the less frequent word
+        keys = self.keys
+        items = self.items
+        ranges = [ (self.get_range(x), x) for x in words ]
+        ranges.sort(key=lambda x: x[0][1] - x[0][0])
+        start, end = ranges[0][0]
+        words = [ x[1] for x in ranges ]
+        if end - start < AUTOCOMPLETE_SCAN_MIN:
+            abspaths = set([ x[1] for x in keys[start:end] ])
+            abspaths = [ x for x in abspaths
+                         if self.match(items[x], words[1:]) ]
+        else:
+            # Frequent words: the most popular products first
+            abspaths = [ x for x in self.others
+                         if self.match(items[x], words) ]
+            size = AUTOCOMPLETE_SIZES['product']
+            for popularity, title, abspath in self.ranked:
+                item = items[abspath]
+                if group in item['groups'] or not self.match(item, words):
+                    continue
+                abspaths.append(abspath)
+                size -= 1
+                if size == 0:
+                    break
+        # The references with separators ("AB-12")
+        reference = fold(text.strip().lower())
+        if reference not in words:
+            start, end = self.get_range(reference)
+            abspaths = set(abspaths)
+            abspaths.update([ x[1] for x in keys[start:end] ])
+        # Filter
+        results = dict([ (x, []) for x in AUTOCOMPLETE_SIZES ])
+        nb_products = self.nb_products
+        for abspath in abspaths:
+            item = items[abspath]
+            kind = item['kind']
+            if kind == 'product':
+                if not item['is_public'] or group in item['groups']:
+                    continue
+                popularity = item['popularity']
+            else:
+                popularity = nb_products.get(abspath, 0)
+                if popularity == 0:
+                    continue
+            results[kind].append((-popularity, item['title'], abspath, item))
+        # Sort and cap
+        for kind, size in AUTOCOMPLETE_SIZES.iteritems():
+            kind_results = nsmallest(size, results[kind])
+            results[kind] = [ x[3] for x in kind_results ]
+        self.cache[key] = results
+        return results
+
+
+
+# {site root abspath: AutocompleteIndex}
+autocomplete_indexes = {}
+register_index(autocomplete_indexes, AutocompleteIndex)
+
+def get_autocomplete_index(shop):
+    """None until the index is built (see shop.indexes).
+    """
+    return get_index(autocomplete_indexes, AutocompleteIndex, shop)
+
+
+def get_autocomplete_index_if_built(resource):
+    return get_index_if_built(autocomplete_indexes, resource)
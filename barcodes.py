@@ -0,0 +1,152 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# Generating a barcode needs elaphe and ghostscript, so the images are
+# cached on disk, into the "barcodes" folder of the instance.
+# An image is stored at "<key[:2]>/<key>.png", the key being the SHA-1
+# of (format, code, options). The least recently used images are
+# removed when the cache is bigger than its max size.
+#######################################################################
+
+# Import from standard library
+from hashlib import sha1
+from os import fdopen, listdir, makedirs, remove, rename, stat, utime
+from os.path import exists, join
+from tempfile import mkstemp
+
+# Import from shop
+from utils import barcode_options, generate_barcode
+
+
+# Max size of the cache (in bytes)
+BARCODES_CACHE_SIZE = 50 * 1024 * 1024
+
+
+class BarcodesCache(object):
+
+    def __init__(self, path, max_size=BARCODES_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        # Computed the first time an image is added
+        self.size = None
+        if not exists(path):
+            makedirs(path)
+
+
+    def get_key(self, format, code, options=barcode_options):
+        options = sorted(options.items())
+        return sha1(repr((format, code, options))).hexdigest()
+
+
+    def get_path(self, key):
+        return join(self.path, key[:2], '%s.png' % key)
+
+
+    def get_barcode(self, format, code):
+        """Return the image (PNG) of the barcode, or None if it cannot be
+        generated.
+        """
+        if format == '0':
+            return None
+        key = self.get_key(format, code)
+        path = self.get_path(key)
+        if exists(path):
+            # Used recently
+            utime(path, None)
+            return open(path).read()
+        barcode = generate_barcode(format, code)
+        if barcode is not None:
+            self.add(path, barcode)
+        return barcode
+
+
+    def add(self, path, data):
+        folder = path.rsplit('/', 1)[0]
+        if not exists(folder):
+            makedirs(folder)
+        fd, tmp_path = mkstemp(dir=folder)
+        file = fdopen(fd, 'w')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        rename(tmp_path, path)
+        # Eviction
+        if self.size is None:
+            self.size = sum([ x[2] for x in self.get_files() ])
+        else:
+            self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+
+    def get_files(self):
+        """Return the images of the cache as a list of
+        (path, last access, size).
+        """
+        files = []
+        for folder in listdir(self.path):
+            folder = join(self.path, folder)
+            for name in listdir(folder):
+                path = join(folder, name)
+                try:
+                    info = stat(path)
+                except OSError:
+                    # Removed by another process
+                    continue
+                files.append((path, info.st_mtime, info.st_size))
+        return files
+
+
+    def evict(self):
+        """Remove the least recently used images, until the cache is
+        smaller than 3/4 of its max size.
+        """
+        files = self.get_files()
+        files.sort(key=lambda x: x[1])
+        size = sum([ x[2] for x in files ])
+        for path, mtime, file_size in files:
+            if size <= self.max_size * 3 / 4:
+                break
+            try:
+                remove(path)
+            except OSError:
+                continue
+            size -= file_size
+        self.size = size
+
+
+
+# {instance path: BarcodesCache}
+barcodes_caches = {}
+
+def get_barcodes_cache(target):
+    cache = barcodes_caches.get(target)
+    if cache is None:
+        path = join(target, 'barcodes')
+        cache = barcodes_caches[target] = BarcodesCache(path)
+    return cache
+
+
+def make_barcodes(target, format, codes):
+    """Generate the barcodes not in the cache (run by the jobs worker, see
+    Shop.pregenerate_barcodes).
+    """
+    cache = get_barcodes_cache(target)
+    for code in codes:
+        cache.get_barcode(format, code)
+    return '\n'.join(codes)
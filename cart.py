@@ -24,8 +24,9 @@ from itools.web import get_context
 from ikaaro.datatypes import Password
 
 # Import from shop
+from prices import get_prices_cache
+from shipping_quotes import get_shipping_quotes
 from utils import format_price
-from utils import get_shippings_details
 
 
 class ProductCart(object):
@@ -44,7 +45,9 @@ class ProductCart(object):
             if self.context.get_cookie(key) is None:
                 self.context.set_cookie(key, '', path='/')
         # We load cart
-        self.products = self._get_products()
+        # (Products are resolved only when needed)
+        self._cookie_products = self._decode_products()
+        self._products = None
         self.addresses = self._get_addresses()
         self.shipping = self._get_shipping()
         self.id_zone = self._get_id_zone()
@@ -92,7 +95,7 @@ class ProductCart(object):
     #######################################
     ## Products
     #######################################
-    def _get_products(self):
+    def _decode_products(self):
         """
         Format of cookie "products":
           id|name|quantity|declination
@@ -109,18 +112,33 @@ class ProductCart(object):
                 id, name, quantity, declination = data.split('|')
             except ValueError:
                 raise ValueError, 'Value "%s" is incorrect' % data
+            products.append({'id': id,
+                             'name': name,
+                             'quantity': int(quantity),
+                             'declination': declination})
+        return products
+
+
+    def _get_products(self):
+        products = []
+        for product_cart in self._cookie_products:
             # Check product exist
+            name = product_cart['name']
             product = self.context.root.get_resource(name, soft=True)
             if not product or not product.is_buyable(self.context):
                 continue
             # Add product
-            products.append({'id': id,
-                             'name': name,
-                             'quantity': int(quantity),
-                             'declination': declination})
+            products.append(product_cart)
         return products
 
 
+    @property
+    def products(self):
+        if self._products is None:
+            self._products = self._get_products()
+        return self._products
+
+
     def save_products(self):
         cookies = []
         for product in self.products:
@@ -230,6 +248,7 @@ class ProductCart(object):
     def set_shipping(self, shipping_name, shipping_option=''):
         value = Password.encode('%s|%s' % (shipping_name, shipping_option))
         cookie = self.context.set_cookie('shipping', value)
+        self.shipping = {'name': shipping_name, 'option': shipping_option}
 
     ########################
     # Id zone
@@ -245,6 +264,9 @@ class ProductCart(object):
     def set_id_zone(self, id_zone):
         value = Password.encode(id_zone)
         cookie = self.context.set_cookie('id_zone', value)
+        self.id_zone = id_zone
+        # Taxes depends on zone
+        get_prices_cache(self.context).set_id_zone(id_zone)
 
     ######################
     # Addresses
@@ -270,6 +292,8 @@ class ProductCart(object):
 
 
     def _set_addresses(self, delivery_address, bill_address):
+        self.addresses = {'delivery_address': delivery_address,
+                          'bill_address': bill_address}
         if delivery_address==None:
             delivery_address = ''
         if bill_address==None:
@@ -319,13 +343,10 @@ class ProductCart(object):
         delivery_address = self.addresses['delivery_address']
         record = addresses.get_record(delivery_address)
         country = addresses.get_record_value(record, 'country')
-        shippings = shop.get_resource('shippings')
         shipping_mode = self.shipping['name']
         # Guess shipping posibilities
-        shippings_details = get_shippings_details(self, context)
-        shippings = shop.get_resource('shippings')
-        for s in shippings.get_namespace_shipping_ways(context,
-                        country, shippings_details):
+        quotes = get_shipping_quotes(context)
+        for s in quotes.get_shipping_ways(shop, country):
             if s['name'] == shipping_mode:
               return s
 
@@ -348,8 +369,24 @@ class ProductCart(object):
     def clear(self):
         for key in ['products', 'addresses', 'shipping']:
             self.context.del_cookie(key)
+        self._cookie_products = []
+        self._products = []
+        self.clean()
 
 
     def clean(self):
         for key in ['addresses', 'shipping']:
             self.context.del_cookie(key)
+        self.addresses = {'delivery_address': None,
+                          'bill_address': None}
+        self.shipping = None
+
+
+
+def get_cart(context):
+    """The cart is built once by request and shared by all callers."""
+    cart = getattr(context, '_cart', None)
+    if cart is None:
+        cart = ProductCart(context)
+        context._cart = cart
+    return cart
@@ -0,0 +1,231 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# Read the catalog of the shop by batches, to export it without loading
+# all the products in memory.
+#######################################################################
+
+# Import from standard library
+from csv import writer
+from decimal import Decimal as decimal
+from json import loads
+from os import fdopen, remove
+from tempfile import mkstemp
+from xml.sax.saxutils import escape, quoteattr
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+# Import from itools
+from itools.xapian import AndQuery, OrQuery, PhraseQuery
+
+# Import from shop
+from prices import get_prices_cache
+from utils import format_price
+
+
+def iter_brains(root, query, sort_by='abspath', batch_size=100):
+    """Yield the brains matching the query, loaded by batches.
+    """
+    results = root.search(query)
+    start = 0
+    while True:
+        brains = results.get_documents(sort_by=sort_by, start=start,
+                                       size=batch_size)
+        if not brains:
+            break
+        for brain in brains:
+            yield brain
+        start += batch_size
+
+
+def iter_products(shop, query=None, batch_size=100):
+    """Yield (product brain, declinations brains) for the products of the
+    shop matching the query.
+    The declinations are searched with only one query by batch of
+    products.
+    """
+    root = shop.get_root()
+    site_root = str(shop.get_site_root().get_abspath())
+    products_query = [PhraseQuery('format', shop.product_class.class_id),
+                      PhraseQuery('parent_paths', site_root)]
+    if query is not None:
+        products_query.append(query)
+    products = iter_brains(root, AndQuery(*products_query),
+                           batch_size=batch_size)
+    while True:
+        batch = []
+        for brain in products:
+            batch.append(brain)
+            if len(batch) == batch_size:
+                break
+        if not batch:
+            break
+        # Get the declinations of the batch
+        declinations = {}
+        query = AndQuery(PhraseQuery('format', 'product-declination'),
+                   OrQuery(*[ PhraseQuery('parent_paths', x.abspath)
+                              for x in batch ]))
+        for brain in root.search(query).get_documents(sort_by='abspath'):
+            parent_path = brain.abspath.rsplit('/', 1)[0]
+            declinations.setdefault(parent_path, []).append(brain)
+        for brain in batch:
+            yield brain, declinations.get(brain.abspath, [])
+
+
+def get_brain_price(brain, declination, prefix, with_tax, has_tax):
+    """Return the price of the declination computed from the values stored
+    in the catalog (see Product.get_viewbox_prices and the price impacts
+    of the declination), or None if they are missing.
+    """
+    viewbox_prices = getattr(brain, 'viewbox_prices', None)
+    price_impacts = getattr(declination, 'price_impacts', None)
+    if not viewbox_prices or not price_impacts:
+        return None
+    prices = loads(viewbox_prices).get(prefix)
+    impact = loads(price_impacts).get(prefix)
+    if prices is None or impact is None:
+        return None
+    without_tax, before_reduction, has_reduction, tax = prices
+    price = decimal(without_tax) + decimal(impact)
+    if with_tax and has_tax:
+        price = price * (decimal(tax) / decimal(100) + 1)
+    return price
+
+
+def get_catalog_rows(shop, groups, query=None, batch_size=100):
+    """Yield a row by declination:
+      reference, declination name, declination title, stock,
+      one price by group (with or without tax)
+    The prices are computed from the catalog, only the products indexed
+    before the catalog had the prices are loaded.
+    """
+    root = shop.get_root()
+    prices = get_prices_cache()
+    # The tax depends on the zone
+    zones = shop.get_resource('countries-zones').handler
+    zone_record = zones.get_record(prices.get_id_zone(shop))
+    has_tax = zones.get_record_value(zone_record, 'has_tax') is True
+    for brain, declinations in iter_products(shop, query, batch_size):
+        # XXX We do not export product without declination
+        if not declinations:
+            continue
+        product = None
+        for d in declinations:
+            row = [brain.reference,
+                   d.name,
+                   (d.declination_title or u'').encode('utf-8'),
+                   str(d.stock_quantity)]
+            # Price by group (HT or TTC)
+            for group in groups:
+                prefix = group.get_prefix()
+                with_tax = not group.get_property('show_ht_price')
+                price = get_brain_price(brain, d, prefix, with_tax, has_tax)
+                if price is not None:
+                    row.append(format_price(price).encode('utf-8'))
+                    continue
+                # Not indexed since the catalog has the prices
+                if product is None:
+                    product = root.get_resource(brain.abspath)
+                k_price = {'id_declination': d.name,
+                           'prefix': prefix,
+                           'pretty': True}
+                if with_tax:
+                    price = product.get_price_with_tax(**k_price)
+                else:
+                    price = product.get_price_without_tax(**k_price)
+                row.append(price.encode('utf-8'))
+            yield row
+        # Keep the memory bounded
+        if product is not None:
+            prices.invalidate(product)
+
+
+def write_catalog_csv(shop, groups, file, batch_size=100):
+    """Write the catalog into the given file, one product model after the
+    other (the first column is the name of the product model).
+    Rows are written as soon as they are computed.
+    """
+    csv = writer(file)
+    for product_model in shop.get_resource('products-models').get_resources():
+        query = PhraseQuery('product_model', str(product_model.get_abspath()))
+        for row in get_catalog_rows(shop, groups, query, batch_size):
+            csv.writerow([product_model.name] + row)
+
+
+
+#######################################################################
+# ODS (lpod builds the whole document in memory, the content is written
+# here row by row into a temporary file, then compressed)
+#######################################################################
+ods_mimetype = 'application/vnd.oasis.opendocument.spreadsheet'
+
+ods_manifest = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<manifest:manifest xmlns:manifest='
+    '"urn:oasis:names:tc:opendocument:xmlns:manifest:1.0">'
+    '<manifest:file-entry manifest:media-type="%s" '
+    'manifest:full-path="/"/>'
+    '<manifest:file-entry manifest:media-type="text/xml" '
+    'manifest:full-path="content.xml"/>'
+    '</manifest:manifest>') % ods_mimetype
+
+ods_content_start = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<office:document-content'
+    ' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+    ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+    ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+    ' office:version="1.1">'
+    '<office:body><office:spreadsheet>')
+
+ods_content_end = (
+    '</office:spreadsheet></office:body></office:document-content>')
+
+ods_cell = ('<table:table-cell office:value-type="string"><text:p>%s'
+            '</text:p></table:table-cell>')
+
+
+def write_catalog_ods(shop, groups, file, batch_size=100):
+    """Write the catalog as an ODS document into the given file, one table
+    by product model (as the CSV, without the first column).
+    """
+    fd, content_path = mkstemp()
+    try:
+        content = fdopen(fd, 'w')
+        try:
+            content.write(ods_content_start)
+            models = shop.get_resource('products-models').get_resources()
+            for product_model in models:
+                content.write('<table:table table:name=%s>'
+                              % quoteattr(product_model.name))
+                query = PhraseQuery('product_model',
+                                    str(product_model.get_abspath()))
+                for row in get_catalog_rows(shop, groups, query, batch_size):
+                    cells = [ ods_cell % escape(x) for x in row ]
+                    content.write('<table:table-row>%s</table:table-row>'
+                                  % ''.join(cells))
+                content.write('</table:table>')
+            content.write(ods_content_end)
+        finally:
+            content.close()
+        # The mimetype first, not compressed
+        ods = ZipFile(file, 'w', ZIP_DEFLATED)
+        ods.writestr(ZipInfo('mimetype'), ods_mimetype)
+        ods.writestr('META-INF/manifest.xml', ods_manifest)
+        ods.write(content_path, 'content.xml')
+        ods.close()
+    finally:
+        remove(content_path)
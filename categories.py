@@ -20,7 +20,7 @@ from itools.core import merge_dicts
 from itools.datatypes import Integer, Unicode
 from itools.gettext import MSG
 from itools.web import get_context
-from itools.xapian import AndQuery, NotQuery, PhraseQuery
+from itools.xapian import AndQuery, PhraseQuery
 from itools.xml import xml_to_text
 
 # Import from ikaaro
@@ -32,12 +32,15 @@ from ikaaro.registry import get_register_fields
 from itws.views import AutomaticEditView
 
 # Import from shop
+from autocomplete import get_autocomplete_index_if_built
+from categories_tree import invalidate_categories_tree
 from categories_views import Category_View, Category_BackofficeView
 from categories_views import Category_Comparator, Category_BatchEdition
 from categories_views import NewCategory_Form
 from csv_views import Export
 from datatypes import ImagePathDataType
 from folder import ShopFolder
+from products_counts import get_products_counts
 from utils import get_group_name, get_shop
 from products import Product
 from products.product_views import Product_NewProduct, Products_View
@@ -112,6 +115,12 @@ class Category(ShopFolder):
         data = self.get_property('data')
         if data is not None:
             data = xml_to_text(data)
+        # The tree of categories has to be rebuilt
+        invalidate_categories_tree(self)
+        # Update the autocomplete index
+        index = get_autocomplete_index_if_built(self)
+        if index is not None:
+            index.update_category(self)
         return merge_dicts(
             super(Category, self)._get_catalog_values(),
             data=data,
@@ -121,6 +130,13 @@ class Category(ShopFolder):
             m_breadcrumb_title=m_breadcrumb_title)
 
 
+    def _on_move_resource(self, source):
+        ShopFolder._on_move_resource(self, source)
+        index = get_autocomplete_index_if_built(self)
+        if index is not None:
+            index.remove_path(source)
+
+
     def get_document_types(self):
         return [Product, Category]
 
@@ -131,18 +147,14 @@ class Category(ShopFolder):
                        'nb_categories': Integer(title=MSG(u'Nb sub categories'))}
 
     def get_nb_products(self, only_public=False):
-        root = self.get_root()
         shop = get_shop(self)
-        abspath = self.get_canonical_path()
-        query = [PhraseQuery('parent_paths', str(abspath)),
-                 PhraseQuery('format', shop.product_class.class_id)]
+        group_name = None
         if shop.get_property('hide_not_buyable_products') is True:
             context = get_context()
             group_name = get_group_name(shop, context)
-            query.append(NotQuery(PhraseQuery('not_buyable_by_groups', group_name)))
-        if only_public is True:
-            query.append(PhraseQuery('workflow_state', 'public'))
-        return len(root.search(AndQuery(*query)))
+        counts = get_products_counts(shop)
+        return counts.get_nb_products(self.get_canonical_path(),
+                                      only_public, group_name)
 
 
     def get_nb_categories(self):
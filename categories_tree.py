@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from itools
+from itools.uri import Path
+from itools.web import select_language
+from itools.xapian import AndQuery, PhraseQuery
+
+
+class CategoriesTree(object):
+    """
+    The tree of the categories of a website, built from the catalog:
+      - categories: list of categories sorted by abspath
+      - children: {parent abspath: [categories]}
+    Each category is a dict with the keys:
+      abspath, name, level, m_title, m_breadcrumb_title
+    (titles are stored by language, see get_title)
+    The number of products are not stored in the tree
+    (see products_counts).
+    """
+
+    def __init__(self, site_root):
+        root = site_root.get_root()
+        languages = site_root.get_property('website_languages')
+        categories_abspath = site_root.get_abspath().resolve2('categories')
+        self.categories_abspath = str(categories_abspath)
+        self.categories = []
+        self.children = {}
+        query = AndQuery(PhraseQuery('parent_paths', self.categories_abspath),
+                         PhraseQuery('format', 'category'))
+        results = root.search(query)
+        for brain in results.get_documents(sort_by='abspath'):
+            abspath = brain.abspath
+            category = {'abspath': abspath,
+                        'name': brain.name,
+                        'level': abspath.count('/'),
+                        'm_title': {},
+                        'm_breadcrumb_title': {}}
+            for key in ['m_title', 'm_breadcrumb_title']:
+                for language in languages:
+                    try:
+                        value = getattr(brain, '%s_%s' % (key, language))
+                    except AttributeError:
+                        continue
+                    if value:
+                        category[key][language] = value
+            self.categories.append(category)
+            parent = str(Path(abspath).resolve2('..'))
+            self.children.setdefault(parent, []).append(category)
+
+
+    def get_title(self, category, key='m_title'):
+        """Language negotiation (as done by the catalog brains).
+        """
+        values = category[key]
+        if not values:
+            return None
+        languages = values.keys()
+        language = select_language(languages) or languages[0]
+        return values[language]
+
+
+    def get_first_category(self):
+        if self.categories:
+            return self.categories[0]
+        return None
+
+
+    def get_branch(self, abspath):
+        """Return the categories which are the children of "abspath" or
+        of one of its ancestors (sorted by abspath).
+        """
+        abspath = Path(abspath)
+        categories_abspath = self.categories_abspath
+        branch = []
+        for i in range(len(abspath) + 1):
+            path = str(abspath[:i])
+            if (path != categories_abspath and
+                not path.startswith(categories_abspath + '/')):
+                continue
+            branch.extend(self.children.get(path, []))
+        branch.sort(key=lambda x: x['abspath'])
+        return branch
+
+
+
+# {site root abspath: CategoriesTree}
+categories_trees = {}
+
+def get_categories_tree(site_root):
+    key = str(site_root.get_abspath())
+    tree = categories_trees.get(key)
+    if tree is None:
+        tree = categories_trees[key] = CategoriesTree(site_root)
+    return tree
+
+
+def invalidate_categories_tree(resource):
+    key = str(resource.get_site_root().get_abspath())
+    categories_trees.pop(key, None)
@@ -118,11 +118,21 @@ class Category_View(BrowseFormBatchNumeric):
         else:
             namespace['photo'] = None
         # Get products view box
+        categories = {}
         for item_resource in items:
             # XXX Hack for cross selling
             # Cross selling return only resource not brain
             if type(item_resource) is tuple:
                  item_brain, item_resource = item_resource
+                 if item_resource is None:
+                     # Rendered from the catalog (see sort_and_batch)
+                     viewbox = get_shop(resource).product_class.viewbox
+                     box = viewbox.render_brain(resource, item_brain, context,
+                                                categories)
+                     namespace['products'].append({'name': item_brain.name,
+                                                   'abspath': item_brain.abspath,
+                                                   'box': box})
+                     continue
             viewbox = item_resource.viewbox
             namespace['products'].append({'name': item_resource.name,
                                           'abspath': str(item_resource.get_abspath()),
@@ -193,7 +203,8 @@ class Category_View(BrowseFormBatchNumeric):
                 datatype = IntegerRange
             schema['DFT-%s' % key] = datatype
         return merge_dicts({'stored_price': IntegerRange,
-                            'stored_weight': IntegerRange},
+                            'stored_weight': IntegerRange,
+                            'stored_note': IntegerRange},
                            schema)
 
 
@@ -228,6 +239,19 @@ class Category_View(BrowseFormBatchNumeric):
             if reverse:
                 items.reverse()
 
+        # The view boxes can be rendered from the catalog, without loading
+        # the products (the public products can be viewed by everybody)
+        if shop.get_property('categories_viewbox_from_catalog') is True:
+            allowed_items = []
+            for item in items:
+                if getattr(item, 'viewbox_cover', None):
+                    allowed_items.append((item, None))
+                else:
+                    # Not indexed since the catalog has the view box fields
+                    resource = context.root.get_resource(item.abspath)
+                    allowed_items.append((item, resource))
+            return allowed_items
+
         # Access Control (FIXME this should be done before batch)
         user = context.user
         root = context.root
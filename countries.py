@@ -34,6 +34,7 @@ from ikaaro.table_views import Table_AddRecord
 # Import from shop
 from countries_views import Countries_View, CountriesZones_View
 from enumerates import CountriesZonesEnumerate
+from shipping_quotes import invalidate_shipping_quotes
 from utils import get_shop
 
 ###########################################################
@@ -124,6 +125,12 @@ class BaseCountries(BaseTable):
       }
 
 
+    def set_changed(self):
+        BaseTable.set_changed(self)
+        # The shipping prices depend on the zone of the countries
+        invalidate_shipping_quotes()
+
+
 
 class Countries(Table):
 
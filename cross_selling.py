@@ -15,10 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from standard library
-from random import shuffle
+from time import time
 
 # Import from itools
-from itools.core import merge_dicts
+from itools.core import LRUCache, merge_dicts
 from itools.gettext import MSG
 from itools.log import log_warning
 from itools.xapian import OrQuery, AndQuery, PhraseQuery, NotQuery
@@ -33,13 +33,21 @@ from ikaaro.registry import register_resource_class
 from cross_selling_views import AddProduct_View
 from cross_selling_views import CrossSelling_Configure, CrossSelling_TableView
 from cross_selling_views import CrossSelling_Edit, cross_selling_schema
-from utils import get_group_name, get_shop
+from utils import get_group_name, get_random_documents, get_shop
 from forms import ProductSelectorWidget
 from products import Product
 
 
 
 
+# Number of seconds a random selection of products is kept
+CROSS_SELLING_TTL = 60
+
+# {key: (expiration time, products abspaths)}
+# (see CrossSellingTable.get_products)
+cross_selling_selections = LRUCache(500, 600)
+
+
 class CrossSellingTable(ResourcesOrderedTable):
 
     class_id = 'CrossSellingTable'
@@ -160,14 +168,28 @@ class CrossSellingTable(ResourcesOrderedTable):
         # Complete results
         sort = table.get_property('sort')
         if sort == 'random':
-            # Random selection
-            results = root.search(AndQuery(*query))
-            # XXX It's not relevant to make a random cross selling
-            # with more than 1000 products
-            brains = list(results.get_documents(size=1000))
-            shuffle(brains)
-            for brain in brains[:products_quantity]:
-                yield root.get_resource(brain.abspath)
+            # Random selection, kept CROSS_SELLING_TTL seconds by table,
+            # categories and group
+            key = (str(table.get_abspath()), product_format,
+                   tuple(sorted([ str(x.get_abspath()) for x in categories ])),
+                   group_name,
+                   tuple(sorted([ str(x) for x in excluded_products ])),
+                   tuple(names), products_quantity)
+            now = time()
+            if (key in cross_selling_selections and
+                cross_selling_selections[key][0] > now):
+                abspaths = cross_selling_selections[key][1]
+            else:
+                results = root.search(AndQuery(*query))
+                brains = get_random_documents(results, products_quantity)
+                abspaths = [ x.abspath for x in brains ]
+                cross_selling_selections[key] = (now + CROSS_SELLING_TTL,
+                                                 abspaths)
+            for abspath in abspaths:
+                # The product may have been removed since
+                resource = root.get_resource(abspath, soft=True)
+                if resource is not None:
+                    yield resource
         elif sort == 'last':
             results = root.search(AndQuery(*query))
             brains = list(results.get_documents(sort_by='ctime',
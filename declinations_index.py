@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Import from shop
+from transactions import after_abort
+
+
+class DeclinationsIndex(object):
+    """
+    The declinations of a product:
+      - declinations: list of declinations (in the order of the folder)
+      - by_name: {name: declination}
+      - by_options: {(value of option 1, value of option 2...): name}
+    Each declination is a dict with the keys:
+      name, options ({option name: value}), price_impact ({prefix: value}),
+      weight, stock, is_default
+    The index is built once, then it is dropped when a declination or
+    the product changes. The JSON of the declinations (for the product
+    view) is kept with the index (see Product.get_javascript_cache).
+    """
+
+    def __init__(self, product):
+        from products.declination import Declination, declination_schema
+        self.purchase_options_names = product.get_purchase_options_names()
+        self.declinations = []
+        self.by_name = {}
+        self.by_options = {}
+        self.javascript = {}
+        impact_keys = [ x for x in declination_schema
+                        if x.endswith('impact_on_price') ]
+        for declination in product.search_resources(cls=Declination):
+            dynamic_schema = declination.get_dynamic_schema()
+            options = {}
+            for name in self.purchase_options_names:
+                value = declination.get_dynamic_property(name, dynamic_schema)
+                if value:
+                    options[name] = value
+            price_impact = {}
+            for key in impact_keys:
+                prefix = key[:-len('impact_on_price')]
+                price_impact[prefix] = declination.get_property(key)
+            kw = {'name': declination.name,
+                  'options': options,
+                  'price_impact': price_impact,
+                  'weight': declination.get_weight(),
+                  'stock': declination.get_quantity_in_stock(),
+                  'is_default': declination.get_property('is_default')}
+            self.declinations.append(kw)
+            self.by_name[declination.name] = kw
+            # The first declination wins
+            key = self.get_options_key(options)
+            self.by_options.setdefault(key, declination.name)
+
+
+    def get_options_key(self, options):
+        return tuple([ options.get(x) or None
+                       for x in self.purchase_options_names ])
+
+
+    def get_declination(self, options):
+        return self.by_options.get(self.get_options_key(options))
+
+
+
+# {product abspath: DeclinationsIndex}
+declinations_indexes = {}
+
+def get_declinations_index(product):
+    key = str(product.get_abspath())
+    index = declinations_indexes.get(key)
+    # The purchase options are defined by the product model
+    if (index is None or
+        index.purchase_options_names != product.get_purchase_options_names()):
+        index = declinations_indexes[key] = DeclinationsIndex(product)
+    return index
+
+
+def get_declinations_index_if_built(product):
+    """To use the index only if it has been built (not to rebuild it for
+    each declination during a reindex).
+    """
+    return declinations_indexes.get(str(product.get_abspath()))
+
+
+def invalidate_declinations_index(abspath):
+    """Drop the index of the product, and again if the transaction is
+    aborted (it may have been built meanwhile from the changes).
+    """
+    abspath = str(abspath)
+    declinations_indexes.pop(abspath, None)
+    after_abort(declinations_indexes.pop, abspath, None)
@@ -20,7 +20,7 @@ from itools.datatypes import Enumerate, String, Unicode, Integer
 from itools.gettext import MSG
 from itools.handlers import checkid
 from itools.xapian import OrQuery, PhraseQuery
-from itools.web import get_context, INFO, ERROR
+from itools.web import get_context, select_language, INFO, ERROR
 
 # Import from ikaaro
 from ikaaro.buttons import RemoveButton
@@ -180,63 +180,56 @@ class Restricted_EnumerateTable_to_Enumerate(Enumerate):
 class EnumerateTable_to_Enumerate(Enumerate):
 
     @classmethod
-    def get_kw(cls, table, record):
-        get_value = table.handler.get_record_value
-        kw = {'name': str(get_value(record, 'name')),
-              'value': get_value(record, 'title')}
-        for key in table.additional_enumerate_keys:
-            kw[key] = get_value(record, key)
-        return kw
+    def get_table(cls):
+        here = get_context().resource
+        # XXX Hack for icms-update (context.resource is None)
+        if here is None:
+            return None
+        shop = get_shop(here)
+        return shop.get_resource('enumerates/%s' % cls.enumerate_name)
+
 
     @classmethod
     def get_title(cls):
-        shop = get_shop(get_context().resource)
-        enumerates_folder = shop.get_resource('enumerates')
-        table = enumerates_folder.get_resource(cls.enumerate_name)
-        return table.get_title()
+        return cls.get_table().get_title()
 
 
     @classmethod
     def get_options(cls):
-        shop = get_shop(get_context().resource)
-        enumerates_folder = shop.get_resource('enumerates')
-        table = enumerates_folder.get_resource(cls.enumerate_name)
-        return [cls.get_kw(table, record)
-                for record in table.handler.get_records_in_order()]
+        table = cls.get_table()
+        index = table.handler.get_index(table.additional_enumerate_keys)
+        # Options are shared, give a copy
+        return [ x.copy() for x in index.get_options() ]
+
 
     @classmethod
     def get_value(cls, name, default=None):
         if name is None:
             return None
-        here = get_context().resource
-        # XXX Hack for icms-update (context.resource is None)
-        if here is None:
+        table = cls.get_table()
+        if table is None:
             return None
-        shop = get_shop(here)
-        table = shop.get_resource('enumerates/%s' % cls.enumerate_name)
-        records = table.handler.search(name=name)
-        if len(records) == 0:
+        index = table.handler.get_index(table.additional_enumerate_keys)
+        record = index.records.get(name)
+        if record is None:
             # XXX Should not happen
             # Enumerate has been deleted
             return None
-        record = records[0]
-        return cls.get_kw(table, record)['value']
+        return index.get_title(record)
 
 
     @classmethod
     def to_text(cls, name, languages):
-        here = get_context().resource
-        # XXX Hack for icms-update (context.resource is None)
-        if here is None:
-            return None
         if name is None:
             return None
-        shop = get_shop(here)
-        enumerates_folder = shop.get_resource('enumerates')
-        table = enumerates_folder.get_resource(cls.enumerate_name)
-        record = table.handler.search(name=name)[0]
-        values = [table.handler.get_record_value(record, 'title', lang) for lang
-                    in languages]
+        table = cls.get_table()
+        if table is None:
+            return None
+        index = table.handler.get_index(table.additional_enumerate_keys)
+        record = index.records.get(name)
+        if record is None:
+            return None
+        values = [ record['titles'].get(x, u'') for x in languages ]
         return u' '.join(values)
 
 
@@ -339,6 +332,62 @@ class EnumeratesFolder_View(Folder_BrowseContent):
             item, column)
 
 
+class EnumerateTable_Index(object):
+    """
+    The records of an enumerate table by name:
+      {name: {'name': ..., 'titles': {language: title}, ...}}
+    (with the additional enumerate keys of the table).
+    The options are computed once by negotiated languages.
+    """
+
+    def __init__(self, handler, additional_keys):
+        get_value = handler.get_record_value
+        self.records = {}
+        self.ordered_records = []
+        self.languages = set()
+        self.options = {}
+        for record in handler.get_records_in_order():
+            titles = {}
+            for title in record.get_property('title') or []:
+                if title.value:
+                    titles[title.parameters['language']] = title.value
+            name = str(get_value(record, 'name'))
+            kw = {'name': name,
+                  'titles': titles,
+                  'languages': tuple(sorted(titles))}
+            for key in additional_keys:
+                kw[key] = get_value(record, key)
+            self.records[name] = kw
+            self.ordered_records.append(kw)
+            self.languages.add(kw['languages'])
+
+
+    def get_title(self, record):
+        """Language negotiation (as done by get_record_value).
+        """
+        languages = record['languages']
+        if not languages:
+            return u''
+        language = select_language(languages) or languages[0]
+        return record['titles'][language]
+
+
+    def get_options(self):
+        # The options depend only on the negotiated languages
+        key = tuple([ select_language(x) for x in sorted(self.languages) ])
+        options = self.options.get(key)
+        if options is None:
+            options = []
+            for record in self.ordered_records:
+                option = dict(record, value=self.get_title(record))
+                del option['titles']
+                del option['languages']
+                options.append(option)
+            self.options[key] = options
+        return options
+
+
+
 class EnumerateTable_Handler(OrderedTableFile):
 
     record_properties = {
@@ -346,6 +395,26 @@ class EnumerateTable_Handler(OrderedTableFile):
         'title': Unicode(mandatory=True, multiple=True),
         }
 
+    # Index of the records (see get_index)
+    index = None
+
+
+    def reset(self):
+        OrderedTableFile.reset(self)
+        self.index = None
+
+
+    def set_changed(self):
+        OrderedTableFile.set_changed(self)
+        # The records have changed, the index must be built again
+        self.index = None
+
+
+    def get_index(self, additional_keys):
+        if self.index is None:
+            self.index = EnumerateTable_Index(self, additional_keys)
+        return self.index
+
 
 
 class EnumerateTable(OrderedTable):
@@ -374,7 +443,7 @@ class EnumerateTable(OrderedTable):
 ## Enumerate Table Color
 ####################################
 
-class EnumerateTableColor_Handler(OrderedTableFile):
+class EnumerateTableColor_Handler(EnumerateTable_Handler):
 
     record_properties = {
         'name': String(unique=True, is_indexed=True),
@@ -90,6 +90,8 @@ class SortBy_Enumerate(Enumerate):
       {'name': 'mtime', 'value': MSG(u'Modification date')},
       {'name': 'ctime', 'value': MSG(u'Creation date')},
       {'name': 'stored_price', 'value': MSG(u'Price')},
+      {'name': 'stored_note', 'value': MSG(u'Rating')},
+      {'name': 'nb_reviews', 'value': MSG(u'Number of reviews')},
       {'name': 'abspath', 'value': MSG(u'Regroup by category')}]
 
 
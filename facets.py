@@ -0,0 +1,150 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# Count the number of documents matching a list of facets (filters)
+# with only one catalog search by base query.
+#
+# XXX We use the xapian database of the catalog directly
+#######################################################################
+
+# Import from xapian
+from xapian import Enquire
+
+# Import from itools
+from itools.xapian import AndQuery, PhraseQuery, RangeQuery
+from itools.xapian.utils import _decode, _get_field_cls
+
+# Import from shop
+from utils import get_catalog_revision
+
+
+# Cache: {key: (catalog revision, counts)}
+facets_cache = {}
+facets_cache_size = 500
+
+
+class FacetsCounter(object):
+    """
+    Given a base query, count for each facet query the number of documents
+    matching (base query AND facet query).
+    The documents matching the base query are computed once, then:
+      - PhraseQuery facets (one term) are counted by intersecting the
+        posting list of the term with the matched documents,
+      - RangeQuery facets are counted with the stored values of the
+        matched documents,
+      - Other facets fall back on a catalog search.
+    """
+
+    def __init__(self, context, query):
+        self.context = context
+        self.root = context.root
+        self.query = query
+        self.catalog = context.database.catalog
+        self._docids = None
+        self._values = {}
+
+
+    def get_docids(self):
+        if self._docids is None:
+            catalog = self.catalog
+            enquire = Enquire(catalog._db)
+            enquire.set_query(catalog._query2xquery(self.query))
+            size = enquire.get_mset(0, 0).get_matches_upper_bound()
+            self._mset = enquire.get_mset(0, size)
+            self._docids = set([ x.docid for x in self._mset ])
+        return self._docids
+
+
+    def get_values(self, name):
+        """Return the list of stored values of field "name" for the
+        documents matching the base query.
+        """
+        if name not in self._values:
+            self.get_docids()
+            catalog = self.catalog
+            info = catalog._metadata[name]
+            field_cls = _get_field_cls(name, catalog._fields, info)
+            slot = info['value']
+            values = []
+            for x in self._mset:
+                data = x.document.get_value(slot)
+                values.append(_decode(field_cls, data) if data else None)
+            self._values[name] = values
+        return self._values[name]
+
+
+    def count(self, query):
+        # No facet query, all the documents
+        if query is None:
+            return len(self.get_docids())
+        metadata = self.catalog._metadata
+        query_class = query.__class__
+        # Field never indexed => Nothing
+        if (query_class in (PhraseQuery, RangeQuery) and
+            query.name not in metadata):
+            return 0
+        if query_class is PhraseQuery:
+            xquery = self.catalog._query2xquery(query)
+            terms = [ x for x in xquery ]
+            if len(terms) == 1:
+                docids = self.get_docids()
+                db = self.catalog._db
+                n = 0
+                for posting in db.postlist(terms[0]):
+                    if posting.docid in docids:
+                        n += 1
+                return n
+        elif query_class is RangeQuery and 'value' in metadata[query.name]:
+            left, right = query.left, query.right
+            n = 0
+            for value in self.get_values(query.name):
+                if left is None and right is None:
+                    n += 1
+                elif value is None:
+                    continue
+                elif ((left is None or value >= left) and
+                      (right is None or value <= right)):
+                    n += 1
+            return n
+        # Fallback
+        return len(self.root.search(AndQuery(self.query, query)))
+
+
+
+def count_facets(context, base_query, facets):
+    """facets is a list of queries (or None for "all").
+    Return the list of number of documents matching base query and
+    each facet. Results are cached until the catalog changes.
+    """
+    revision = get_catalog_revision(context)
+    key = (repr(base_query), tuple([ repr(x) for x in facets ]))
+    cached = facets_cache.get(key)
+    if cached is not None and cached[0] == revision:
+        return cached[1]
+    # The documents matching a base query are shared during the request
+    counters = getattr(context, '_facets_counters', None)
+    if counters is None:
+        counters = context._facets_counters = {}
+    counter = counters.get(key[0])
+    if counter is None:
+        counter = counters[key[0]] = FacetsCounter(context, base_query)
+    counts = [ counter.count(x) for x in facets ]
+    # Store
+    if len(facets_cache) >= facets_cache_size:
+        facets_cache.clear()
+    facets_cache[key] = (revision, counts)
+    return counts
@@ -35,7 +35,12 @@ from ikaaro.webpage import _get_links, _change_link
 from itws.tags import TagsAware
 
 # Import from shop
+from autocomplete import get_autocomplete_index_if_built
+from categories_tree import invalidate_categories_tree
 from datatypes import AbsolutePathDataTypeEnumerate
+from declinations_index import invalidate_declinations_index
+from product_search import get_product_search_index_if_built
+from products_counts import get_products_counts_if_built
 from utils import get_parent_paths
 
 
@@ -59,6 +64,29 @@ class ShopFolder(Folder):
                 parent_paths=get_parent_paths(self.get_abspath()))
 
 
+    def del_resource(self, name, soft=False):
+        resource = self.get_resource(name, soft=soft)
+        if resource is not None:
+            # Products are removed from the number of products by category
+            counts = get_products_counts_if_built(self)
+            if counts is not None:
+                counts.remove_path(resource.get_abspath())
+            # And from the search index
+            index = get_product_search_index_if_built(self)
+            if index is not None:
+                index.remove_path(resource.get_abspath())
+            # And from the autocomplete index
+            index = get_autocomplete_index_if_built(self)
+            if index is not None:
+                index.remove_path(resource.get_abspath())
+            # The tree of categories may change
+            invalidate_categories_tree(self)
+            # The declinations of a product may change
+            invalidate_declinations_index(self.get_abspath())
+            invalidate_declinations_index(resource.get_abspath())
+        return Folder.del_resource(self, name, soft=soft)
+
+
     def get_links(self):
         links = Folder.get_links(self)
         # General informations
@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# The in-memory indexes of the shop (products search, autocomplete) are
+# built from the resources themselves, which takes minutes on a large
+# catalog. They are never built inside a request: the server starts to
+# build them when it starts (or the first time they are asked for), by
+# batches of resources, in its idle time. Until an index is built the
+# views fall back to the catalog.
+#######################################################################
+
+# Import from standard library
+from time import time
+from traceback import format_exc
+
+# Import from gobject
+from gobject import idle_add
+
+# Import from itools
+from itools.log import log_error, log_info
+from itools.web import del_context, get_context
+from itools.xapian import AndQuery, PhraseQuery
+
+# Import from ikaaro
+from ikaaro.server import Server, get_fake_context
+
+
+class BackgroundIndex(object):
+    """Base class of the in-memory indexes of the resources of a site
+    root. Once built (or while it is built), the index is updated each
+    time one of its resources is indexed, moved or deleted.
+    """
+
+    # The number of resources indexed by idle callback
+    batch_size = 50
+
+    def __init__(self):
+        self.is_built = False
+        self.is_building = False
+        # The abspaths of the resources still to index, while building
+        self.pending = None
+
+
+    def get_formats(self, shop):
+        """The formats of the resources to index.
+        """
+        return [shop.product_class.class_id]
+
+
+    def index_resource(self, resource):
+        raise NotImplementedError
+
+
+    def get_abspaths(self, shop):
+        root = shop.get_root()
+        site_root = str(shop.get_site_root().get_abspath())
+        abspaths = []
+        for format in self.get_formats(shop):
+            query = AndQuery(PhraseQuery('format', format),
+                             PhraseQuery('parent_paths', site_root))
+            documents = root.search(query).get_documents(sort_by='abspath')
+            abspaths.extend([ x.abspath for x in documents ])
+        # Indexed in order (popped from the end)
+        abspaths.reverse()
+        return abspaths
+
+
+    def index_batch(self, root, size):
+        pending = self.pending
+        for i in range(min(size, len(pending))):
+            # The resource may have been removed meanwhile
+            resource = root.get_resource(pending.pop(), soft=True)
+            if resource is not None:
+                self.index_resource(resource)
+
+
+    def end_rebuild(self):
+        self.pending = None
+        self.is_building = False
+        self.is_built = True
+
+
+    def rebuild(self, shop):
+        """Build the index at once (see scripts/shop-search-benchmark.py).
+        """
+        self.__init__()
+        self.is_building = True
+        self.pending = self.get_abspaths(shop)
+        self.index_batch(shop.get_root(), len(self.pending))
+        self.end_rebuild()
+
+
+    def start_rebuild(self, server, site_root):
+        """Build the index of the given site root (abspath) in the idle
+        time of the server.
+        """
+        self.__init__()
+        self.is_building = True
+        idle_add(self.rebuild_callback, server, site_root, time())
+
+
+    def rebuild_callback(self, server, site_root, t0):
+        context = get_fake_context()
+        server.init_context(context)
+        try:
+            root = context.root
+            if self.pending is None:
+                # First the resources to index
+                shop = root.get_resource(site_root).get_resource('shop')
+                self.pending = self.get_abspaths(shop)
+                return True
+            self.index_batch(root, self.batch_size)
+            if self.pending:
+                return True
+            self.end_rebuild()
+            log_info('%s of %s built in %.2fs' % (self.__class__.__name__,
+                     site_root, time() - t0), domain='shop')
+        except Exception:
+            log_error('%s of %s not built:\n%s' % (self.__class__.__name__,
+                      site_root, format_exc()), domain='shop')
+            # Started again the next time it is needed
+            self.__init__()
+        finally:
+            del_context()
+        return False
+
+
+
+# [(indexes, index class)], the indexes of the shops to build when the
+# server starts
+registered_indexes = []
+
+def register_index(indexes, cls):
+    registered_indexes.append((indexes, cls))
+
+
+def get_index(indexes, cls, shop):
+    """Return the index of the site root of the shop, or None if it is not
+    built yet (then it is started to be built).
+    """
+    site_root = str(shop.get_site_root().get_abspath())
+    index = indexes.get(site_root)
+    if index is None:
+        index = indexes[site_root] = cls()
+    if index.is_built is False:
+        if index.is_building is False:
+            index.start_rebuild(get_context().server, site_root)
+        return None
+    return index
+
+
+def get_index_if_built(indexes, resource):
+    """To update the index only if it is built (or being built).
+    """
+    site_root = str(resource.get_site_root().get_abspath())
+    index = indexes.get(site_root)
+    if index is None:
+        return None
+    if index.is_built is False and index.is_building is False:
+        return None
+    return index
+
+
+
+#######################################################################
+# Hook into the ikaaro server (see shop/__init__)
+#######################################################################
+def start_indexes(server):
+    context = get_fake_context()
+    server.init_context(context)
+    try:
+        root = context.root
+        for brain in root.search(format='shop').get_documents():
+            shop = root.get_resource(brain.abspath)
+            for indexes, cls in registered_indexes:
+                get_index(indexes, cls, shop)
+    except Exception:
+        log_error('Search indexes not started:\n%s' % format_exc(),
+                  domain='shop')
+    finally:
+        del_context()
+    return False
+
+
+Server_start = Server.start
+
+def start(self):
+    idle_add(start_indexes, self)
+    Server_start(self)
@@ -0,0 +1,374 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# The artefacts of the orders (PDF, barcode) and the exports of the
+# catalog are not generated during the request: a job is written into
+# the jobs queue of the instance once the transaction is committed, then
+# it is run by the pool of processes of the "shop-jobs.py" worker. The
+# jobs are pickled, so their arguments must be plain data (no XMLParser,
+# no MSG...).
+#
+# A job is a file named (as the messages of the outbox):
+#   <time of the next try>_<number of tries>_<id>
+# The artefacts are stored into the "artefacts" folder of the instance,
+# while an artefact is generated there is a "<artefact>.pending" file,
+# and a "<artefact>.failed" file if it cannot be generated.
+#######################################################################
+
+# Import from standard library
+from cPickle import dumps, load
+from email import message_from_string
+from email.mime.application import MIMEApplication
+from os import fdopen, listdir, makedirs, remove, rename
+from os.path import dirname, exists, join
+from tempfile import mkstemp
+from time import time
+from traceback import format_exc
+
+# Import from itools
+from itools.gettext import MSG
+from itools.log import log_error, log_info
+from itools.web import get_context
+
+# Import from shop
+from outbox import get_outbox
+from transactions import after_commit
+
+
+# Retry: the delay is doubled after each try (1 minute, 2 minutes, ...)
+JOB_RETRY_DELAY = 60
+JOB_MAX_TRIES = 5
+
+
+#######################################################################
+# Jobs (run by the processes of the pool)
+#######################################################################
+def make_barcode(format, code):
+    from utils import generate_barcode
+    barcode = generate_barcode(format, code)
+    if barcode is None:
+        raise ValueError, 'the barcode "%s" cannot be generated' % code
+    return barcode
+
+
+def make_barcodes(target, format, codes):
+    from barcodes import make_barcodes
+    return make_barcodes(target, format, codes)
+
+
+def make_pdf(template, namespace):
+    from itools.handlers import ro_database
+    from itools.pdf import stl_pmltopdf
+    from itools.xml import XMLFile
+    from utils import format_for_pdf
+    # The signature is given as text (see Order.get_pdf_namespace)
+    if namespace.get('pdf_signature') is not None:
+        namespace['pdf_signature'] = format_for_pdf(namespace['pdf_signature'])
+    # The barcode may have not been generated
+    barcode = namespace.get('order_barcode')
+    if barcode and not exists(barcode):
+        namespace['order_barcode'] = None
+    document = ro_database.get_handler(template, XMLFile)
+    return stl_pmltopdf(document, namespace=namespace)
+
+
+def export_catalog(target, shop, groups, format, path):
+    """Write the catalog of the shop (abspath) with the prices of the
+    groups (abspaths) into the file at the given path, as "csv" or "ods".
+    The database of the instance is opened read-only. The file is written
+    here (the job returns nothing), so it is never held in memory.
+    """
+    from ikaaro.server import Server, get_fake_context
+    from catalog_export import write_catalog_csv, write_catalog_ods
+    server = Server(target, read_only=True)
+    context = get_fake_context()
+    server.init_context(context)
+    root = server.root
+    shop = context.resource = root.get_resource(shop)
+    groups = [ root.get_resource(x) for x in groups ]
+    write = {'csv': write_catalog_csv, 'ods': write_catalog_ods}[format]
+    tmp_path = path + '.tmp'
+    file = open(tmp_path, 'w')
+    try:
+        write(shop, groups, file)
+    finally:
+        file.close()
+    rename(tmp_path, path)
+
+
+job_functions = {
+    'barcode': make_barcode,
+    'barcodes': make_barcodes,
+    'catalog': export_catalog,
+    'pdf': make_pdf}
+
+
+def run_job(job):
+    try:
+        return True, job_functions[job['kind']](*job['args'])
+    except Exception:
+        return False, format_exc()
+
+
+def translate_namespace(value):
+    """Return the namespace with the messages translated (the worker has
+    no context to translate them).
+    """
+    if isinstance(value, MSG):
+        return value.gettext()
+    elif isinstance(value, dict):
+        return dict([ (x, translate_namespace(y))
+                      for x, y in value.iteritems() ])
+    elif isinstance(value, list):
+        return [ translate_namespace(x) for x in value ]
+    return value
+
+
+
+#######################################################################
+# Queue
+#######################################################################
+class JobQueue(object):
+
+    def __init__(self, target):
+        self.target = target
+        self.path = join(target, 'jobs')
+        self.tmp_path = join(self.path, 'tmp')
+        self.failed_path = join(self.path, 'failed')
+        self.artefacts_path = join(target, 'artefacts')
+        for path in [self.tmp_path, self.failed_path, self.artefacts_path]:
+            if not exists(path):
+                makedirs(path)
+
+
+    def _write(self, path, data):
+        """Write the file at once (through a temporary file).
+        """
+        fd, tmp_path = mkstemp(dir=self.tmp_path)
+        file = fdopen(fd, 'w')
+        try:
+            file.write(data)
+        finally:
+            file.close()
+        folder = dirname(path)
+        if not exists(folder):
+            makedirs(folder)
+        rename(tmp_path, path)
+
+
+    def _remove(self, path):
+        if exists(path):
+            remove(path)
+
+
+    #######################################################################
+    # Artefacts
+    #######################################################################
+    def get_artefact_path(self, artefact):
+        return join(self.artefacts_path, artefact)
+
+
+    def get_status(self, artefact):
+        """Return 'pending', 'failed', 'done' or None if the artefact is
+        unknown.
+        """
+        # Added to the queue once the transaction is committed
+        context = get_context()
+        if artefact in getattr(context, 'scheduled_artefacts', ()):
+            return 'pending'
+        path = self.get_artefact_path(artefact)
+        if exists(path + '.pending'):
+            return 'pending'
+        elif exists(path + '.failed'):
+            return 'failed'
+        elif exists(path):
+            return 'done'
+        return None
+
+
+    #######################################################################
+    # Jobs
+    #######################################################################
+    def add_job(self, kind, artefact, args, requires=None, emails=None):
+        """Add a job generating the artefact (a path relative to the
+        artefacts folder, or None if the job has no artefact):
+          - kind: 'barcode', 'barcodes', 'catalog' or 'pdf' (see
+            job_functions)
+          - requires: the artefacts to generate before this one
+          - emails: messages (as strings) to send once the artefact is
+            generated (as an attachment)
+        """
+        data = self.dump_job(kind, artefact, args, requires, emails)
+        self._add_job(artefact, data)
+
+
+    def add_job_after_commit(self, kind, artefact, args, requires=None,
+                             emails=None):
+        """Add the job once the transaction is committed. The job is
+        pickled right away, so the errors are raised in the request.
+        """
+        data = self.dump_job(kind, artefact, args, requires, emails)
+        if artefact is not None:
+            context = get_context()
+            if context is not None:
+                if getattr(context, 'scheduled_artefacts', None) is None:
+                    context.scheduled_artefacts = set()
+                context.scheduled_artefacts.add(artefact)
+        after_commit(self._add_job, artefact, data)
+
+
+    def dump_job(self, kind, artefact, args, requires=None, emails=None):
+        job = {'kind': kind,
+               'artefact': artefact,
+               'args': args,
+               'requires': requires or [],
+               'emails': emails or []}
+        return dumps(job, 2)
+
+
+    def _add_job(self, artefact, data):
+        if artefact is not None:
+            path = self.get_artefact_path(artefact)
+            self._write(path + '.pending', '')
+            self._remove(path + '.failed')
+        # Add the job
+        try:
+            fd, tmp_path = mkstemp(dir=self.tmp_path)
+            file = fdopen(fd, 'w')
+            try:
+                file.write(data)
+            finally:
+                file.close()
+        except Exception:
+            if artefact is not None:
+                self._remove(path + '.pending')
+            raise
+        uid = tmp_path.rsplit('/', 1)[-1]
+        rename(tmp_path, join(self.path, '%010d_0_%s' % (time(), uid)))
+
+
+    def get_jobs(self):
+        """Return the jobs of the queue as a list of
+        (name, time of the next try, number of tries), sorted by time.
+        """
+        jobs = []
+        for name in listdir(self.path):
+            try:
+                next_try, tries, uid = name.split('_', 2)
+                jobs.append((name, int(next_try), int(tries)))
+            except ValueError:
+                # The folders "tmp" and "failed"
+                continue
+        jobs.sort(key=lambda x: x[1])
+        return jobs
+
+
+    def get_stats(self):
+        now = time()
+        jobs = self.get_jobs()
+        return {
+            'queued': len(jobs),
+            'ready': len([ x for x in jobs if x[1] <= now ]),
+            'deferred': len([ x for x in jobs if x[2] > 0 ]),
+            'failed': len(listdir(self.failed_path))}
+
+
+    #######################################################################
+    # Run
+    #######################################################################
+    def run(self, pool, batch_size=20):
+        """Run the jobs ready to be run, at most "batch_size" at once with
+        the given pool of processes. Return the number of jobs done.
+        """
+        now = time()
+        names = []
+        jobs = []
+        for name, next_try, tries in self.get_jobs():
+            if len(jobs) == batch_size:
+                break
+            if next_try > now:
+                continue
+            job = load(open(join(self.path, name)))
+            # Wait for the required artefacts
+            statuses = [ self.get_status(x) for x in job['requires'] ]
+            if 'pending' in statuses:
+                continue
+            names.append((name, tries))
+            jobs.append(job)
+        if not jobs:
+            return 0
+        # Run
+        n = 0
+        results = pool.map(run_job, jobs)
+        for (name, tries), job, (success, result) in zip(names, jobs, results):
+            artefact = job['artefact']
+            if artefact is None:
+                path = None
+                artefact = job['kind']
+            else:
+                path = self.get_artefact_path(artefact)
+            if success:
+                # Or written by the job (see export_catalog)
+                if path is not None and result is not None:
+                    self._write(path, result)
+                    self._remove(path + '.pending')
+                remove(join(self.path, name))
+                log_info('Artefact "%s" generated' % artefact)
+                self.send_emails(job['emails'], artefact, result)
+                n += 1
+                continue
+            # Try again later
+            log_error('Artefact "%s" not generated:\n%s' % (artefact, result))
+            tries += 1
+            if tries < JOB_MAX_TRIES:
+                delay = JOB_RETRY_DELAY * 2 ** (tries - 1)
+                uid = name.split('_', 2)[2]
+                target = '%010d_%d_%s' % (now + delay, tries, uid)
+                rename(join(self.path, name), join(self.path, target))
+                continue
+            # Failed (the emails are sent without the artefact)
+            rename(join(self.path, name), join(self.failed_path, name))
+            if path is not None:
+                self._write(path + '.failed', result)
+                self._remove(path + '.pending')
+            self.send_emails(job['emails'])
+        return n
+
+
+    def send_emails(self, emails, artefact=None, data=None):
+        outbox = get_outbox(self.target)
+        for email in emails:
+            message = message_from_string(email)
+            if artefact is not None:
+                filename = artefact.rsplit('/', 1)[-1]
+                subtype = filename.rsplit('.', 1)[-1]
+                attachment = MIMEApplication(data, subtype)
+                attachment.add_header('Content-Disposition', 'attachment',
+                                      filename=filename)
+                message.attach(attachment)
+            outbox.add_message(message)
+
+
+
+# {instance path: JobQueue}
+job_queues = {}
+
+def get_job_queue(target):
+    queue = job_queues.get(target)
+    if queue is None:
+        queue = job_queues[target] = JobQueue(target)
+    return queue
@@ -18,6 +18,8 @@
 from itools.core import merge_dicts
 from itools.datatypes import PathDataType
 from itools.gettext import MSG
+from itools.web import get_context
+from itools.xapian import PhraseQuery
 
 # Import from ikaaro
 from ikaaro.folder import Folder
@@ -27,6 +29,7 @@ from ikaaro.forms import XHTMLBody, ImageSelectorWidget, RTEWidget
 from itws.views import AutomaticEditView
 
 # Import from shop
+from autocomplete import autocomplete_indexes
 from datatypes import DynamicEnumerate
 from manufacturers_views import Manufacturers_View
 from manufacturers_views import Manufacturer_View
@@ -69,6 +72,24 @@ class Manufacturer(Folder):
                            photo=PathDataType)
 
 
+    def _get_catalog_values(self):
+        # Update the title in the autocomplete indexes
+        for index in autocomplete_indexes.itervalues():
+            index.update_manufacturer(self)
+        return Folder._get_catalog_values(self)
+
+
+    def set_property(self, name, value, language=None):
+        Folder.set_property(self, name, value, language=language)
+        # Renamed: reindex its products (see Product_ViewBox)
+        if name == 'title':
+            context = get_context()
+            query = PhraseQuery('manufacturer', str(self.get_abspath()))
+            for brain in context.root.search(query).get_documents():
+                product = context.root.get_resource(brain.abspath)
+                context.database.change_resource(product)
+
+
 
 
 class Manufacturers(Folder):
@@ -81,3 +102,11 @@ class Manufacturers(Folder):
 
     def get_document_types(self):
         return [Manufacturer]
+
+
+    def del_resource(self, name, soft=False):
+        resource = self.get_resource(name, soft=soft)
+        if resource is not None:
+            for index in autocomplete_indexes.itervalues():
+                index.remove_path(resource.get_abspath())
+        return Folder.del_resource(self, name, soft=soft)
@@ -22,8 +22,10 @@ from itools.gettext import MSG
 from itools.web import BaseView, ERROR
 
 # Import from shop
+from shop.catalog_export import iter_products
 from shop.modules import ShopModule
-from shop.products.declination import Declination
+from shop.prices import get_prices_cache
+from shop.utils import get_shop
 
 # Import from lpod
 lpod_is_install = True
@@ -47,7 +49,9 @@ class ShopModule_ExportCatalog_View(BaseView):
         body = document.get_body()
         root = context.root
         table = odf_create_table(u"Table 1", width=5, height=1, style='table-cell')
-        for brain in root.search(format='product').get_documents():
+        shop = get_shop(resource)
+        prices = get_prices_cache()
+        for brain, declinations in iter_products(shop):
             # Get product
             product = root.get_resource(brain.abspath)
             cover = product.get_resource(product.get_property('cover'))
@@ -67,14 +71,15 @@ class ShopModule_ExportCatalog_View(BaseView):
             row.set_cell_value(3, u'%s' % product.get_price_without_tax())
             table.append_row(row)
             # Get declinations
-            for d in product.search_resources(cls=Declination):
-                price = d.parent.get_price_without_tax(id_declination=d.name, pretty=True)
+            for d in declinations:
+                price = product.get_price_without_tax(id_declination=d.name, pretty=True)
                 row = odf_create_row(width=5)
                 row.set_cell_value(1, 'reference')
-                row.set_cell_value(2, d.get_declination_title())
+                row.set_cell_value(2, d.declination_title)
                 row.set_cell_value(3, u'%s' % price)
-                row.set_cell_value(4, d.get_property('stock-quantity'))
+                row.set_cell_value(4, d.stock_quantity)
                 table.append(row)
+            prices.invalidate(product)
         body.append(table)
         f = StringIO()
         document.save(f)
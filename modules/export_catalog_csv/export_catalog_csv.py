@@ -20,17 +20,16 @@ from cStringIO import StringIO
 # Import from itools
 from itools.core import get_abspath
 from itools.csv import CSVFile
+from itools.datatypes import String
 from itools.gettext import MSG
 from itools.handlers import ro_database
-from itools.web import ERROR, STLForm
+from itools.web import BaseView, ERROR, INFO, STLForm, get_context
 from itools.xmlfile import XMLFile
 
 # Import from lpod
 lpod_is_install = True
 try:
-    from lpod.document import odf_new_document_from_type
     from lpod.document import odf_get_document
-    from lpod.table import odf_create_table, import_from_csv
 except:
     lpod_is_install = False
 
@@ -39,8 +38,9 @@ from ikaaro.datatypes import FileDataType
 
 # Import from shop
 from shop.datatypes import UserGroup_Enumerate
+from shop.jobs import get_job_queue
 from shop.modules import ShopModule
-from shop.products.declination import Declination
+from shop.modules.stock.stock import update_stocks, get_stock_report_errors
 from shop.utils import get_shop
 
 
@@ -54,64 +54,41 @@ class ShopModule_ExportCatalogCSV_View(STLForm):
         return ro_database.get_handler(path, XMLFile)
 
 
-    def action_export_as_ods(self, resource, context, form):
-        if lpod_is_install is False:
-            msg = ERROR(u'Please install LPOD')
-            return context.come_back(msg)
-        # XXX Create a new process and send ODS file by mail for performances ?
-        # XXX We do not export product without declination
-        # XXX We do not export product without product model
-        # Get list of groups
+    def get_groups(self, context):
+        """Groups having their own prices.
+        """
         groups = []
         for option in UserGroup_Enumerate.get_options():
             group = context.root.get_resource(option['name'])
             if group.get_property('use_default_price') is True:
                 continue
             groups.append(group)
-        # DB
-        root = context.root
-        shop = get_shop(resource)
-        document = odf_new_document_from_type('spreadsheet')
-        body = document.get_body()
-        models = shop.get_resource('products-models').get_resources()
-        for product_model in models:
-            lines = []
-            # We create one TAB by product model
-            table = odf_create_table(product_model.get_title())
-            search = root.search(product_model=str(product_model.get_abspath()))
-            for brain in search.get_documents():
-                  product = root.get_resource(brain.abspath)
-                  for d in product.search_resources(cls=Declination):
-                      # Ref - Declination name - Declination title
-                      line = [product.get_property('reference'),
-                              d.name,
-                              d.get_declination_title().encode('utf-8')]
-                      # Stock
-                      line.append(str(d.get_quantity_in_stock()))
-                      # Price by group (HT or TTC)
-                      for group in groups:
-                          k_price = {'id_declination': d.name,
-                                     'prefix': group.get_prefix(),
-                                     'pretty': True}
-                          if group.get_property('show_ht_price'):
-                              price = product.get_price_without_tax(**k_price)
-                          else:
-                              price = product.get_price_with_tax(**k_price)
-                          line.append(str(price))
-                      # Add row
-                      lines.append(','.join(line))
-            data = '\n'.join(lines)
-            table = import_from_csv(StringIO(data), product_model.name)
-            body.append(table)
-        # Extport as ODS
-        f = StringIO()
-        document.save(f)
-        content = f.getvalue()
-        f.close()
-        # Return ODS
-        context.set_content_type('application/vnd.oasis.opendocument.spreadsheet')
-        context.set_content_disposition('attachment', 'export.ods')
-        return content
+        return groups
+
+
+    def get_namespace(self, resource, context):
+        exports = []
+        for format in ['ods', 'csv']:
+            status = resource.get_export_status(format)
+            exports.append({
+                'title': 'export.%s' % format,
+                'href': ';download?format=%s' % format,
+                'is_done': status == 'done',
+                'is_pending': status == 'pending',
+                'is_failed': status == 'failed'})
+        return {'exports': exports}
+
+
+    def action_export_as_ods(self, resource, context, form):
+        resource.export_catalog(self.get_groups(context), 'ods')
+        msg = INFO(u'The catalog will be exported in a few minutes')
+        return context.come_back(msg)
+
+
+    def action_export_as_csv(self, resource, context, form):
+        resource.export_catalog(self.get_groups(context), 'csv')
+        msg = INFO(u'The catalog will be exported in a few minutes')
+        return context.come_back(msg)
 
 
     action_import_ods_schema = {'file': FileDataType(mandatory=True)}
@@ -120,37 +97,61 @@ class ShopModule_ExportCatalogCSV_View(STLForm):
         if lpod_is_install is False:
             msg = ERROR(u'Please install LPOD')
             return context.come_back(msg)
-        # Get models
-        root = context.root
-        shop = get_shop(resource)
-        models = shop.get_resource('products-models').get_resources()
         # Open ODF file
         filename, mimetype, body = form['file']
         f = StringIO(body)
         document = odf_get_document(f)
+        lines = []
+        errors = []
         for table in document.get_body().get_tables():
-            model_name = table.get_name()
             csv = CSVFile(string=table.to_csv())
-            for row in csv.get_rows():
-                reference = row[0]
-                declination_name = row[1]
-                stock = row[-3]
-                price1 = row[-2]
-                price2 = row[-1]
-                product_brains = root.search(reference=reference).get_documents()
-                if len(product_brains) > 1:
-                    print 'Reference %s %s' % (reference, len(product_brains))
+            for i, row in enumerate(csv.get_rows()):
+                try:
+                    quantity = int(row[-3])
+                except ValueError:
+                    msg = MSG(u'Invalid stock quantity for reference '
+                              u'{reference}')
+                    errors.append(msg.gettext(reference=row[0]))
                     continue
-                product_brain = product_brains[0]
-                product = root.get_resource(product_brain.abspath)
-                declination = product.get_resource(declination_name)
-                # Set change
-                declination.set_property('stock-quantity', int(stock))
+                lines.append({'line': i + 1,
+                              'reference': row[0],
+                              'name': row[1],
+                              'quantity': quantity})
+        # Update all the stocks in one pass
+        report = update_stocks(get_shop(resource), lines)
+        errors.extend(get_stock_report_errors(report))
+        if errors:
+            context.message = ERROR(u'Import has been done with errors: '
+                                    u'{errors}', errors=u', '.join(errors))
+            return
         context.message = MSG(u'Import has been done')
         return
 
 
 
+class ShopModule_ExportCatalogCSV_Download(BaseView):
+
+    access = 'is_admin'
+    query_schema = {'format': String}
+
+    def GET(self, resource, context):
+        format = context.query['format']
+        if format not in ('csv', 'ods'):
+            return context.come_back(ERROR(u'Unknown format'), goto=';view')
+        if resource.get_export_status(format) != 'done':
+            msg = ERROR(u'The catalog has not been exported yet')
+            return context.come_back(msg, goto=';view')
+        path = resource.get_export_path(format)
+        if format == 'csv':
+            context.set_content_type('text/csv')
+        else:
+            context.set_content_type(
+                'application/vnd.oasis.opendocument.spreadsheet')
+        context.set_content_disposition('attachment', 'export.%s' % format)
+        return open(path).read()
+
+
+
 class ShopModule_ExportCatalogCSV(ShopModule):
 
     class_id = 'shop_module_export_catalog_csv'
@@ -159,6 +160,43 @@ class ShopModule_ExportCatalogCSV(ShopModule):
     class_description = MSG(u'Export shop catalog into CSV')
 
     view = ShopModule_ExportCatalogCSV_View()
+    download = ShopModule_ExportCatalogCSV_Download()
+
+
+    def get_export_key(self, format):
+        """The path of the export in the artefacts folder of the instance
+        (see shop.jobs).
+        """
+        return 'exports%s/export.%s' % (self.get_abspath(), format)
+
+
+    def get_export_status(self, format):
+        """Return 'pending', 'failed', 'done' or None.
+        """
+        queue = get_job_queue(get_context().server.target)
+        return queue.get_status(self.get_export_key(format))
+
+
+    def get_export_path(self, format):
+        queue = get_job_queue(get_context().server.target)
+        return queue.get_artefact_path(self.get_export_key(format))
+
+
+    def export_catalog(self, groups, format='csv'):
+        """Export the catalog with the prices of the groups, as "csv" or
+        "ods". The export is done by the jobs worker once the transaction
+        is committed (see shop.jobs.export_catalog).
+        """
+        context = get_context()
+        target = context.server.target
+        queue = get_job_queue(target)
+        key = self.get_export_key(format)
+        args = (target,
+                str(get_shop(self).get_abspath()),
+                [ str(x.get_abspath()) for x in groups ],
+                format,
+                queue.get_artefact_path(key))
+        queue.add_job_after_commit('catalog', key, args)
 
 
 # EXPORT CSV
@@ -19,7 +19,7 @@ from itools.gettext import MSG
 from itools.web import STLView
 
 # Import from shop
-from shop.cart import ProductCart
+from shop.cart import get_cart
 from shop.modules import ShopModule
 from shop.utils import get_shop, get_skin_template
 
@@ -33,7 +33,7 @@ class ShopModule_MiniCart_View(STLView):
 
 
     def get_namespace(self, resource, context):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         nb_products = cart.get_nb_products()
         shop = get_shop(context.resource)
         # Get total price
@@ -340,6 +340,8 @@ class ShopModule_AReview_NewInstance(NewInstance):
         # Create the reviews
         cls = ShopModule_AReview
         child = cls.make_resource(cls, reviews, name)
+        # Reindex the product (see ShopModule_Reviews.get_reviews_aggregates)
+        context.database.change_resource(product)
         # The metadata
         metadata = child.metadata
         language = resource.get_content_language(context)
@@ -574,6 +576,14 @@ class ShopModule_AReview(WorkflowAware, Folder):
         return values
 
 
+    def set_property(self, name, value, language=None):
+        Folder.set_property(self, name, value, language=language)
+        # Published, retired or edited: reindex the product
+        if name in ('state', 'note', 'description'):
+            product = self.parent.parent
+            get_context().database.change_resource(product)
+
+
     def get_namespace(self, context):
         # Build namespace
         namespace = {'author': self.get_namespace_author(context),
@@ -648,6 +658,34 @@ class ShopModule_Reviews(MultilingualProperties, Folder):
         MultilingualProperties._make_resource(cls, folder, name, **kw)
 
 
+    def del_resource(self, name, soft=False):
+        Folder.del_resource(self, name, soft=soft)
+        # Reindex the product
+        get_context().database.change_resource(self.parent)
+
+
+    def get_reviews_aggregates(self):
+        """The aggregates of the public reviews, indexed with the product
+        (see Product._get_catalog_values).
+        """
+        reviews = [ x for x in self.search_resources(cls=ShopModule_AReview)
+                    if x.get_workflow_state() == 'public' ]
+        reviews.sort(key=lambda x: x.get_mtime(), reverse=True)
+        nb_reviews = len(reviews)
+        note = sum([ x.get_property('note') for x in reviews ])
+        if reviews:
+            description = reviews[0].get_property('description')
+            last_review = reduce_string(description, 200, 200)
+        else:
+            last_review = None
+        return {'nb_reviews': nb_reviews,
+                'reviews_note_sum': note,
+                # XXX We can't sort decimal, so transform to int
+                'stored_note': note * 100 / nb_reviews if nb_reviews else 0,
+                'last_review': last_review,
+                'last_reviews': [ x.name for x in reviews[:5] ]}
+
+
 
 class ShopModule_Review(ShopModule):
 
@@ -729,27 +767,28 @@ class ShopModule_Review(ShopModule):
                     'here_abspath': str(context.resource.get_abspath()),
                     'product_abspath': resource.get_abspath(),
                     'viewboxes': {}}
-        # XXX Should be in catalog for performances
-        abspath = reviews.get_canonical_path()
-        queries = [PhraseQuery('parent_path', str(abspath)),
-                   PhraseQuery('workflow_state', 'public'),
-                   PhraseQuery('format', 'shop_module_a_review')]
-        search = context.root.search(AndQuery(*queries))
-        brains = list(search.get_documents(sort_by='mtime', reverse=True))
-        nb_reviews = len(brains)
-        if brains:
-            last_review = brains[0]
-            last_review = reduce_string(brains[0].shop_module_review_description,
-                                        200, 200)
+        # The aggregates are indexed with the product
+        query = PhraseQuery('abspath', str(resource.get_abspath()))
+        brains = context.root.search(query).get_documents()
+        if brains and brains[0].nb_reviews is not None:
+            brain = brains[0]
+            nb_reviews = brain.nb_reviews
+            note = brain.reviews_note_sum
+            last_review = brain.last_review
+            names = brain.last_reviews or []
         else:
-            last_review = None
-        note = 0
-        for brain in brains:
-            note += brain.shop_module_review_note
+            # Not indexed yet
+            values = reviews.get_reviews_aggregates()
+            nb_reviews = values['nb_reviews']
+            note = values['reviews_note_sum']
+            last_review = values['last_review']
+            names = values['last_reviews']
         # Get viewboxes
         viewboxes = []
-        for brain in brains[:5]:
-            review = context.root.get_resource(brain.abspath)
+        for name in names:
+            review = reviews.get_resource(name, soft=True)
+            if review is None:
+                continue
             viewbox = Review_Viewbox().GET(review, context)
             viewboxes.append(viewbox)
         return {'nb_reviews': nb_reviews,
@@ -791,3 +830,9 @@ register_resource_class(ShopModule_AReview)
 register_field('shop_module_review_author', String(is_indexed=True))
 register_field('shop_module_review_note', Integer(is_indexed=True, is_stored=True))
 register_field('shop_module_review_description', Unicode(is_stored=True))
+# Indexed with the products
+register_field('nb_reviews', Integer(is_indexed=True, is_stored=True))
+register_field('reviews_note_sum', Integer(is_stored=True))
+register_field('stored_note', Integer(is_indexed=True, is_stored=True))
+register_field('last_review', Unicode(is_stored=True))
+register_field('last_reviews', String(is_stored=True, multiple=True))
@@ -23,7 +23,7 @@ from itools.datatypes import Boolean, Integer, String, Unicode
 from itools.gettext import MSG
 from itools.stl import stl
 from itools.web import ERROR, INFO
-from itools.xapian import OrQuery, PhraseQuery
+from itools.xapian import AndQuery, OrQuery, PhraseQuery
 
 # Import from ikaaro
 from ikaaro.forms import SelectWidget, TextWidget
@@ -31,15 +31,85 @@ from ikaaro.registry import register_resource_class
 
 # Import from shop
 from shop.datatypes import IntegerRangeDatatype
-from shop.products.declination import Declination
 from shop.products.enumerate import CategoriesEnumerate, States
 from shop.manufacturers import ManufacturersEnumerate
 from shop.modules import ShopModule
 from shop.suppliers import SuppliersEnumerate
+from shop.utils import get_shop
 from shop.utils_views import SearchTableFolder_View
 from shop.widgets import NumberRangeWidget
 
 
+def update_stocks(shop, lines):
+    """Update the stock quantity of many products and declinations at once.
+    "lines" is a list of dicts with the keys:
+      line, reference, name (declination name or None), quantity
+    (if quantity is None the line is only checked).
+    All the references are resolved with only one catalog search, and a
+    resource is modified only once and only if its stock quantity changes,
+    so each resource is reindexed once at the end of the transaction.
+    Return the report: the lines with the keys "status" ('updated',
+    'unchanged' or 'error') and "message" (for errors).
+    """
+    root = shop.get_root()
+    report = []
+    # Resolve the references
+    references = set([ x['reference'] for x in lines if x['reference'] ])
+    products = {}
+    if references:
+        format = shop.product_class.class_id
+        query = AndQuery(PhraseQuery('format', format),
+                   OrQuery(*[ PhraseQuery('reference', x)
+                              for x in references ]))
+        for brain in root.search(query).get_documents():
+            products.setdefault(brain.reference, []).append(brain.abspath)
+    # Check the lines
+    changes = {}
+    for line in lines:
+        line = dict(line, status=None, message=None)
+        report.append(line)
+        reference = line['reference']
+        if not reference:
+            line['message'] = MSG(u'Line number {line} has no reference')
+        elif reference not in products:
+            line['message'] = MSG(u'Unknow reference {reference}')
+        elif len(products[reference]) > 1:
+            line['message'] = MSG(u'Reference {reference} is used {n} times')
+            line['n'] = len(products[reference])
+        if line['message']:
+            line['status'] = 'error'
+            continue
+        resource = root.get_resource(products[reference][0])
+        if line['name']:
+            resource = resource.get_resource(line['name'], soft=True)
+            if resource is None:
+                line['status'] = 'error'
+                line['message'] = MSG(u'Unknow declination {name}')
+                continue
+        line['status'] = 'unchanged'
+        if line['quantity'] is None:
+            continue
+        # The last line wins
+        abspath = str(resource.get_abspath())
+        if abspath in changes:
+            changes[abspath][1]['status'] = 'unchanged'
+        changes[abspath] = (resource, line)
+    # Apply the changes
+    for resource, line in changes.values():
+        quantity = line['quantity']
+        if resource.get_property('stock-quantity') == quantity:
+            continue
+        resource.set_property('stock-quantity', quantity)
+        line['status'] = 'updated'
+    return report
+
+
+
+def get_stock_report_errors(report):
+    return [ x['message'].gettext(**x) for x in report
+             if x['status'] == 'error' ]
+
+
 class Stock_FillStockOut(SearchTableFolder_View):
 
     # XXX Problems if we use it to edit prices
@@ -155,42 +225,32 @@ class Stock_FillStockOut(SearchTableFolder_View):
 
 
     def action(self, resource, context, form):
-        root = context.root
+        lines = []
         references_number = form['references_number']
         for i in range(1, references_number+1):
             reference = form['reference_%s' % i]
-            if not reference:
-                context.message = ERROR(u'[Error] Line number %s has no reference' % i)
-                context.commit = False
-                return
-            new_stock = form['new_stock_%s' % i]
-            search = root.search(reference=reference)
-            results = search.get_documents()
-            if not results:
-                context.message = ERROR(u'[Error] Unknow reference %s' % reference)
-                context.commit = False
-                return
-            # XXX
-            #if len(results) > 1:
-            #    context.message = ERROR(u'[Error] Reference %s is used %s times.' %
-            #                          (reference, len(results)))
-            #    context.commit = False
-            #    return
-            product = root.get_resource(results[0].abspath)
-            if new_stock:
-                product.set_property('stock-quantity', new_stock)
-            nb_declinations = form['nb_declinations_%s' % i]
-            if nb_declinations == 0:
-                continue
-            #declinations = list(product.search_resources(cls=Declination))
+            lines.append({'line': i,
+                          'reference': reference,
+                          'name': None,
+                          'quantity': form['new_stock_%s' % i] or None})
+            nb_declinations = form['nb_declinations_%s' % i] or 0
             for j in range(1, nb_declinations+1):
                 suffix = '_%s_%s' % (i, j)
-                name_declination = form['name'+ suffix]
-                stock_declination = form['new_stock'+ suffix]
-                if stock_declination:
-                    declination = product.get_resource(name_declination)
-                    declination.set_property('stock-quantity', stock_declination)
-        context.message = INFO(u'Stock quantity has been updated')
+                lines.append({'line': i,
+                              'reference': reference,
+                              'name': form['name'+ suffix],
+                              'quantity': form['new_stock'+ suffix] or None})
+        # Update all the stocks in one pass
+        report = update_stocks(get_shop(resource), lines)
+        errors = get_stock_report_errors(report)
+        if errors:
+            context.message = ERROR(u'[Error] {errors}',
+                                    errors=u', '.join(errors))
+            context.commit = False
+            return
+        nb_updated = len([ x for x in report if x['status'] == 'updated' ])
+        context.message = INFO(u'Stock quantity has been updated '
+                               u'({n} changes)', n=nb_updated)
 
 
     def action_generate_pdf(self, resource, context, form):
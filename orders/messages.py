@@ -20,6 +20,7 @@ from itools.csv import Table as BaseTable
 from itools.datatypes import Boolean, String, Unicode
 from itools.gettext import MSG
 from itools.i18n import format_datetime
+from itools.web import get_context
 from itools.xml import XMLParser
 
 # Import from ikaaro
@@ -49,6 +50,24 @@ class Messages_TableResource(Table):
             BooleanCheckBox('private', title=MSG(u'Private ?')),
             BooleanCheckBox('seen', title=MSG(u'Seen ?'))]
 
+
+    # The number of unread messages is indexed with the order
+    def add_new_record(self, record):
+        record = Table.add_new_record(self, record)
+        get_context().database.change_resource(self.parent)
+        return record
+
+
+    def update_record(self, id, **kw):
+        Table.update_record(self, id, **kw)
+        get_context().database.change_resource(self.parent)
+
+
+    def del_record(self, id):
+        Table.del_record(self, id)
+        get_context().database.change_resource(self.parent)
+
+
     def get_namespace_messages(self, context):
         messages = []
         get_value = self.handler.get_record_value
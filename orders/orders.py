@@ -24,12 +24,10 @@ from itools.datatypes import Boolean, DateTime
 from itools.datatypes import ISODateTime, Decimal, Integer, String, Unicode
 from itools.gettext import MSG
 from itools.i18n import format_date
-from itools.pdf import stl_pmltopdf
 from itools.uri import get_reference
 from itools.web import get_context
 
 # Import from ikaaro
-from ikaaro.file import PDF, Image
 from ikaaro.forms import TextWidget
 from ikaaro.registry import register_resource_class, register_field
 from ikaaro.table import Table
@@ -37,20 +35,23 @@ from ikaaro.workflow import WorkflowAware, WorkflowError
 
 # Import from shop
 from shop.addresses import Addresses, BaseAddresses
+from shop.jobs import get_job_queue, translate_namespace
+from shop.outbox import get_email_message
 from shop.payments.enumerates import PaymentWaysEnumerate
 from shop.shipping.shipping_way import ShippingWaysEnumerate
 from shop.utils import get_shop
 
 # Import from shop.orders
 from messages import Messages_TableResource
-from orders_views import Order_Manage, OrdersView
+from orders_views import Order_Artefact, Order_Manage, Order_RegeneratePDF
+from orders_views import OrdersView
 from orders_views import ShopPayments_EndViewTop
 from workflow import order_workflow
 from shop.csv_views import Export
 from shop.datatypes import Users_Enumerate
 from shop.products.taxes import TaxesEnumerate
 from shop.folder import ShopFolder
-from shop.utils import format_price, format_for_pdf
+from shop.utils import format_price
 
 
 #############################################
@@ -149,9 +150,16 @@ class Order(WorkflowAware, ShopFolder):
 
     workflow = order_workflow
 
+    # Artefacts generated by the jobs worker {name: file name}
+    artefacts = {'barcode': 'barcode.png',
+                 'bill': 'bill.pdf',
+                 'order': 'order.pdf'}
+
     # Views
     manage = Order_Manage()
     end_view_top = ShopPayments_EndViewTop()
+    artefact = Order_Artefact()
+    regenerate_pdf = Order_RegeneratePDF()
 
 
     @classmethod
@@ -244,19 +252,19 @@ class Order(WorkflowAware, ShopFolder):
                                 '%s/messages' % name,
                                 **{'title': {'en': u'Messages'}})
         # Generate barcode
-        from shop.utils import generate_barcode
         order = shop.get_resource('orders/%s' % name)
-        barcode = generate_barcode(shop.get_property('barcode_format'), name)
-        metadata =  {'title': {'en': u'Barcode'},
-                     'filename': 'barcode.png',
-                     'format': 'image/png'}
-        Image.make_resource(Image, order, 'barcode', body=barcode, **metadata)
+        order.generate_barcode(context)
 
 
     def _get_catalog_values(self):
         values = ShopFolder._get_catalog_values(self)
-        for key in ['customer_id', 'creation_datetime', 'is_payed']:
+        for key in ['customer_id', 'creation_datetime', 'is_payed',
+                    'total_price']:
             values[key] = self.get_property(key)
+        # For the list of orders (see OrdersView)
+        values['nb_unread_messages'] = self.get_nb_unread_messages()
+        values['has_bill_pdf'] = self.get_artefact_status('bill') is not None
+        values['has_order_pdf'] = self.get_artefact_status('order') is not None
         return values
 
 
@@ -369,6 +377,7 @@ class Order(WorkflowAware, ShopFolder):
             quantity = get_value(record, 'quantity')
             id_declination = get_value(record, 'declination')
             product_resource.remove_from_stock(quantity, id_declination)
+            product_resource.add_sold_quantity(quantity)
         # E-Mail confirmation / notification -> Order creation
         customer_email = self.get_customer_email(context)
         # Build email informations
@@ -389,24 +398,24 @@ class Order(WorkflowAware, ShopFolder):
     def onenter_payment_ok(self):
         context = get_context()
         shop = get_shop(self)
+        root = context.root
         # We set payment as payed
         self.set_property('is_payed', True)
+        # We send email confirmation to administrator
+        # (with the order PDF, once it has been generated)
+        subject = MSG(u'New order validated').gettext()
+        text = MSG(u'New order has been validated').gettext()
+        to_addrs = shop.get_property('order_notification_mails')
+        emails = [ get_email_message(root, x, subject, text=text).as_string()
+                   for x in to_addrs ]
         # We generate PDF
-        order = None
         try:
-            bill = self.generate_pdf_bill(context)
-            order = self.generate_pdf_order(context)
-            order.handler.name = 'Order.pdf'
-            attachment = order.handler
+            self.generate_pdf_bill(context)
+            self.generate_pdf_order(context, emails=emails)
         except Exception:
             # PDF generation is dangerous
-            attachment = None
-        # We send email confirmation to administrator
-        subject = MSG(u'New order validated').gettext()
-        text = MSG(u'New order has been validated').gettext()
-        for to_addr in shop.get_property('order_notification_mails'):
-            context.root.send_email(to_addr, subject,
-                                    text=text, attachment=attachment)
+            for to_addr in to_addrs:
+                root.send_email(to_addr, subject, text=text)
 
 
     def onenter_preparation(self):
@@ -438,6 +447,7 @@ class Order(WorkflowAware, ShopFolder):
             quantity = get_value(record, 'quantity')
             id_declination = get_value(record, 'declination')
             product_resource.add_on_stock(quantity, id_declination)
+            product_resource.add_sold_quantity(-quantity)
 
 
     ##################################################
@@ -529,62 +539,100 @@ class Order(WorkflowAware, ShopFolder):
 
 
     ########################################################
-    # PDF Generation
+    # Artefacts (PDF, barcode)
     ########################################################
-
-    def generate_pdf_order(self, context):
+    def get_artefact_key(self, name):
+        """The path of the artefact in the artefacts folder of the
+        instance (see shop.jobs).
+        """
+        return 'orders/%s/%s' % (self.name, self.artefacts[name])
+
+
+    def get_artefact_status(self, name):
+        """Return 'pending', 'failed', 'done' or None.
+        """
+        queue = get_job_queue(get_context().server.target)
+        status = queue.get_status(self.get_artefact_key(name))
+        if status is None and self.get_resource(name, soft=True):
+            # Generated by a previous version
+            return 'done'
+        return status
+
+
+    def get_artefact_path(self, name):
+        """Return the path of the artefact on the file system, or None if
+        it has not been generated.
+        """
+        context = get_context()
+        queue = get_job_queue(context.server.target)
+        key = self.get_artefact_key(name)
+        if queue.get_status(key) is not None:
+            path = queue.get_artefact_path(key)
+            return path if queue.get_status(key) == 'done' else None
+        # Generated by a previous version
+        resource = self.get_resource(name, soft=True)
+        if resource is None:
+            return None
+        return context.database.fs.get_absolute_path(resource.handler.key)
+
+
+    def generate_barcode(self, context):
         shop = get_shop(self)
-        # Delete old pdf
-        if self.get_resource('order', soft=True):
-            self.del_resource('order')
-        # Get template
-        document = self.get_resource('/ui/backoffice/orders/order_pdf.xml')
-        # Build namespace
-        path = context.database.fs.get_absolute_path(self.handler.key)
-        namespace = self.get_namespace(context)
+        format = shop.get_property('barcode_format')
+        if format == '0':
+            return
+        queue = get_job_queue(context.server.target)
+        queue.add_job_after_commit('barcode', self.get_artefact_key('barcode'),
+                                   (format, self.name))
+
+
+    def get_pdf_namespace(self, context):
+        """The namespace of the PDF, as plain data (it is pickled with the
+        job, see shop.jobs).
+        """
+        shop = get_shop(self)
+        namespace = translate_namespace(self.get_namespace(context))
+        namespace['logo'] = shop.get_pdf_logo_key(context)
+        # Formatted by the worker (see shop.jobs.make_pdf)
+        namespace['pdf_signature'] = shop.get_property('pdf_signature')
+        # The barcode may be generated after
+        queue = get_job_queue(context.server.target)
+        key = self.get_artefact_key('barcode')
+        if queue.get_status(key) is not None:
+            namespace['order_barcode'] = queue.get_artefact_path(key)
+        else:
+            namespace['order_barcode'] = self.get_artefact_path('barcode')
+        return namespace
+
+
+    def generate_pdf(self, context, name, template, namespace, emails=None):
+        """The PDF is generated by the jobs worker.
+        """
+        document = self.get_resource(template)
+        queue = get_job_queue(context.server.target)
+        queue.add_job_after_commit('pdf', self.get_artefact_key(name),
+                                   (document.key, namespace),
+                                   requires=[self.get_artefact_key('barcode')],
+                                   emails=emails)
+        # Reindex (has_bill_pdf, has_order_pdf)
+        context.database.change_resource(self)
+
+
+    def generate_pdf_order(self, context, emails=None):
+        namespace = self.get_pdf_namespace(context)
         for product in namespace['products']:
             product['key'] = context.database.fs.get_absolute_path(product['key'])
             product['cover']['key'] = context.database.fs.get_absolute_path(
                                            product['cover']['key'])
-        namespace['logo'] = shop.get_pdf_logo_key(context)
-        namespace['pdf_signature'] = format_for_pdf(shop.get_property('pdf_signature'))
-        barcode = self.get_resource('barcode', soft=True)
-        if barcode:
-            key = barcode.handler.key
-            path = context.database.fs.get_absolute_path(key)
-            namespace['order_barcode'] = path
-        else:
-            namespace['order_barcode'] = None
-        # Build pdf
-        body = stl_pmltopdf(document, namespace=namespace)
-        metadata =  {'title': {'en': u'Bill'},
-                     'filename': 'order.pdf'}
-        return PDF.make_resource(PDF, self, 'order', body=body, **metadata)
+        self.generate_pdf(context, 'order', '/ui/backoffice/orders/order_pdf.xml',
+                          namespace, emails)
 
 
-    def generate_pdf_bill(self, context):
-        shop = get_shop(self)
-        # Delete old bill
-        if self.get_resource('bill', soft=True):
-            self.del_resource('bill')
-        # Get template
-        document = self.get_resource('/ui/backoffice/orders/order_facture.xml')
-        # Build namespace
-        namespace = self.get_namespace(context)
-        namespace['logo'] = shop.get_pdf_logo_key(context)
-        namespace['pdf_signature'] = format_for_pdf(shop.get_property('pdf_signature'))
-        barcode = self.get_resource('barcode', soft=True)
-        if barcode:
-            key = barcode.handler.key
-            path = context.database.fs.get_absolute_path(key)
-            namespace['order_barcode'] = path
-        else:
-            namespace['order_barcode'] = None
-        # Build pdf
-        pdf = stl_pmltopdf(document, namespace=namespace)
-        metadata =  {'title': {'en': u'Bill'},
-                     'filename': 'bill.pdf'}
-        return PDF.make_resource(PDF, self, 'bill', body=pdf, **metadata)
+    def generate_pdf_bill(self, context, emails=None):
+        namespace = self.get_pdf_namespace(context)
+        self.generate_pdf(context, 'bill',
+                          '/ui/backoffice/orders/order_facture.xml',
+                          namespace, emails)
 
     ###################################################
     ## Computed fields
@@ -593,9 +641,15 @@ class Order(WorkflowAware, ShopFolder):
 
     @property
     def nb_msg(self):
-        messages = self.get_resource('messages').handler
-        nb_messages = messages.get_n_records() - len(messages.search(seen=True))
-        return nb_messages or None
+        return self.get_nb_unread_messages() or None
+
+
+    def get_nb_unread_messages(self):
+        messages = self.get_resource('messages', soft=True)
+        if messages is None:
+            return 0
+        messages = messages.handler
+        return messages.get_n_records() - len(messages.search(seen=True))
 
 
     ###################################################
@@ -646,9 +700,13 @@ class Orders(ShopFolder):
 
 
 # Register catalog fields
-register_field('customer_id', String(is_indexed=True))
+register_field('customer_id', String(is_indexed=True, is_stored=True))
 register_field('is_payed', Boolean(is_stored=True))
 register_field('creation_datetime', DateTime(is_stored=True, is_indexed=True))
+register_field('nb_unread_messages', Integer(is_stored=True))
+register_field('has_bill_pdf', Boolean(is_stored=True))
+register_field('has_order_pdf', Boolean(is_stored=True))
+register_field('total_price', Decimal(is_stored=True))
 
 # Register resources
 register_resource_class(Order)
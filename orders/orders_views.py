@@ -22,7 +22,8 @@ from itools.gettext import MSG
 from itools.i18n import format_datetime
 from itools.log import log_error
 from itools.xapian import PhraseQuery
-from itools.web import ERROR, INFO, STLForm, FormError, STLView
+from itools.web import BaseForm, BaseView, ERROR, INFO, STLForm, FormError
+from itools.web import STLView
 from itools.web.views import process_form
 from itools.xml import XMLParser
 from itools.workflow import WorkflowError
@@ -35,6 +36,7 @@ from ikaaro.forms import SelectWidget, TextWidget
 from widgets import OrdersWidget
 from workflow import Order_Transitions, states, states_color, OrderStates_Enumerate
 from shop.buttons import MergeOrderButton, MergeBillButton, RegeneratePDFButton
+from shop.datatypes import Users_Enumerate
 from shop.payments.enumerates import PaymentWaysEnumerate
 from shop.payments.payments_views import Payments_EditablePayment
 from shop.shipping.shipping_way import ShippingWaysEnumerate
@@ -45,6 +47,12 @@ from shop.utils import format_price, get_shop, join_pdfs
 
 numero_template = '<span class="counter" style="background-color:%s"><a href="%s">%s</a></span>'
 img_mail = list(XMLParser('<img src="/ui/shop/images/mail.png"/>'))
+artefact_template = '<a href="./%s/;artefact?name=%s"><img src="%s"/></a>'
+artefact_statuses = {'pending': MSG(u'Pending'), 'failed': MSG(u'Failed')}
+artefact_errors = {
+    'pending': ERROR(u'The document is being generated, try again later'),
+    'failed': ERROR(u'The document could not be generated'),
+    None: ERROR(u'The document is not available')}
 
 
 
@@ -87,42 +95,54 @@ class OrdersView(SearchTableFolder_View):
 
 
     def get_item_value(self, resource, context, item, column):
+        # Rendered from the catalog only
         item_brain, item_resource = item
-        if column == 'name':
+        if column == 'checkbox':
+            return item_brain.name, False
+        elif column == 'name':
             state = item_brain.workflow_state
-            href = context.resource.get_pathto(item_resource)
-            name = item_resource.get_reference()
+            href = '%s/' % item_brain.name
+            # See Order.get_reference
+            name = '%.6d' % int(item_brain.name)
             return XMLParser(numero_template % (states_color[state], href, name))
         elif column == 'state':
             state = item_brain.workflow_state
             state_title = states[state].gettext().encode('utf-8')
-            href = context.resource.get_pathto(item_resource)
+            href = '%s/' % item_brain.name
             return XMLParser(numero_template % (states_color[state], href, state_title))
+        elif column == 'customer_id':
+            return Users_Enumerate.get_value(item_brain.customer_id)
         elif column == 'total_price':
-            price = item_resource.get_property(column)
-            return format_price(price)
-        elif column == 'order_pdf':
-            if item_resource.get_resource('order', soft=True) is None:
-                return
-            img = """
-                  <a href="./%s/order/;download">
-                    <img src="/ui/icons/16x16/select_none.png"/>
-                  </a>
-                  """ % item_brain.name
-            return XMLParser(img)
-        elif column == 'bill':
-            if item_resource.get_resource('bill', soft=True) is None:
-                return
-            img = """
-                  <a href="./%s/bill/;download">
-                    <img src="/ui/icons/16x16/pdf.png"/>
-                  </a>
-                  """ % item_brain.name
-            return XMLParser(img)
+            return format_price(item_brain.total_price)
+        elif column == 'creation_datetime':
+            value = item_brain.creation_datetime
+            if value is None:
+                return u'-'
+            return format_datetime(value, context.accept_language)
+        elif column == 'nb_msg':
+            return item_brain.nb_unread_messages or None
+        elif column in ('order_pdf', 'bill'):
+            # Generated by the jobs worker (Order_Artefact tells if it is
+            # not generated yet)
+            if column == 'order_pdf':
+                name, img = 'order', '/ui/icons/16x16/select_none.png'
+            else:
+                name, img = 'bill', '/ui/icons/16x16/pdf.png'
+            if not getattr(item_brain, 'has_%s_pdf' % name):
+                return None
+            return XMLParser(artefact_template % (item_brain.name, name, img))
         proxy = super(OrdersView, self)
         return proxy.get_item_value(resource, context, item, column)
 
 
+    def sort_and_batch(self, resource, context, items):
+        # The orders are not loaded (the view is for the administrators,
+        # no need to check the access to each order)
+        start = context.query['batch_start']
+        size = context.query['batch_size']
+        return [ (x, None) for x in items[start:start+size] ]
+
+
     def get_items(self, resource, context, *args):
         abspath = str(resource.get_canonical_path())
         query = [PhraseQuery('parent_path', abspath),
@@ -136,10 +156,10 @@ class OrdersView(SearchTableFolder_View):
         context.set_content_disposition('attachment; filename="Document.pdf"')
         list_pdf = []
         for id in form['ids']:
-            pdf = resource.get_resource('%s/%s' % (id, pdf_name), soft=True)
-            if pdf is None:
+            order = resource.get_resource(id)
+            path = order.get_artefact_path(pdf_name)
+            if path is None:
                 continue
-            path = context.database.fs.get_absolute_path(pdf.handler.key)
             list_pdf.append(path)
         # Join pdf
         pdf = join_pdfs(list_pdf)
@@ -160,7 +180,48 @@ class OrdersView(SearchTableFolder_View):
             order = resource.get_resource(order_id)
             order.generate_pdf_bill(context)
             order.generate_pdf_order(context)
-        return context.come_back(MSG(u'PDF has been regenerated'))
+        return context.come_back(MSG(u'PDF will be regenerated'))
+
+
+
+class Order_Artefact(BaseView):
+    """Download an artefact of the order (PDF, barcode).
+    """
+
+    access = 'is_admin'
+    query_schema = {'name': String(mandatory=True)}
+
+    def GET(self, resource, context):
+        name = context.query['name']
+        if name not in resource.artefacts:
+            return context.come_back(ERROR(u'Unknown document'), goto='./')
+        path = resource.get_artefact_path(name)
+        if path is None:
+            status = resource.get_artefact_status(name)
+            msg = artefact_errors.get(status, artefact_errors[None])
+            return context.come_back(msg, goto=';manage')
+        filename = resource.artefacts[name]
+        if filename.endswith('.pdf'):
+            context.set_content_type('application/pdf')
+        else:
+            context.set_content_type('image/png')
+        context.set_content_disposition('inline; filename="%s"' % filename)
+        return open(path).read()
+
+
+
+class Order_RegeneratePDF(BaseForm):
+    """The PDF are generated by the jobs worker (once the transaction is
+    committed, so it is a POST).
+    """
+
+    access = 'is_admin'
+
+    def action(self, resource, context, form):
+        resource.generate_pdf_bill(context)
+        resource.generate_pdf_order(context)
+        msg = INFO(u'PDF will be regenerated')
+        return context.come_back(msg, goto=';manage')
 
 
 
@@ -202,11 +263,11 @@ class Order_Manage(Payments_EditablePayment, STLForm):
         namespace['state'] = {'title': states[resource.workflow_state],
                               'color': states_color[resource.workflow_state]}
         namespace['transitions'] = SelectWidget('transition').to_html(Order_Transitions, None)
-        # Bill
-        has_bill = resource.get_resource('bill', soft=True) is not None
-        namespace['has_bill'] = has_bill
-        has_order = resource.get_resource('order', soft=True) is not None
-        namespace['has_order'] = has_order
+        # Bill (generated by the jobs worker)
+        for name in ['bill', 'order']:
+            status = resource.get_artefact_status(name)
+            namespace['has_%s' % name] = (status == 'done')
+            namespace['%s_status' % name] = artefact_statuses.get(status)
         # Order
         creation_datetime = resource.get_property('creation_datetime')
         namespace['order'] = {
@@ -341,10 +402,11 @@ class Order_Manage(Payments_EditablePayment, STLForm):
 
     action_change_message_state_schema = {'id_message': Integer(mandatory=True)}
     def action_change_message_state(self, resource, context, form):
-        handler = resource.get_resource('messages').handler
+        messages = resource.get_resource('messages')
+        handler = messages.handler
         record = handler.get_record(form['id_message'])
         seen = handler.get_record_value(record, 'seen')
-        handler.update_record(form['id_message'], **{'seen': not seen})
+        messages.update_record(form['id_message'], **{'seen': not seen})
         context.message = INFO(u'Changes saves')
 
 
@@ -0,0 +1,283 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# The e-mails of the shop are not sent during the request: the messages
+# built by ikaaro's Root.send_email are written into the outbox of the
+# instance once the transaction is committed, or right away by the
+# requests which do not commit, as a GET (instead of the spool of the
+# server, see send_email), then they are sent by batches by the
+# "shop-send-emails.py" worker.
+#
+# A message of the outbox is a file named:
+#   <time of the next try>_<number of tries>_<id>
+# The messages which cannot be sent are moved to the "failed" folder.
+# The workers take a lock on the outbox to send a batch.
+#######################################################################
+
+# Import from standard library
+from email.parser import HeaderParser
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from os import fdopen, listdir, makedirs, remove, rename
+from os.path import exists, join
+from smtplib import SMTP, SMTPRecipientsRefused, SMTPResponseException
+from smtplib import SMTPServerDisconnected
+from tempfile import mkstemp
+from time import time
+from types import FunctionType, MethodType
+
+# Import from itools
+from itools.log import log_error, log_info, log_warning
+from itools.web import get_context
+
+# Import from shop
+from transactions import after_commit
+
+
+# Retry: the delay is doubled after each try (1 minute, 2 minutes, ...)
+RETRY_DELAY = 60
+RETRY_MAX_DELAY = 6 * 3600
+RETRY_MAX_TRIES = 10
+
+
+class Outbox(object):
+
+    def __init__(self, target):
+        self.path = join(target, 'outbox')
+        self.tmp_path = join(self.path, 'tmp')
+        self.failed_path = join(self.path, 'failed')
+        self.lock_path = join(self.path, 'lock')
+        for path in [self.tmp_path, self.failed_path]:
+            if not exists(path):
+                makedirs(path)
+
+
+    #######################################################################
+    # Queue
+    #######################################################################
+    def add_message(self, message):
+        """Write the message (email.Message) into the outbox.
+        """
+        fd, tmp_path = mkstemp(dir=self.tmp_path)
+        file = fdopen(fd, 'w')
+        try:
+            file.write(message.as_string())
+        finally:
+            file.close()
+        uid = tmp_path.rsplit('/', 1)[-1]
+        rename(tmp_path, join(self.path, '%010d_0_%s' % (time(), uid)))
+
+
+    def get_messages(self):
+        """Return the messages of the outbox as a list of
+        (name, time of the next try, number of tries), sorted by time.
+        """
+        messages = []
+        for name in listdir(self.path):
+            try:
+                next_try, tries, uid = name.split('_', 2)
+                messages.append((name, int(next_try), int(tries)))
+            except ValueError:
+                # The folders "tmp" and "failed", the lock
+                continue
+        messages.sort(key=lambda x: x[1])
+        return messages
+
+
+    def get_stats(self):
+        """Depth of the queue and failures.
+        """
+        now = time()
+        messages = self.get_messages()
+        ready = [ x for x in messages if x[1] <= now ]
+        return {
+            'queued': len(messages),
+            'ready': len(ready),
+            'deferred': len([ x for x in messages if x[2] > 0 ]),
+            'failed': len(listdir(self.failed_path)),
+            # Number of seconds the oldest ready message has been waiting
+            'oldest': int(now - ready[0][1]) if ready else 0}
+
+
+    def _defer(self, name, tries):
+        """The message will be sent later (or never if it has been tried
+        too many times).
+        """
+        tries += 1
+        source = join(self.path, name)
+        uid = name.split('_', 2)[2]
+        if tries >= RETRY_MAX_TRIES:
+            rename(source, join(self.failed_path, uid))
+            return
+        delay = min(RETRY_DELAY * 2 ** (tries - 1), RETRY_MAX_DELAY)
+        target = '%010d_%d_%s' % (time() + delay, tries, uid)
+        rename(source, join(self.path, target))
+
+
+    def _fail(self, name, code=None):
+        uid = name.split('_', 2)[2]
+        if code is not None:
+            uid = '%s_%s' % (code, uid)
+        rename(join(self.path, name), join(self.failed_path, uid))
+
+
+    #######################################################################
+    # Send
+    #######################################################################
+    def send(self, smtp_host, smtp_login=None, smtp_password=None,
+             batch_size=50):
+        """Send the messages ready to be sent, at most "batch_size" through
+        the same SMTP connection. Return the number of messages sent.
+        Only one worker sends at a time (the others send nothing).
+        """
+        lock = open(self.lock_path, 'a')
+        try:
+            try:
+                flock(lock, LOCK_EX | LOCK_NB)
+            except IOError:
+                # Another worker is sending
+                return 0
+            try:
+                return self._send(smtp_host, smtp_login, smtp_password,
+                                  batch_size)
+            finally:
+                flock(lock, LOCK_UN)
+        finally:
+            lock.close()
+
+
+    def _send(self, smtp_host, smtp_login, smtp_password, batch_size):
+        now = time()
+        messages = [ x for x in self.get_messages() if x[1] <= now ]
+        messages = messages[:batch_size]
+        if not messages:
+            return 0
+        # Open the connection (if it fails, we will try again later)
+        try:
+            smtp = SMTP(smtp_host)
+            if smtp_login and smtp_password:
+                smtp.login(smtp_login, smtp_password)
+        except Exception, e:
+            log_warning('Cannot connect to "%s": %s' % (smtp_host, e))
+            return 0
+        # Send
+        n = 0
+        parser = HeaderParser()
+        for name, next_try, tries in messages:
+            path = join(self.path, name)
+            try:
+                message = open(path).read()
+                headers = parser.parsestr(message)
+                smtp.sendmail(headers['from'], headers['to'], message)
+            except SMTPServerDisconnected:
+                # The message will be sent with the next batch
+                log_warning('Disconnected from "%s"' % smtp_host)
+                break
+            except SMTPRecipientsRefused:
+                # The recipient addresses has been refused
+                log_error('Email "%s" refused' % name)
+                self._fail(name)
+            except SMTPResponseException, excp:
+                # 4xx errors are temporary, 5xx errors are permanent
+                log_error('Email "%s" not sent: %s %s' % (name,
+                          excp.smtp_code, excp.smtp_error))
+                if excp.smtp_code < 500:
+                    self._defer(name, tries)
+                else:
+                    self._fail(name, excp.smtp_code)
+            except Exception, e:
+                log_error('Email "%s" not sent: %s' % (name, e))
+                self._defer(name, tries)
+            else:
+                remove(path)
+                n += 1
+                log_info('Email "%s" sent to "%s"' % (headers['subject'],
+                                                      headers['to']))
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+        return n
+
+
+
+# {instance path: Outbox}
+outboxes = {}
+
+def get_outbox(target):
+    outbox = outboxes.get(target)
+    if outbox is None:
+        outbox = outboxes[target] = Outbox(target)
+    return outbox
+
+
+
+#######################################################################
+# Hook into the ikaaro server (see shop/__init__)
+#######################################################################
+def will_commit(context):
+    """Tell whether the changes made now by the request will be committed
+    (see RequestMethod.handle_request in itools.web.server): not by a GET
+    (unless "context.commit" is True), nor if "context.commit" is False,
+    nor by the postponed render of a view, which runs after the commit.
+    An error (status >= 400) cannot be known in advance.
+    """
+    commit = getattr(context, 'commit', None)
+    if commit is False:
+        return False
+    method = getattr(context, 'method', None)
+    if method in ('GET', 'HEAD') and commit is not True:
+        return False
+    entity = getattr(context, 'entity', None)
+    if isinstance(entity, (FunctionType, MethodType)):
+        return False
+    return True
+
+
+def send_email(server, message):
+    """Replaces ikaaro's Server.send_email: the message is written into
+    the outbox once the transaction is committed, or right away if the
+    request will not commit (see will_commit) or if
+    "context.emails_after_commit" is False.
+    """
+    # Check the SMTP host is defined
+    if not server.smtp_host:
+        raise ValueError, '"smtp-host" is not set in config.conf'
+    context = get_context()
+    messages = getattr(context, 'email_messages', None)
+    if messages is not None:
+        # See get_email_message
+        messages.append(message)
+        return
+    outbox = get_outbox(server.target)
+    if (getattr(context, 'emails_after_commit', True) is False or
+        not will_commit(context)):
+        outbox.add_message(message)
+    else:
+        after_commit(outbox.add_message, message)
+
+
+def get_email_message(root, to_addr, subject, **kw):
+    """Return the message built by ikaaro's Root.send_email, without
+    sending it.
+    """
+    context = get_context()
+    context.email_messages = []
+    try:
+        root.send_email(to_addr, subject, **kw)
+        return context.email_messages[0]
+    finally:
+        del context.email_messages
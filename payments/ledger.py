@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from standard library
+from decimal import Decimal as decimal
+from operator import itemgetter
+
+
+class PaymentsLedger(object):
+    """
+    The payments of all the payment ways, most recent first. Each payment
+    is a dict with the keys:
+      ts, payment_mode, id, complete_id, ref, user, state, amount
+    With the indexes by_ref, by_user, by_state and by_way ({value: list of
+    payments}), in the same order.
+    The tables of the payment ways are the source of truth: the ledger is
+    built once, then the payments are updated once their changes are
+    committed (see PaymentWayBaseTable).
+    """
+
+    def __init__(self, payments):
+        from payment_way import PaymentWay
+        # {key of the handler of a table: name of the payment way}
+        self.ways = {}
+        # {(payment way, id): payment}
+        self.by_id = {}
+        self.payments = []
+        for payment_way in payments.search_resources(cls=PaymentWay):
+            handler = payment_way.get_resource('payments').handler
+            self.ways[handler.key] = payment_way.name
+            for record in handler.get_records():
+                payment = self.get_payment(payment_way.name, handler, record)
+                self.by_id[(payment_way.name, record.id)] = payment
+                self.payments.append(payment)
+        self.payments.sort(key=itemgetter('ts'), reverse=True)
+        # Indexes
+        self.by_ref = {}
+        self.by_user = {}
+        self.by_state = {}
+        self.by_way = {}
+        for payment in self.payments:
+            for payments in self.get_indexes(payment):
+                payments.append(payment)
+
+
+    def get_payment(self, payment_mode, handler, record):
+        get_value = handler.get_record_value
+        return {
+            'ts': get_value(record, 'ts'),
+            'payment_mode': payment_mode,
+            'id': record.id,
+            'complete_id': '%s-%s' % (payment_mode, record.id),
+            'ref': get_value(record, 'ref'),
+            'user': get_value(record, 'user'),
+            'state': get_value(record, 'state') or False,
+            'amount': get_value(record, 'amount') or decimal(0)}
+
+
+    def get_indexes(self, payment):
+        """The lists of payments (by_*) the payment belongs to.
+        """
+        return [self.by_ref.setdefault(payment['ref'], []),
+                self.by_user.setdefault(payment['user'], []),
+                self.by_state.setdefault(payment['state'], []),
+                self.by_way.setdefault(payment['payment_mode'], [])]
+
+
+    def update_payment(self, handler, id):
+        """The record "id" of the table has been added, changed or removed.
+        Return False if the table is not one of the ledger.
+        """
+        payment_mode = self.ways.get(handler.key)
+        if payment_mode is None:
+            return False
+        # Remove the old payment
+        old = self.by_id.pop((payment_mode, id), None)
+        if old is not None:
+            for payments in [self.payments] + self.get_indexes(old):
+                for i, x in enumerate(payments):
+                    if x is old:
+                        del payments[i]
+                        break
+        # Add the new one (most recent first)
+        record = handler.get_record(id)
+        if record is None:
+            return True
+        payment = self.get_payment(payment_mode, handler, record)
+        self.by_id[(payment_mode, id)] = payment
+        ts = payment['ts']
+        for payments in [self.payments] + self.get_indexes(payment):
+            i = 0
+            while i < len(payments) and payments[i]['ts'] > ts:
+                i += 1
+            payments.insert(i, payment)
+        return True
+
+
+    def search(self, ref=None, user=None, state=None, payment_ways=None):
+        """Return the payments matching all the criteria, most recent
+        first ("payment_ways" is a list of names).
+        """
+        criteria = []
+        if ref:
+            criteria.append(('ref', self.by_ref.get(ref, [])))
+        if user:
+            criteria.append(('user', self.by_user.get(user, [])))
+        if (state is True) or (state is False):
+            criteria.append(('state', self.by_state.get(state, [])))
+        if payment_ways is not None:
+            by_way = []
+            for name in payment_ways:
+                by_way.extend(self.by_way.get(name, []))
+            by_way.sort(key=itemgetter('ts'), reverse=True)
+            criteria.append(('payment_mode', by_way))
+        if not criteria:
+            return list(self.payments)
+        # Start from the smallest list, then filter it
+        criteria.sort(key=lambda x: len(x[1]))
+        payments = criteria[0][1]
+        values = {'ref': ref, 'user': user, 'state': state}
+        for key, x in criteria[1:]:
+            if key == 'payment_mode':
+                payments = [ x for x in payments
+                             if x['payment_mode'] in payment_ways ]
+            else:
+                payments = [ x for x in payments if x[key] == values[key] ]
+        return list(payments)
+
+
+    def get_total(self, ref=None, user=None, state=None):
+        return sum([ x['amount'] for x in self.search(ref, user, state) ],
+                   decimal(0))
+
+
+
+# {payments abspath: PaymentsLedger}
+payments_ledgers = {}
+
+def get_payments_ledger(payments):
+    key = str(payments.get_abspath())
+    ledger = payments_ledgers.get(key)
+    if ledger is None:
+        ledger = payments_ledgers[key] = PaymentsLedger(payments)
+    return ledger
+
+
+def invalidate_payments_ledger():
+    payments_ledgers.clear()
+
+
+def update_payments_ledger(handler, id):
+    """Update the payment of the given table and record id in the ledgers
+    (once the change is committed).
+    """
+    found = False
+    for ledger in payments_ledgers.values():
+        if ledger.update_payment(handler, id):
+            found = True
+    # A new payment way
+    if found is False:
+        invalidate_payments_ledger()
@@ -28,9 +28,11 @@ from ikaaro.registry import register_resource_class
 from ikaaro.table import Table
 
 # Import from shop
+from ledger import invalidate_payments_ledger, update_payments_ledger
 from payment_way_views import PaymentWay_RecordView, PaymentWay_Configure
 from shop.folder import ShopFolder
 from shop.datatypes import ImagePathDataType, UserGroup_Enumerate
+from shop.transactions import after_commit
 from shop.utils import CurrentFolder_AddImage, format_price
 
 
@@ -45,6 +47,28 @@ class PaymentWayBaseTable(BaseTable):
         'description': Unicode(title=MSG(u'Payment description'))}
 
 
+    def reset(self):
+        BaseTable.reset(self)
+        invalidate_payments_ledger()
+
+
+    # The payments are updated in the ledger once committed
+    def add_record(self, kw):
+        record = BaseTable.add_record(self, kw)
+        after_commit(update_payments_ledger, self, record.id)
+        return record
+
+
+    def update_record(self, id, **kw):
+        BaseTable.update_record(self, id, **kw)
+        after_commit(update_payments_ledger, self, id)
+
+
+    def del_record(self, id):
+        BaseTable.del_record(self, id)
+        after_commit(update_payments_ledger, self, id)
+
+
 class PaymentWayTable(Table):
 
     class_id = 'payment-table'
@@ -29,6 +29,7 @@ from payments_views import Payments_View, Payments_History_View
 from payments_views import Payments_ManagePayment, Payments_AddPayment
 
 # Import from shop
+from ledger import get_payments_ledger, invalidate_payments_ledger
 from payment_way import PaymentWay
 from registry import payment_ways_registry
 from shop.folder import ShopFolder
@@ -56,6 +57,13 @@ class Payments(ShopFolder):
         return payment_ways_registry.values()
 
 
+    def del_resource(self, name, soft=False):
+        # The payments of the payment way are removed from the ledger
+        invalidate_payments_ledger()
+        after_abort(invalidate_payments_ledger)
+        return ShopFolder.del_resource(self, name, soft=soft)
+
+
     @staticmethod
     def _make_resource(cls, folder, name, *args, **kw):
         ShopFolder._make_resource(cls, folder, name, **kw)
@@ -77,11 +85,31 @@ class Payments(ShopFolder):
         return items
 
 
+    def search_payments(self, ref=None, user=None, payment_way=None,
+                        state=None):
+        """Return the payments from the ledger (see PaymentsLedger), most
+        recent first, without loading the records.
+        """
+        payment_ways = None
+        if payment_way is not None:
+            payment_ways = [ x.name for x in self.search_resources(
+                               cls=PaymentWay, format=payment_way) ]
+        ledger = get_payments_ledger(self)
+        return ledger.search(ref, user, state, payment_ways)
+
+
     def get_payments_records(self, context, ref=None, user=None,
                              payment_way=None, state=None,
                              queries=None):
+        if not queries:
+            records = []
+            for payment in self.search_payments(ref, user, payment_way, state):
+                way = self.get_resource(payment['payment_mode'])
+                payments = way.get_resource('payments').handler
+                records.append((way, payments.get_record(payment['id'])))
+            return records
+        # Other criteria: search the tables
         records = []
-        queries = queries or []
         if ref:
             queries.append(PhraseQuery('ref', ref))
         if user:
@@ -132,12 +160,8 @@ class Payments(ShopFolder):
 
     def get_payments_informations(self, context, ref=None, user=None):
         """Get payments general statistic concerning a user or a ref"""
-        infos = {'total_payed': 0}
-        for payment_way, record in self.get_payments_records(
-                                      context, ref=ref, user=user, state=True):
-            payments = payment_way.get_resource('payments').handler
-            infos['total_payed'] += payments.get_record_value(record, 'amount')
-        return infos
+        ledger = get_payments_ledger(self)
+        return {'total_payed': ledger.get_total(ref, user, state=True)}
 
 
     ######################
@@ -24,7 +24,6 @@ from itools.gettext import MSG
 from itools.xml import XMLParser
 from itools.web import ERROR, FormError, STLForm, get_context
 from itools.web.views import process_form
-from itools.xapian import PhraseQuery
 
 # Import from ikaaro
 from ikaaro.forms import AutoForm, SelectWidget, Widget, stl_namespaces
@@ -162,11 +161,10 @@ class Payments_History_View(SearchForm):
 
 
     def get_items(self, resource, context):
-        queries = []
-        for key in self.search_schema.keys():
-            if context.query[key]:
-                queries.append(PhraseQuery(key, context.query[key]))
-        return resource.get_payments_items(context, queries=queries)
+        # The payments of the ledger, the records are loaded by page
+        query = context.query
+        return resource.search_payments(ref=query['ref'], user=query['user'],
+                                        state=query['state'] or None)
 
 
     def get_item_value(self, resource, context, item, column):
@@ -185,16 +183,31 @@ class Payments_History_View(SearchForm):
 
 
     def sort_and_batch(self, resource, context, items):
-        # Sort
+        # Sort (the payments are already sorted by date)
         sort_by = context.query['sort_by']
         reverse = context.query['reverse']
-        if sort_by:
+        if sort_by == 'user_title':
+            # By the title of the customers, as displayed
+            users = context.root.get_resource('users')
+            titles = {}
+            for username in set([ x['user'] for x in items ]):
+                user = users.get_resource(username or '0', soft=True)
+                titles[username] = user.get_title() if user else u''
+            items.sort(key=lambda x: titles[x['user']], reverse=reverse)
+        elif (items and sort_by in items[0] and
+              (sort_by, reverse) != ('ts', True)):
             items.sort(key=itemgetter(sort_by), reverse=reverse)
 
         # Batch
         start = context.query['batch_start']
         size = context.query['batch_size']
-        return items[start:start+size]
+        namespaces = []
+        for payment in items[start:start+size]:
+            way = resource.get_resource(payment['payment_mode'])
+            payments = way.get_resource('payments')
+            record = payments.handler.get_record(payment['id'])
+            namespaces.append(payments.get_record_namespace(context, record))
+        return namespaces
 
 
 
@@ -0,0 +1,108 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from itools
+from itools.uri import get_uri_name
+from itools.web import get_context
+
+# Import from shop
+from utils import get_shop, get_group_name
+
+
+# Properties having an impact on the price of a product / declination
+price_properties = ['has_reduction', 'pre-tax-price', 'reduce-pre-tax-price',
+                    'tax', 'impact_on_price']
+
+
+class PricesCache(object):
+    """
+    Memoize prices of products for the duration of a request.
+    Prices are stored by product abspath and by key:
+      (kind, id_declination, prefix, id_zone, with_reduction)
+    The group prefix and the delivery zone are computed only once.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.prefix = None
+        self.id_zone = None
+        self.prices = {}
+
+
+    def get_prefix(self, resource):
+        if self.prefix is None:
+            shop = get_shop(resource)
+            group_name = get_group_name(shop, self.context)
+            if get_uri_name(group_name) == 'pro':
+                self.prefix = 'pro-'
+            else:
+                self.prefix = ''
+        return self.prefix
+
+
+    def get_id_zone(self, resource):
+        if self.id_zone is None:
+            from cart import get_cart
+            # Get zone from cookie
+            id_zone = get_cart(self.context).id_zone
+            # If not define... get default zone
+            if id_zone is None:
+                shop = get_shop(resource)
+                id_zone = shop.get_property('shop_default_zone')
+            self.id_zone = int(id_zone)
+        return self.id_zone
+
+
+    def set_id_zone(self, id_zone):
+        # Taxes depends on zone, so we forget all taxed prices
+        self.id_zone = int(id_zone) if id_zone is not None else None
+        self.prices.clear()
+
+
+    def get(self, resource, key):
+        abspath = str(resource.get_abspath())
+        return self.prices.get(abspath, {}).get(key)
+
+
+    def set(self, resource, key, value):
+        abspath = str(resource.get_abspath())
+        self.prices.setdefault(abspath, {})[key] = value
+
+
+    def invalidate(self, resource):
+        abspath = str(resource.get_abspath())
+        self.prices.pop(abspath, None)
+
+
+
+def get_prices_cache(context=None):
+    if context is None:
+        context = get_context()
+    if context is None:
+        # Outside of a request (scripts, imports): nothing is memoized
+        return PricesCache(None)
+    cache = getattr(context, '_prices', None)
+    if cache is None:
+        cache = PricesCache(context)
+        context._prices = cache
+    return cache
+
+
+def is_price_property(name):
+    for key in price_properties:
+        if name.endswith(key):
+            return True
+    return False
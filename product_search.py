@@ -0,0 +1,380 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from standard library
+from datetime import datetime
+from math import log
+from re import compile, UNICODE
+from unicodedata import combining, normalize
+
+# Import from xapian
+from xapian import Stem
+
+# Import from shop
+from indexes import BackgroundIndex, get_index, get_index_if_built
+from indexes import register_index
+from transactions import after_commit
+from utils import get_parent_paths
+
+
+# Weight of the words by field
+TITLE_WEIGHT = 8
+REFERENCE_WEIGHT = 4
+MANUFACTURER_WEIGHT = 2
+TEXT_WEIGHT = 1
+# The products whose reference is the searched text come first
+EXACT_REFERENCE_SCORE = 1000
+# A word found with a typo counts half
+TYPO_PENALTY = 0.5
+TYPO_MIN_LENGTH = 4
+# The values the results can be sorted by (see SortBy_Enumerate)
+SORT_FIELDS = ('title', 'mtime', 'ctime', 'stored_price', 'stored_note',
+               'nb_reviews', 'abspath')
+
+# The stemmers of xapian (snowball)
+stemmers_names = {
+    'da': 'danish', 'de': 'german', 'en': 'english', 'es': 'spanish',
+    'fi': 'finnish', 'fr': 'french', 'hu': 'hungarian', 'it': 'italian',
+    'nl': 'dutch', 'no': 'norwegian', 'pt': 'portuguese', 'ro': 'romanian',
+    'ru': 'russian', 'sv': 'swedish', 'tr': 'turkish'}
+
+words_re = compile(r'\w+', UNICODE)
+
+
+#######################################################################
+# Words
+#######################################################################
+def fold(word):
+    """Remove the accents.
+    """
+    word = normalize('NFKD', word)
+    return u''.join([ x for x in word if not combining(x) ])
+
+
+def get_words(text):
+    return words_re.findall(text.lower())
+
+
+# {language: (Stem, {word: term})}
+stemmers = {}
+
+def get_term(word, language):
+    """The term indexed for the word: stemmed in the given language, then
+    without accents.
+    """
+    stemmer = stemmers.get(language)
+    if stemmer is None:
+        name = stemmers_names.get(language)
+        stemmer = stemmers[language] = (Stem(name) if name else None, {})
+    stem, terms = stemmer
+    term = terms.get(word)
+    if term is None:
+        term = word
+        if stem is not None:
+            term = unicode(stem(word.encode('utf-8')), 'utf-8')
+        term = terms[word] = fold(term)
+    return term
+
+
+def get_typos(term):
+    """The term with one letter removed, at any position.
+    """
+    return [ term[:i] + term[i+1:] for i in range(len(term)) ]
+
+
+
+#######################################################################
+# Index
+#######################################################################
+class ProductSearchIndex(BackgroundIndex):
+    """
+    Full-text index of the products of a site root.
+      - postings: {term: {product abspath: weight}}, the weight of a term
+        depends on the fields it is found in (title > reference >
+        manufacturer > text)
+      - references: {reference: set of products abspaths}, the references
+        of the products and of their declinations (for the exact matches)
+      - products: {abspath: (terms, references, info)}, to remove the
+        product from the index, and the values used to filter and to sort
+        the results
+    The index is built in the background (see shop.indexes), then it is
+    updated each time a product is indexed, moved or deleted (once the
+    transaction is committed).
+    """
+
+    def __init__(self):
+        BackgroundIndex.__init__(self)
+        self.postings = {}
+        self.references = {}
+        self.products = {}
+        # {term with one letter removed: set of terms}
+        # (built the first time a word is not found)
+        self.typos = None
+
+
+    def index_resource(self, product):
+        # The values computed when the product was indexed in the catalog
+        root = product.get_root()
+        abspath = str(product.get_abspath())
+        values = {}
+        for brain in root.search(abspath=abspath).get_documents():
+            for name in ['mtime', 'stored_note', 'nb_reviews']:
+                values[name] = getattr(brain, name, None)
+        self.index_product(*self.get_product_fields(product, values))
+
+
+    #######################################################################
+    # Update
+    #######################################################################
+    def index_product(self, abspath, fields, references, info):
+        """Index the product:
+          - fields: list of (weight, language, text)
+          - references: the references of the product and its declinations
+          - info: {'is_public', 'parent_paths', 'title', 'mtime', 'ctime',
+                   'stored_price', 'stored_note', 'nb_reviews'}
+        """
+        self.remove_product(abspath)
+        terms = {}
+        for weight, language, text in fields:
+            if not text:
+                continue
+            for word in get_words(text):
+                term = get_term(word, language)
+                terms[term] = terms.get(term, 0) + weight
+        for term, weight in terms.iteritems():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                if self.typos is not None:
+                    self._add_typos(term)
+            # Many occurrences do not count much more than one
+            postings[abspath] = 1 + log(weight)
+        references = [ x.upper() for x in references if x ]
+        for reference in references:
+            self.references.setdefault(reference, set()).add(abspath)
+        self.products[abspath] = (terms.keys(), references, info)
+
+
+    def remove_product(self, abspath):
+        product = self.products.pop(abspath, None)
+        if product is None:
+            return
+        terms, references, info = product
+        for term in terms:
+            postings = self.postings[term]
+            del postings[abspath]
+            if not postings:
+                # The term is kept in the typos, it is checked on search
+                del self.postings[term]
+        for reference in references:
+            products = self.references[reference]
+            products.discard(abspath)
+            if not products:
+                del self.references[reference]
+
+
+    def get_product_fields(self, product, values):
+        """Return the arguments of "index_product" for the given product,
+        "values" are its catalog values (text, mtime, stored_note,
+        nb_reviews), as far as they are known.
+        """
+        from products.declination import Declination
+        site_root = product.get_site_root()
+        languages = site_root.get_property('website_languages')
+        text = values.get('text')
+        if not isinstance(text, dict):
+            text = product.to_text()
+        fields = []
+        default_language = languages[0]
+        # Title and text
+        for language in languages:
+            title = product.get_property('title', language=language)
+            fields.append((TITLE_WEIGHT, language, title))
+            fields.append((TEXT_WEIGHT, language, text.get(language)))
+        # Manufacturer
+        manufacturer = product.get_property('manufacturer')
+        if manufacturer:
+            manufacturer = site_root.get_resource(manufacturer, soft=True)
+        if manufacturer:
+            for language in languages:
+                title = manufacturer.get_property('title', language=language)
+                fields.append((MANUFACTURER_WEIGHT, language, title))
+        # References
+        references = [product.get_property('reference')]
+        for declination in product.search_resources(cls=Declination):
+            references.append(declination.get_property('reference'))
+        for reference in references:
+            if reference:
+                fields.append((REFERENCE_WEIGHT, None,
+                               unicode(reference, 'utf-8')))
+        # Filters and sort
+        info = {'is_public': product.get_statename() == 'public',
+                'parent_paths': get_parent_paths(product.get_abspath()) or [],
+                'title': product.get_title(language=default_language),
+                'mtime': values.get('mtime') or datetime.min,
+                'ctime': product.get_property('ctime'),
+                'stored_price': int(product.get_price_with_tax() * 100),
+                'stored_note': values.get('stored_note') or 0,
+                'nb_reviews': values.get('nb_reviews') or 0}
+        abspath = str(product.get_abspath())
+        return abspath, fields, references, info
+
+
+    def update_product(self, product, values):
+        """Called when the product is indexed in the catalog, with its
+        catalog values.
+        """
+        values = dict(values)
+        # As the database does (the time of the commit)
+        values.setdefault('mtime', datetime.now())
+        fields = self.get_product_fields(product, values)
+        after_commit(self._update, *fields)
+
+
+    def _update(self, abspath, fields, references, info):
+        if self.is_built is False and self.is_building is False:
+            return
+        self.index_product(abspath, fields, references, info)
+
+
+    def remove_path(self, abspath):
+        """Remove the product at the given path and all the products below.
+        """
+        after_commit(self._remove_path, str(abspath))
+
+
+    def _remove_path(self, abspath):
+        if self.is_built is False and self.is_building is False:
+            return
+        prefix = abspath.rstrip('/') + '/'
+        for path in self.products.keys():
+            if path == abspath or path.startswith(prefix):
+                self.remove_product(path)
+
+
+    #######################################################################
+    # Search
+    #######################################################################
+    def _add_typos(self, term):
+        for typo in [term] + get_typos(term):
+            self.typos.setdefault(typo, set()).add(term)
+
+
+    def get_typo_terms(self, term):
+        """The terms at one letter (removed, added or replaced) from the
+        given term.
+        """
+        if self.typos is None:
+            self.typos = {}
+            for x in self.postings:
+                self._add_typos(x)
+        terms = set()
+        for typo in [term] + get_typos(term):
+            terms.update(self.typos.get(typo, []))
+        return [ x for x in terms if x in self.postings and x != term ]
+
+
+    def get_word_postings(self, word, languages, typos=True):
+        """Return the postings of the terms matching the word, as a list of
+        ({product abspath: weight}, factor).
+        """
+        nb_products = len(self.products) or 1
+        terms = set([ get_term(word, x) for x in languages ])
+        terms.add(get_term(word, None))
+        penalty = 1
+        found = [ x for x in terms if x in self.postings ]
+        if not found and typos and len(word) >= TYPO_MIN_LENGTH:
+            found = []
+            for term in terms:
+                found.extend(self.get_typo_terms(term))
+            penalty = TYPO_PENALTY
+        word_postings = []
+        for term in found:
+            postings = self.postings[term]
+            idf = log(1 + float(nb_products) / len(postings))
+            word_postings.append((postings, idf * penalty))
+        return word_postings
+
+
+    def search(self, text, languages, parent_path=None, stored_price=None,
+               only_public=True, typos=True, sort_by=None, reverse=False):
+        """Return the abspaths of the products matching all the words of the
+        text, by relevance (or sorted by one of SORT_FIELDS).
+        """
+        # Exact reference
+        scores = {}
+        for abspath in self.references.get(text.strip().upper(), []):
+            scores[abspath] = EXACT_REFERENCE_SCORE
+        # Words: start from the less frequent one
+        words = [ self.get_word_postings(x, languages, typos)
+                  for x in get_words(text) ]
+        words.sort(key=lambda x: sum([ len(y[0]) for y in x ]))
+        if words:
+            candidates = set()
+            for postings, factor in words[0]:
+                candidates.update(postings)
+            for word in words[1:]:
+                candidates = [ x for x in candidates
+                               if [ 1 for y in word if x in y[0] ] ]
+            # Score: the best term of each word
+            for abspath in candidates:
+                score = scores.get(abspath, 0)
+                for word in words:
+                    score += max([ postings.get(abspath, 0) * factor
+                                   for postings, factor in word ])
+                scores[abspath] = score
+        # Filters
+        results = []
+        for abspath, score in scores.iteritems():
+            info = self.products[abspath][2]
+            if only_public and not info['is_public']:
+                continue
+            if parent_path and parent_path not in info['parent_paths']:
+                continue
+            if stored_price:
+                price_min, price_max = stored_price
+                price = info['stored_price']
+                if price_min is not None and price < price_min:
+                    continue
+                if price_max is not None and price > price_max:
+                    continue
+            # Sort (without key function, faster)
+            if sort_by == 'abspath':
+                results.append((abspath,))
+            elif sort_by in SORT_FIELDS:
+                results.append((info[sort_by], abspath))
+            else:
+                results.append((-score, info['title'], abspath))
+        if sort_by in SORT_FIELDS:
+            results.sort(reverse=reverse)
+        else:
+            results.sort()
+        return [ x[-1] for x in results ]
+
+
+
+# {site root abspath: ProductSearchIndex}
+product_search_indexes = {}
+register_index(product_search_indexes, ProductSearchIndex)
+
+def get_product_search_index(shop):
+    """None until the index is built (see shop.indexes).
+    """
+    return get_index(product_search_indexes, ProductSearchIndex, shop)
+
+
+def get_product_search_index_if_built(resource):
+    return get_index_if_built(product_search_indexes, resource)
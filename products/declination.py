@@ -16,11 +16,13 @@
 
 # Import from standard library
 from decimal import Decimal as decimal
+from json import dumps
 
 # Import from itools
 from itools.core import merge_dicts
 from itools.datatypes import Boolean, String, Unicode, Integer, Decimal
 from itools.gettext import MSG
+from itools.uri import Path
 from itools.web import get_context, ERROR
 from itools.xapian import AndQuery, PhraseQuery
 
@@ -37,7 +39,9 @@ from ikaaro.views_new import NewInstance
 from enumerate import DeclinationImpact
 from dynamic_folder import DynamicFolder
 from widgets import DeclinationPricesWidget
+from shop.declinations_index import invalidate_declinations_index
 from shop.enumerate_table import EnumerateTable_to_Enumerate
+from shop.prices import get_prices_cache, is_price_property
 from shop.utils import get_shop
 
 
@@ -179,6 +183,8 @@ class Declination(DynamicFolder):
 
 
     def _get_catalog_values(self):
+        # The declination has been added or changed
+        invalidate_declinations_index(self.parent.get_abspath())
         return merge_dicts(
             DynamicFolder._get_catalog_values(self),
             self._get_dynamic_catalog_values(),
@@ -191,7 +197,16 @@ class Declination(DynamicFolder):
             # XXX Declination must be workflowaware
             is_default=self.get_property('is_default'),
             workflow_state=self.parent.get_workflow_state(),
-            stock_quantity=self.get_property('stock-quantity'))
+            stock_quantity=self.get_property('stock-quantity'),
+            # See shop.catalog_export
+            price_impacts=dumps(dict([
+                (x, str(self.get_price_impact(x))) for x in ['', 'pro-'] ])))
+
+
+    def _on_move_resource(self, source):
+        DynamicFolder._on_move_resource(self, source)
+        invalidate_declinations_index(Path(source).resolve2('..'))
+        invalidate_declinations_index(self.parent.get_abspath())
 
 
     def _get_dynamic_catalog_values(self):
@@ -209,6 +224,15 @@ class Declination(DynamicFolder):
         return values
 
 
+    def set_property(self, name, value, language=None, with_dynamic=True):
+        if is_price_property(name):
+            get_prices_cache().invalidate(self.parent)
+        # Price impact, stock, options...
+        invalidate_declinations_index(self.parent.get_abspath())
+        return DynamicFolder.set_property(self, name, value, language,
+                                          with_dynamic)
+
+
     def get_declination_title(self):
         title = u''
         dynamic_schema = self.get_dynamic_schema()
@@ -262,3 +286,4 @@ class Declination(DynamicFolder):
 register_resource_class(Declination)
 register_field('declination_title', Unicode(is_indexed=True, is_stored=True))
 register_field('is_default', Boolean(is_indexed=True))
+register_field('price_impacts', String(is_stored=True))
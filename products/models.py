@@ -141,6 +141,20 @@ class ProductTypeTable(OrderedTableFile):
         'datatype': Datatypes(mandatory=True, is_indexed=True, index='keyword'),
         }
 
+    # Compiled schema (see ProductModel.get_compiled_schema)
+    compiled_schema = None
+
+
+    def reset(self):
+        OrderedTableFile.reset(self)
+        self.compiled_schema = None
+
+
+    def set_changed(self):
+        OrderedTableFile.set_changed(self)
+        # The schema has changed, it must be compiled again
+        self.compiled_schema = None
+
 
 
 class ProductModelSchema(OrderedTable):
@@ -211,14 +225,30 @@ class ProductModel(ShopFolder):
         return []
 
 
+    def get_compiled_schema(self):
+        """The schema table compiled as a list of fields (in order):
+          {'name': ..., 'datatype': ..., 'widget': ..., 'record': ...}
+        It is kept by the handler of the table until the table changes.
+        """
+        schema_handler = self.get_resource('schema').handler
+        if schema_handler.compiled_schema is None:
+            get_value = schema_handler.get_record_value
+            fields = []
+            for record in schema_handler.get_records_in_order():
+                datatype = get_real_datatype(schema_handler, record)
+                fields.append(
+                    {'name': get_value(record, 'name'),
+                     'datatype': datatype,
+                     'widget': get_default_widget_shop(datatype),
+                     'record': record})
+            schema_handler.compiled_schema = fields
+        return schema_handler.compiled_schema
+
+
     def get_model_schema(self):
         schema = {}
-        schema_resource = self.get_resource('schema')
-        schema_handler = schema_resource.handler
-        get_value = schema_handler.get_record_value
-        for record in schema_handler.get_records_in_order():
-            name = get_value(record, 'name')
-            schema[name] = get_real_datatype(schema_handler, record)
+        for field in self.get_compiled_schema():
+            schema[field['name']] = field['datatype']
         return schema
 
 
@@ -226,12 +256,10 @@ class ProductModel(ShopFolder):
         widgets = []
         schema_handler = self.get_resource('schema').handler
         get_value = schema_handler.get_record_value
-        for record in schema_handler.get_records_in_order():
-            name = get_value(record, 'name')
-            datatype = get_real_datatype(schema_handler, record)
-            widget = get_default_widget_shop(datatype)
-            title = get_value(record, 'title')
-            widget = widget(name, title=title, has_empty_option=False)
+        for field in self.get_compiled_schema():
+            title = get_value(field['record'], 'title')
+            widget = field['widget'](field['name'], title=title,
+                                     has_empty_option=False)
             widgets.append(widget)
         return widgets
 
@@ -247,12 +275,13 @@ class ProductModel(ShopFolder):
         dynamic_schema = self.get_model_schema()
         schema_handler = self.get_resource('schema').handler
         get_value = schema_handler.get_record_value
-        for record in schema_handler.get_records_in_order():
-            name = get_value(record, 'name')
+        for field in self.get_compiled_schema():
+            name = field['name']
+            record = field['record']
             value = real_value = resource.get_dynamic_property(name, dynamic_schema)
             # Real value is used to keep the enumerate value
             # corresponding to the options[{'name': xxx}]
-            datatype = dynamic_schema[name]
+            datatype = field['datatype']
             if value and hasattr(datatype, 'render'):
                 value = datatype.render(value, context)
             # Build kw
@@ -17,6 +17,7 @@
 # Import from standard library
 from decimal import Decimal as decimal
 from datetime import datetime
+from hashlib import md5
 from json import dumps
 
 # Import from itools
@@ -49,18 +50,25 @@ from product_views import Product_CrossSellingViewBox
 from product_views import Product_View, Product_Edit, Product_AddLinkFile
 from product_views import Product_Delete
 from product_views import Product_Print, Product_SendToFriend
-from product_views import Product_DeclinationsView
+from product_views import Product_DeclinationsView, Product_DeclinationsJSON
 from product_views import Product_ChangeProductModel, Products_Stock
 from schema import product_schema
 from taxes import TaxesEnumerate
-from shop.cart import ProductCart
+from shop.declinations_index import get_declinations_index
+from shop.declinations_index import get_declinations_index_if_built
+from shop.declinations_index import invalidate_declinations_index
+from shop.barcodes import get_barcodes_cache
 from shop.enumerate_table import EnumerateTable_to_Enumerate
 from shop.enumerate_table import Restricted_EnumerateTable_to_Enumerate
+from shop.autocomplete import get_autocomplete_index_if_built
 from shop.folder import ShopFolder
 from shop.manufacturers import ManufacturersEnumerate
 from shop.modules import ModuleLoader
+from shop.prices import get_prices_cache, is_price_property
+from shop.product_search import get_product_search_index_if_built
+from shop.products_counts import get_products_counts_if_built
 from shop.shop_views import Shop_Login, Shop_Register
-from shop.utils import get_shop, get_group_name, format_price, generate_barcode
+from shop.utils import get_shop, get_group_name, format_price
 from shop.utils import CurrentFolder_AddImage, MiniTitle, get_product_filters
 
 
@@ -114,6 +122,7 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
     add_link_file = Product_AddLinkFile()
     change_product_model = Product_ChangeProductModel()
     declinations = Product_DeclinationsView()
+    declinations_json = Product_DeclinationsJSON()
     new_declination = Declination_NewInstance()
     order = GoToSpecificDocument(specific_document='order-photos',
                                  title=MSG(u'Manage photos'),
@@ -197,6 +206,8 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
 
 
     def _get_catalog_values(self):
+        # The declinations depend on the product (weight...)
+        invalidate_declinations_index(self.get_abspath())
         values = merge_dicts(DynamicFolder._get_catalog_values(self),
                              TagsAware._get_catalog_values(self),
                              self._get_dynamic_catalog_values())
@@ -236,6 +247,50 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         values['has_reduction'] = self.get_property('has_reduction')
         # not_buyable_by_groups
         values['not_buyable_by_groups'] = self.get_property('not_buyable_by_groups')
+        # View box (see Product_ViewBox.get_brain_namespace)
+        # The cover of the product: None to use the default cover of the
+        # category, [None, None] if the image is missing
+        cover = self.get_property('cover')
+        if cover:
+            cover = self.get_resource(cover, soft=True)
+            if cover is None:
+                cover = [None, None]
+            else:
+                cover = [str(cover.get_abspath()), cover.handler.key]
+        values['viewbox_cover'] = dumps(cover or None)
+        languages = self.get_site_root().get_property('website_languages')
+        manufacturer = self.get_property('manufacturer')
+        if manufacturer:
+            manufacturer = self.get_resource(manufacturer, soft=True)
+        if manufacturer:
+            values['manufacturer_title'] = dict([
+                (x, manufacturer.get_title(language=x)) for x in languages ])
+        values['product_description'] = dict([
+            (x, self.get_property('description', language=x))
+            for x in languages ])
+        values['viewbox_prices'] = self.get_viewbox_prices()
+        # Reviews (see shop.modules.review)
+        reviews = self.get_resource('reviews', soft=True)
+        if reviews is not None:
+            values.update(reviews.get_reviews_aggregates())
+        else:
+            values['nb_reviews'] = 0
+            values['stored_note'] = 0
+        # Update the number of products by category
+        counts = get_products_counts_if_built(self)
+        if (counts is not None and
+            self.class_id == get_shop(self).product_class.class_id):
+            counts.update_product(self)
+        # Update the search index
+        index = get_product_search_index_if_built(self)
+        if (index is not None and
+            self.class_id == get_shop(self).product_class.class_id):
+            index.update_product(self, values)
+        # And the autocomplete index
+        index = get_autocomplete_index_if_built(self)
+        if (index is not None and
+            self.class_id == get_shop(self).product_class.class_id):
+            index.update_product(self)
         return values
 
 
@@ -359,12 +414,33 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         return schema
 
 
-    def get_javascript_namespace(self, declinations):
+    def get_javascript_namespace(self):
+        return self.get_javascript_cache()[0]
+
+
+    def get_javascript_cache(self):
+        """Return the JSON of the declinations and its ETag.
+        The JSON is kept with the declinations index, by product mtime,
+        price prefix, zone and devise.
+        """
+        prices = get_prices_cache()
+        shop = get_shop(self)
+        key = (self.get_mtime(), prices.get_prefix(self),
+               prices.get_id_zone(self), shop.get_property('devise'))
+        javascript = get_declinations_index(self).javascript
+        cached = javascript.get(key)
+        if cached is None:
+            data = self._get_javascript_namespace()
+            cached = javascript[key] = (data, '"%s"' % md5(data).hexdigest())
+        return cached
+
+
+    def _get_javascript_namespace(self):
         # XXX
         # We have to Add price without tax (Before and after reduction)
         # XXX If handle_stock property is false manage_stock should be false
         manage_stock = self.get_stock_option() != 'accept'
-        purchase_options_names = self.get_purchase_options_names()
+        declinations = get_declinations_index(self).declinations
         # Base product
         stock_quantity = self.get_property('stock-quantity')
         products = {}
@@ -379,41 +455,33 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
                 'stock': stock_quantity if manage_stock else None}
         # Other products (declinations)
         for declination in declinations:
-            dynamic_schema = declination.get_dynamic_schema()
-            stock_quantity = declination.get_quantity_in_stock()
-            price_ht = self.get_price_without_tax(id_declination=declination.name)
-            price_ttc = self.get_price_with_tax(id_declination=declination.name)
+            name = declination['name']
+            price_ht = self.get_price_without_tax(id_declination=name)
+            price_ttc = self.get_price_with_tax(id_declination=name)
             image = None#declination.get_property('associated-image')
-            products[declination.name] = {
+            products[name] = {
               'price_ht': format_price(price_ht),
               'price_ttc': format_price(price_ttc),
-              'weight': str(declination.get_weight()),
+              'weight': str(declination['weight']),
               'image': get_uri_name(image) if image else None,
-              'is_default': declination.get_property('is_default'),
-              'option': {},
-              'stock': stock_quantity if manage_stock else None}
-            for name in purchase_options_names:
-                value = declination.get_dynamic_property(name, dynamic_schema)
-                if value:
-                    products[declination.name]['option'][name] = value
+              'is_default': declination['is_default'],
+              'option': declination['options'].copy(),
+              'stock': declination['stock'] if manage_stock else None}
         return dumps(products)
 
 
-    def get_purchase_options_namespace(self, declinations):
+    def get_purchase_options_namespace(self):
         namespace = []
         shop = get_shop(self)
-        purchase_options_names = self.get_purchase_options_names()
+        index = get_declinations_index(self)
+        purchase_options_names = index.purchase_options_names
         values = {}
         # Has declination ?
-        if not declinations:
+        if not index.declinations:
             return namespace
         # Get uniques purchase option values
-        for declination in declinations:
-            dynamic_schema = declination.get_dynamic_schema()
-            for name in purchase_options_names:
-                value = declination.get_dynamic_property(name, dynamic_schema)
-                if not value:
-                    continue
+        for declination in index.declinations:
+            for name, value in declination['options'].items():
                 if not values.has_key(name):
                     values[name] = set([])
                 values[name].add(value)
@@ -443,15 +511,7 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         ==> Return name of declination if exist
         ==> Return None if not exist
         """
-        purchase_options_schema = self.get_purchase_options_schema()
-        for declination in self.search_resources(cls=Declination):
-            dynamic_schema = declination.get_dynamic_schema()
-            value = [kw.get(x) ==
-                  (declination.get_dynamic_property(x, dynamic_schema) or None)
-                        for x in purchase_options_schema]
-            if set(value) == set([True]):
-                return declination.name
-        return None
+        return get_declinations_index(self).get_declination(kw)
 
 
     def get_declination_namespace(self, declination_name):
@@ -547,6 +607,24 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         return ns
 
 
+    def get_viewbox_prices(self):
+        """The prices of the product, stored in the catalog to render the
+        view box without loading the product (the tax depends on the zone
+        of the customer): {prefix: [without tax, without tax before
+        reduction, has reduction, tax]}
+        """
+        prices = {}
+        for prefix in ['', 'pro-']:
+            tax = TaxesEnumerate.get_value(self.get_property('%stax' % prefix))
+            prices[prefix] = [
+                str(self.get_price_without_tax(prefix=prefix)),
+                str(self.get_price_without_tax(with_reduction=False,
+                                               prefix=prefix)),
+                self.get_property('%shas_reduction' % prefix),
+                str(tax or decimal(0))]
+        return dumps(prices)
+
+
     def get_cross_selling_namespace(self, context):
         from shop.categories import Category
         table = self.get_resource('cross-selling', soft=True)
@@ -761,6 +839,14 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         resource.set_property('stock-quantity', new_quantity)
 
 
+    def add_sold_quantity(self, quantity):
+        """The sold quantity is the popularity of the product (quantity is
+        negative when an order is cancelled).
+        """
+        sold_quantity = self.get_property('sold-quantity') or 0
+        self.set_property('sold-quantity', max(sold_quantity + quantity, 0))
+
+
     def get_quantity_in_stock(self):
         return self.get_property('stock-quantity')
 
@@ -786,26 +872,27 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
 
 
     def get_price_prefix(self):
-        shop = get_shop(self)
-        context = get_context()
-        group_name = get_group_name(shop, context)
-        if get_uri_name(group_name) == 'pro':
-            return 'pro-'
-        return ''
+        return get_prices_cache().get_prefix(self)
 
 
     def get_tax_value(self, prefix=None):
-        shop = get_shop(self)
+        prices = get_prices_cache()
         if prefix is None:
-            prefix = self.get_price_prefix()
-        # Get zone from cookie
-        id_zone = ProductCart(get_context()).id_zone
-        # If not define... get default zone
-        if id_zone is None:
-            id_zone = shop.get_property('shop_default_zone')
+            prefix = prices.get_prefix(self)
+        id_zone = prices.get_id_zone(self)
+        key = ('tax', prefix, id_zone)
+        tax_value = prices.get(self, key)
+        if tax_value is None:
+            tax_value = self._get_tax_value(prefix, id_zone)
+            prices.set(self, key, tax_value)
+        return tax_value
+
+
+    def _get_tax_value(self, prefix, id_zone):
+        shop = get_shop(self)
         # Check if zone has tax ?
         zones = shop.get_resource('countries-zones').handler
-        zone_record = zones.get_record(int(id_zone))
+        zone_record = zones.get_record(id_zone)
         if zones.get_record_value(zone_record, 'has_tax') is True:
             tax = self.get_property('%stax'% prefix)
             tax_value = TaxesEnumerate.get_value(tax) or decimal(0)
@@ -816,8 +903,22 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
 
     def get_price_without_tax(self, id_declination=None,
                                with_reduction=True, pretty=False, prefix=None):
+        prices = get_prices_cache()
         if prefix is None:
-            prefix = self.get_price_prefix()
+            prefix = prices.get_prefix(self)
+        key = ('without_tax', id_declination, prefix, with_reduction)
+        price = prices.get(self, key)
+        if price is None:
+            price = self._get_price_without_tax(id_declination,
+                                                with_reduction, prefix)
+            prices.set(self, key, price)
+        # Format price
+        if pretty is True:
+            return format_price(price)
+        return price
+
+
+    def _get_price_without_tax(self, id_declination, with_reduction, prefix):
         # Base price
         if with_reduction is True and self.get_property('%shas_reduction' % prefix):
             price = self.get_property('%sreduce-pre-tax-price' % prefix)
@@ -825,19 +926,33 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
             price = self.get_property('%spre-tax-price' % prefix)
         # Declination
         if id_declination:
-            declination = self.get_resource(id_declination)
-            price = price + declination.get_price_impact(prefix)
-        # Format price
-        if pretty is True:
-            return format_price(price)
+            impact = None
+            index = get_declinations_index_if_built(self)
+            if index is not None:
+                declination = index.by_name.get(id_declination)
+                if declination:
+                    impact = declination['price_impact'].get(prefix)
+            if impact is None:
+                # Not indexed yet, or a group with its own prefix
+                declination = self.get_resource(id_declination)
+                impact = declination.get_price_impact(prefix)
+            price = price + impact
         return price
 
 
     def get_price_with_tax(self, id_declination=None,
                             with_reduction=True, pretty=False, prefix=None):
-        price = self.get_price_without_tax(id_declination,
-                    with_reduction=with_reduction, prefix=prefix)
-        price = price * self.get_tax_value(prefix=prefix)
+        prices = get_prices_cache()
+        if prefix is None:
+            prefix = prices.get_prefix(self)
+        id_zone = prices.get_id_zone(self)
+        key = ('with_tax', id_declination, prefix, id_zone, with_reduction)
+        price = prices.get(self, key)
+        if price is None:
+            price = self.get_price_without_tax(id_declination,
+                        with_reduction=with_reduction, prefix=prefix)
+            price = price * self.get_tax_value(prefix=prefix)
+            prices.set(self, key, price)
         # Format price
         if pretty is True:
             return format_price(price)
@@ -846,6 +961,12 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
 
     def get_weight(self, id_declination=None):
         if id_declination:
+            index = get_declinations_index_if_built(self)
+            if index is not None:
+                declination = index.by_name.get(id_declination)
+                if declination:
+                    return declination['weight']
+            # Not indexed yet
             declination = self.get_resource(id_declination, soft=True)
             if declination:
                 return declination.get_weight()
@@ -855,7 +976,8 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
     def save_barcode(self, reference):
         shop = get_shop(self)
         format = shop.get_property('barcode_format')
-        barcode = generate_barcode(format, reference)
+        cache = get_barcodes_cache(get_context().server.target)
+        barcode = cache.get_barcode(format, reference)
         if not barcode:
             return
         self.del_resource('barcode', soft=True)
@@ -913,6 +1035,32 @@ class Product(WorkflowAware, TagsAware, DynamicFolder):
         return ['view', 'edit'] + self.default_class_views
 
 
+    def set_property(self, name, value, language=None, with_dynamic=True):
+        if is_price_property(name):
+            get_prices_cache().invalidate(self)
+        return DynamicFolder.set_property(self, name, value, language,
+                                          with_dynamic)
+
+
+    def del_property(self, name):
+        if is_price_property(name):
+            get_prices_cache().invalidate(self)
+        return DynamicFolder.del_property(self, name)
+
+
+    def _on_move_resource(self, source):
+        DynamicFolder._on_move_resource(self, source)
+        counts = get_products_counts_if_built(self)
+        if counts is not None:
+            counts.remove_path(source)
+        index = get_product_search_index_if_built(self)
+        if index is not None:
+            index.remove_path(source)
+        index = get_autocomplete_index_if_built(self)
+        if index is not None:
+            index.remove_path(source)
+
+
     def get_links(self):
         return DynamicFolder.get_links(self)
 
@@ -969,6 +1117,11 @@ register_field('ttc_price', Decimal(is_indexed=True, is_stored=True))
 # XXX xapian can't sort decimal
 register_field('stored_price', Integer(is_indexed=False, is_stored=True))
 register_field('stored_weight', Integer(is_indexed=False, is_stored=True))
+# View box (see Product_ViewBox.get_brain_namespace)
+register_field('viewbox_cover', String(is_stored=True))
+register_field('manufacturer_title', Unicode(is_stored=True))
+register_field('product_description', Unicode(is_stored=True))
+register_field('viewbox_prices', String(is_stored=True))
 
 # Register resources
 register_resource_class(Product)
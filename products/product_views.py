@@ -17,14 +17,18 @@
 # Import from standard library
 from copy import deepcopy
 from datetime import datetime
+from decimal import Decimal as decimal
+from json import loads
 
 # Import from itools
 from itools.core import merge_dicts
 from itools.datatypes import Email, Integer, String, Unicode, DateTime
 from itools.gettext import MSG
 from itools.handlers import checkid
-from itools.uri import get_reference
-from itools.web import INFO, ERROR, STLView, STLForm, FormError, get_context
+from itools.stl import stl
+from itools.uri import Path, get_reference
+from itools.web import BaseView, INFO, ERROR, STLView, STLForm, FormError
+from itools.web import get_context
 from itools.xapian import PhraseQuery
 from itools.xml import XMLParser
 
@@ -54,11 +58,13 @@ from widgets import BarcodeWidget, MiniProductWidget
 from widgets import ProductModelWidget, ProductModel_DeletedInformations
 from widgets import StockWidget
 from shop.buttons import BatchEditionButton
-from shop.cart import ProductCart
+from shop.cart import get_cart
 from shop.datatypes import UserGroup_Enumerate, DecimalRangeDatatype, ThreeStateBoolean
 from shop.manufacturers import ManufacturersEnumerate
+from shop.prices import get_prices_cache
 from shop.suppliers import SuppliersEnumerate
 from shop.utils import bool_to_img, get_non_empty_widgets, get_shop, get_skin_template
+from shop.utils import format_price
 from shop.utils_views import SearchTableFolder_View
 from shop.forms import ThreeStateBooleanRadio
 from shop.widgets import NumberRangeWidget
@@ -159,9 +165,8 @@ class Product_View(STLForm):
 
     def get_namespace(self, resource, context):
         context.scripts.append('/ui/shop/js/declinations.js')
-        declinations = list(resource.search_resources(cls=Declination))
-        javascript_products = resource.get_javascript_namespace(declinations)
-        purchase_options = resource.get_purchase_options_namespace(declinations)
+        javascript_products = resource.get_javascript_namespace()
+        purchase_options = resource.get_purchase_options_namespace()
         return merge_dicts(resource.get_namespace(context),
                            javascript_products=javascript_products,
                            purchase_options=purchase_options)
@@ -170,7 +175,7 @@ class Product_View(STLForm):
     action_add_to_cart_schema = {'quantity': Integer(default=1)}
     def action_add_to_cart(self, resource, context, form):
         """ Add to cart """
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Check if we can add to cart
         if not resource.is_buyable(context):
             msg = MSG(u"This product isn't buyable")
@@ -394,6 +399,98 @@ class Product_ViewBox(STLView):
         return resource.get_small_namespace(context)
 
 
+    def get_brain_namespace(self, resource, brain, context, categories):
+        """The namespace of the view box from the values stored in the
+        catalog (see Product._get_catalog_values), without loading the
+        product:
+          - resource: the resource of the view (the category)
+          - categories: {path: (namespace, default cover)} of the parents
+            of the products already rendered
+        Only title, href, cover, description, manufacturer, price,
+        reference and the reviews are available.
+        """
+        site_root = context.site_root
+        site_root_path = site_root.get_abspath()
+        abspath = Path(brain.abspath)
+        # Category (and its default cover)
+        parent_path = str(abspath[:-1])
+        category = categories.get(parent_path)
+        if category is None:
+            parent = site_root.get_resource(parent_path)
+            default_cover = parent.get_property('default_product_cover')
+            if default_cover:
+                default_cover = parent.get_resource(default_cover, soft=True)
+            if default_cover:
+                default_cover = [str(default_cover.get_abspath()),
+                                 default_cover.handler.key]
+            category = ({'name': parent.name,
+                         'href': context.get_link(parent),
+                         'title': parent.get_title()},
+                        default_cover)
+            categories[parent_path] = category
+        category, default_cover = category
+        # Cover (as Product.get_cover_namespace)
+        cover = loads(brain.viewbox_cover)
+        if cover is None:
+            cover = default_cover
+        cover_path, cover_key = cover or [None, None]
+        cover = None
+        if cover_path:
+            cover = {
+                'href': '/%s' % site_root_path.get_pathto(Path(cover_path)),
+                'name': cover_path.rsplit('/', 1)[-1],
+                'key': cover_key,
+                'title': brain.title}
+        # Price
+        prices = get_prices_cache()
+        prefix = prices.get_prefix(resource)
+        without_tax, before_reduction, has_reduction, tax = loads(
+            brain.viewbox_prices)[prefix]
+        without_tax = decimal(without_tax)
+        before_reduction = decimal(before_reduction)
+        tax_value = decimal(1)
+        shop = get_shop(resource)
+        zones = shop.get_resource('countries-zones').handler
+        zone_record = zones.get_record(prices.get_id_zone(resource))
+        if zones.get_record_value(zone_record, 'has_tax') is True:
+            tax_value = decimal(tax) / decimal(100) + 1
+        price = {'with_tax': format_price(without_tax * tax_value),
+                 'without_tax': format_price(without_tax),
+                 'has_reduction': has_reduction}
+        if has_reduction:
+            price['with_tax_before_reduction'] = format_price(
+                before_reduction * tax_value)
+            price['without_tax_before_reduction'] = format_price(
+                before_reduction)
+        # Lang (usefull to show contextuel images)
+        ws_languages = site_root.get_property('website_languages')
+        lang = context.accept_language.select_language(ws_languages)
+        # Reviews
+        note = None
+        if brain.nb_reviews:
+            note = brain.stored_note / 100.0
+        return {
+          'name': brain.name,
+          'lang': lang,
+          'category': category,
+          'cover': cover,
+          'description': brain.product_description,
+          'href': '/%s' % site_root_path.get_pathto(abspath),
+          'manufacturer': brain.manufacturer_title,
+          'price': price,
+          'reference': brain.reference,
+          'title': brain.title,
+          'nb_reviews': brain.nb_reviews,
+          'note': note}
+
+
+    def render_brain(self, resource, brain, context, categories):
+        namespace = self.get_brain_namespace(resource, brain, context,
+                                             categories)
+        template = self.get_template(resource, context)
+        return stl(template, namespace)
+
+
 class Product_CrossSellingViewBox(Product_ViewBox):
 
     skin_template = '/product/product_viewbox_cs.xml'
@@ -606,6 +703,22 @@ class Product_Print(STLView):
 
 
 
+class Product_DeclinationsJSON(BaseView):
+
+    access = 'is_allowed_to_view'
+
+    def GET(self, resource, context):
+        data, etag = resource.get_javascript_cache()
+        context.set_header('etag', etag)
+        context.set_header('cache-control', 'private, must-revalidate')
+        if context.get_header('if-none-match') == etag:
+            context.status = 304
+            return None
+        context.set_content_type('application/json')
+        return data
+
+
+
 class Product_SendToFriend(AutoForm):
 
     access = True
@@ -715,6 +828,9 @@ class Product_DeclinationsView(BrowseFormBatchNumeric):
         for option in UserGroup_Enumerate.get_options():
             group = context.root.get_resource(option['name'])
             groups.append(group)
+        # Barcodes
+        shop_uri = context.resource.get_pathto(shop)
+        barcode_format = shop.get_property('barcode_format')
         # Get all declinations
         for declination in resource.search_resources(cls=Declination):
             name = declination.name
@@ -740,10 +856,10 @@ class Product_DeclinationsView(BrowseFormBatchNumeric):
             else:
                 kw['img'] = None
             # Barcode
-            shop_uri = context.resource.get_pathto(shop)
             reference = declination.get_property('reference')
-            kw['barcode'] = XMLParser('<img src="%s/;barcode?reference=%s"/>' %
-                                      (shop_uri, reference))
+            kw['barcode'] = XMLParser(
+                '<img src="%s/;barcode?reference=%s&amp;format=%s"/>' %
+                (shop_uri, reference, barcode_format))
             # Weight
             base_weight = resource.get_property('weight')
             weight_impact = declination.get_property('impact-on-weight')
@@ -0,0 +1,149 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from itools
+from itools.uri import Path
+from itools.web import get_context
+from itools.xapian import AndQuery, PhraseQuery
+
+# Import from shop
+from transactions import after_commit
+from utils import get_parent_paths
+
+
+class ProductsCounts(object):
+    """
+    Number of products by category (in fact by parent path).
+    For each path we store the number of products:
+      (False, None)  => all the products
+      (True, None)   => the public products
+      (False, group) => the products not buyable by the group
+      (True, group)  => the public products not buyable by the group
+    The counts are built from the catalog the first time they are needed,
+    then they are updated each time a product is indexed, moved or
+    deleted (once the transaction is committed).
+    """
+
+    def __init__(self):
+        self.is_built = False
+        # {product abspath: (is_public, not_buyable_by_groups)}
+        self.products = {}
+        # {parent path: {(only_public, group): nb}}
+        self.counts = {}
+
+
+    def rebuild(self, shop):
+        self.products = {}
+        self.counts = {}
+        root = shop.get_root()
+        site_root = shop.get_site_root()
+        base_query = [PhraseQuery('format', shop.product_class.class_id),
+                      PhraseQuery('parent_paths', str(site_root.get_abspath()))]
+        def search(*args):
+            query = AndQuery(*(base_query + list(args)))
+            return [ x.abspath for x in root.search(query).get_documents() ]
+        # Public products
+        public = set(search(PhraseQuery('workflow_state', 'public')))
+        # Not buyable products by group
+        groups = {}
+        catalog = get_context().database.catalog
+        for group in catalog.get_unique_values('not_buyable_by_groups'):
+            query = PhraseQuery('not_buyable_by_groups', group)
+            for abspath in search(query):
+                groups.setdefault(abspath, []).append(group)
+        # Count
+        for abspath in search():
+            self._add(abspath, abspath in public, groups.get(abspath, []))
+        self.is_built = True
+
+
+    def _add(self, abspath, is_public, groups, n=1):
+        self.products[abspath] = (is_public, groups)
+        for path in get_parent_paths(Path(abspath)) or []:
+            counts = self.counts.setdefault(path, {})
+            keys = [(False, None)] + [ (False, x) for x in groups ]
+            if is_public:
+                keys += [(True, None)] + [ (True, x) for x in groups ]
+            for key in keys:
+                counts[key] = counts.get(key, 0) + n
+
+
+    def _remove(self, abspath):
+        if abspath not in self.products:
+            return
+        is_public, groups = self.products[abspath]
+        self._add(abspath, is_public, groups, n=-1)
+        del self.products[abspath]
+
+
+    def update_product(self, product):
+        abspath = str(product.get_abspath())
+        is_public = (product.get_statename() == 'public')
+        groups = list(product.get_property('not_buyable_by_groups'))
+        after_commit(self._update, abspath, is_public, groups)
+
+
+    def _update(self, abspath, is_public, groups):
+        if self.is_built is False:
+            return
+        self._remove(abspath)
+        self._add(abspath, is_public, groups)
+
+
+    def remove_path(self, abspath):
+        """Remove the product at the given path and all the products below.
+        """
+        after_commit(self._remove_path, str(abspath))
+
+
+    def _remove_path(self, abspath):
+        if self.is_built is False:
+            return
+        prefix = abspath.rstrip('/') + '/'
+        for path in self.products.keys():
+            if path == abspath or path.startswith(prefix):
+                self._remove(path)
+
+
+    def get_nb_products(self, abspath, only_public=False, group=None):
+        counts = self.counts.get(str(abspath))
+        if counts is None:
+            return 0
+        nb_products = counts.get((only_public, None), 0)
+        if group is not None:
+            nb_products -= counts.get((only_public, group), 0)
+        return nb_products
+
+
+
+# {site root abspath: ProductsCounts}
+products_counts = {}
+
+def get_products_counts(shop):
+    site_root = str(shop.get_site_root().get_abspath())
+    counts = products_counts.get(site_root)
+    if counts is None:
+        counts = products_counts[site_root] = ProductsCounts()
+    if counts.is_built is False:
+        counts.rebuild(shop)
+    return counts
+
+
+def get_products_counts_if_built(resource):
+    """To update the counts only if they have been built.
+    """
+    site_root = str(resource.get_site_root().get_abspath())
+    return products_counts.get(site_root)
@@ -78,6 +78,8 @@ class Root(BaseRoot):
 
     def internal_server_error(self, context):
         # We send an email to administrators
+        # (now, the transaction will be aborted, see shop.outbox)
+        context.emails_after_commit = False
         for email in self.get_property('administrators'):
             subject = MSG(u'Internal server error').gettext()
             headers = u'\n'.join([u'%s => %s' % (x, y)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from optparse import OptionParser
+from random import choice, randint, random, seed
+from time import time
+
+# Import from itools
+import itools
+from itools.datatypes import Integer, String
+from itools.xapian import make_catalog
+from itools.xapian import AndQuery, PhraseQuery, RangeQuery
+
+# Import from shop
+from shop.facets import FacetsCounter
+
+
+fields = {
+    'abspath': String(is_key_field=True, is_stored=True, is_indexed=True),
+    'format': String(is_indexed=True),
+    'workflow_state': String(is_indexed=True),
+    'parent_paths': String(is_indexed=True, multiple=True),
+    'DFT-color': String(is_indexed=True),
+    'DFT-size': String(is_indexed=True),
+    'stored_price': Integer(is_indexed=False, is_stored=True),
+    'stored_weight': Integer(is_indexed=False, is_stored=True)}
+
+colors = [ 'color-%d' % x for x in range(20) ]
+sizes = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+categories = [ '/shop/categories/%d' % x for x in range(30) ]
+
+
+class BenchmarkContext(object):
+
+    def __init__(self, catalog):
+        self.database = self
+        self.catalog = catalog
+        self.root = catalog
+
+
+
+def build_catalog(nb_products):
+    seed(0)
+    catalog = make_catalog(None, fields)
+    for i in range(nb_products):
+        values = {
+            'abspath': '/shop/products/product-%d' % i,
+            'format': 'product',
+            'workflow_state': 'public' if random() < 0.9 else 'private',
+            'parent_paths': ['/', '/shop', '/shop/categories',
+                             choice(categories)],
+            'DFT-color': choice(colors),
+            'DFT-size': choice(sizes),
+            'stored_price': randint(100, 100000),
+            'stored_weight': randint(0, 5000)}
+        catalog.index_document(values)
+    return catalog
+
+
+def get_facets():
+    """The facets of a filter box by criterium.
+    """
+    prices = [None, 1000, 5000, 10000, 50000, None]
+    weights = [None, 500, 1000, 2000, None]
+    return [
+        ('DFT-color', [None] +
+            [ PhraseQuery('DFT-color', x) for x in colors ]),
+        ('DFT-size', [None] +
+            [ PhraseQuery('DFT-size', x) for x in sizes ]),
+        ('parent_paths', [None] +
+            [ PhraseQuery('parent_paths', x) for x in categories ]),
+        ('stored_price', [ RangeQuery('stored_price', x, y)
+                           for x, y in zip(prices, prices[1:]) ]),
+        ('stored_weight', [ RangeQuery('stored_weight', x, y)
+                            for x, y in zip(weights, weights[1:]) ])]
+
+
+def count_by_search(catalog, base_query, facets):
+    """As the filter box did before: one catalog search by value.
+    """
+    counts = []
+    for query in facets:
+        if query is None:
+            counts.append(len(catalog.search(base_query)))
+        else:
+            counts.append(len(catalog.search(AndQuery(base_query, query))))
+    return counts
+
+
+def count_by_counter(catalog, base_query, facets):
+    counter = FacetsCounter(BenchmarkContext(catalog), base_query)
+    return [ counter.count(x) for x in facets ]
+
+
+def benchmark(parser, options):
+    t0 = time()
+    catalog = build_catalog(options.products)
+    print 'Catalog of %d products built in %.2fs' % (options.products,
+                                                     time() - t0)
+    base = [PhraseQuery('format', 'product'),
+            PhraseQuery('workflow_state', 'public')]
+    base_queries = [
+        ('no filter', AndQuery(*base)),
+        ('1 filter', AndQuery(PhraseQuery('DFT-size', 'M'), *base)),
+        ('2 filters', AndQuery(PhraseQuery('DFT-size', 'M'),
+                               RangeQuery('stored_price', 1000, 10000),
+                               *base))]
+    facets = get_facets()
+    nb_values = sum([ len(x) for name, x in facets ])
+    print 'Filter box of %d criteria, %d values' % (len(facets), nb_values)
+    for name, base_query in base_queries:
+        for method, count in [('search', count_by_search),
+                              ('counter', count_by_counter)]:
+            t0 = time()
+            for i in range(options.repeat):
+                for criterium, queries in facets:
+                    count(catalog, base_query, queries)
+            t = (time() - t0) / options.repeat
+            print '%-10s %-8s %10.2f ms/filter box' % (name, method,
+                                                      t * 1000)
+        # Check the counts are the same
+        for criterium, queries in facets:
+            if (count_by_search(catalog, base_query, queries) !=
+                count_by_counter(catalog, base_query, queries)):
+                print 'Error: the counts of %s differ' % criterium
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS]'
+    version = 'itools %s' % itools.__version__
+    description = ('Measures the time to count the products of each value'
+                   ' of a filter box, by catalog search and with the'
+                   ' facets counter, on a synthetic catalog.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--products', type='int', default=50000,
+        help="number of products of the catalog (default 50000)")
+    parser.add_option('--repeat', type='int', default=5,
+        help="number of times each filter box is counted (default 5)")
+
+    options, args = parser.parse_args()
+    if args:
+        parser.error('incorrect number of arguments')
+
+    benchmark(parser, options)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+from time import sleep
+
+# Import from itools
+import itools
+
+# Import from shop
+from shop.jobs import get_job_queue
+
+
+def run_jobs(parser, options, target):
+    queue = get_job_queue(target)
+    # Stats
+    if options.stats:
+        stats = queue.get_stats()
+        for key in ['queued', 'ready', 'deferred', 'failed']:
+            print '%s: %s' % (key, stats[key])
+        return
+    # Run
+    pool = Pool(options.processes)
+    while True:
+        n = queue.run(pool, options.batch_size)
+        if options.once:
+            break
+        # Wait only if there is nothing more to do
+        if n < options.batch_size:
+            sleep(options.interval)
+    pool.close()
+    pool.join()
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS] TARGET'
+    version = 'itools %s' % itools.__version__
+    description = ('Generates the documents of the orders (PDF, barcode)'
+                   ' queued by the instance, with a pool of processes.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--once', action='store_true', default=False,
+        help="run one batch of jobs then stop")
+    parser.add_option('--interval', type='int', default=5,
+        help="seconds to wait when the queue is empty (default 5)")
+    parser.add_option('--processes', type='int', default=cpu_count(),
+        help="number of processes (default: number of CPUs)")
+    parser.add_option('--batch-size', type='int', default=20,
+        help="jobs run at once (default 20)")
+    parser.add_option('--stats', action='store_true', default=False,
+        help="print the number of queued and failed jobs")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('incorrect number of arguments')
+
+    target = args[0]
+    run_jobs(parser, options, target)
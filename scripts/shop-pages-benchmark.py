@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from optparse import OptionParser
+from time import time
+
+# Import from itools
+import itools
+from itools.web import del_context
+from itools.xapian import AndQuery, PhraseQuery
+
+# Import from ikaaro
+from ikaaro.datatypes import Password
+from ikaaro.server import Server, get_fake_context
+
+# Import from shop
+from shop.cart import ProductCart, get_cart
+from shop.products.models import ProductModel
+
+
+def get_products(root, shop, nb_products):
+    """The abspaths of the first public products of the shop.
+    """
+    query = AndQuery(PhraseQuery('format', shop.product_class.class_id),
+                     PhraseQuery('workflow_state', 'public'),
+                     PhraseQuery('parent_paths', str(shop.get_abspath())))
+    documents = root.search(query).get_documents(sort_by='abspath',
+                                                 size=nb_products)
+    return [ x.abspath for x in documents ]
+
+
+def get_products_cookie(abspaths):
+    cookies = [ '%d|%s|1|' % (i, abspath)
+                for i, abspath in enumerate(abspaths) ]
+    return Password.encode('@'.join(cookies))
+
+
+def print_time(name, t, nb_pages):
+    print '%-40s %8.2f ms/page' % (name, t * 1000 / nb_pages)
+
+
+def benchmark_cart(server, shop, options):
+    """Measure the time spent to build the cart by page, the callers
+    reading the products of the cart (mini cart, cart box, prices...).
+    """
+    root = server.root
+    abspaths = get_products(root, shop, options.products)
+    cookie = get_products_cookie(abspaths)
+    print 'Cart of %d products, read %d times by page' % (len(abspaths),
+                                                           options.callers)
+    for name, get in [('one cart by caller (before)', ProductCart),
+                      ('one cart by page (get_cart)', get_cart)]:
+        t = 0
+        for i in range(options.pages):
+            context = get_fake_context()
+            server.init_context(context)
+            context.cookies['products'] = cookie
+            t0 = time()
+            for j in range(options.callers):
+                get(context).products
+            t += time() - t0
+            del_context()
+        print_time(name, t, options.pages)
+
+
+# The schema of the models compiled at each call (as before)
+ProductModel_get_compiled_schema = ProductModel.get_compiled_schema
+
+def get_compiled_schema_uncached(self):
+    self.get_resource('schema').handler.compiled_schema = None
+    return ProductModel_get_compiled_schema(self)
+
+
+def benchmark_products(server, shop, options):
+    """Measure the time to make the namespace of the product pages and
+    to compute the catalog values of the products (reindex), with the
+    schema of the product models compiled once or at each call.
+    """
+    root = server.root
+    abspaths = get_products(root, shop, options.pages)
+    print '%d products' % len(abspaths)
+    if not abspaths:
+        return
+    for name, get_compiled_schema in [
+        ('schema compiled at each call (before)',
+         get_compiled_schema_uncached),
+        ('schema compiled once', ProductModel_get_compiled_schema)]:
+        ProductModel.get_compiled_schema = get_compiled_schema
+        t_page = t_reindex = 0
+        for abspath in abspaths:
+            context = get_fake_context()
+            server.init_context(context)
+            product = root.get_resource(abspath)
+            t0 = time()
+            product.get_namespace(context)
+            t_page += time() - t0
+            t0 = time()
+            product._get_catalog_values()
+            t_reindex += time() - t0
+            del_context()
+        print_time('Product page, %s' % name, t_page, len(abspaths))
+        print '%-40s %8.2f products/s' % ('Reindex, %s' % name,
+                                          len(abspaths) / t_reindex)
+    ProductModel.get_compiled_schema = ProductModel_get_compiled_schema
+
+
+def benchmark(target, options):
+    server = Server(target, read_only=True)
+    context = get_fake_context()
+    server.init_context(context)
+    root = server.root
+    brains = root.search(format='shop').get_documents()
+    del_context()
+    for brain in brains:
+        print 'Shop %s' % brain.abspath
+        shop = root.get_resource(brain.abspath)
+        benchmark_cart(server, shop, options)
+        benchmark_products(server, shop, options)
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS] TARGET'
+    version = 'itools %s' % itools.__version__
+    description = ('Measures the time spent by page on the cart, the time'
+                   ' of the product pages and the reindex throughput of'
+                   ' the products, in the shops of the TARGET instance.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--products', type='int', default=10,
+        help="number of products in the cart (default 10)")
+    parser.add_option('--callers', type='int', default=4,
+        help="number of times the cart is read by page (default 4)")
+    parser.add_option('--pages', type='int', default=100,
+        help="number of pages, and of products (default 100)")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('incorrect number of arguments')
+
+    benchmark(args[0], options)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from copy import deepcopy
+from decimal import Decimal as decimal
+from optparse import OptionParser
+from random import randint, seed
+from time import time
+
+# Import from itools
+import itools
+
+# Import from shop
+from shop.shipping.shipping_way import get_parcels
+
+
+def get_partition(list_weight, max_value):
+    """The parcels as they were made before: one list entry by unit.
+    """
+    list_weight = deepcopy(list_weight)
+    for key in list_weight:
+        if key > max_value:
+            return None
+    current_value = decimal(0)
+    partition = []
+    list_weight.sort(reverse=True)
+    while list_weight:
+        if current_value + list_weight[-1] <= max_value:
+            current_value += list_weight.pop()
+        else:
+            partition.append(current_value)
+            current_value = decimal(0)
+        if len(list_weight) == 0:
+            partition.append(current_value)
+    return partition
+
+
+def get_cart(nb_units, nb_products):
+    """Return the cart as [(weight, quantity)].
+    """
+    seed(nb_units)
+    cart = []
+    for i in range(nb_products):
+        weight = decimal(randint(1, 500)) / 100
+        cart.append((weight, nb_units / nb_products))
+    weight, quantity = cart[-1]
+    cart[-1] = (weight, quantity + nb_units % nb_products)
+    return cart
+
+
+def pack_units(cart, max_value):
+    # As get_shippings_details did before
+    list_weight = []
+    for weight, quantity in cart:
+        for i in range(quantity):
+            list_weight.append(weight)
+    return get_partition(list_weight, max_value)
+
+
+def pack_weights(cart, max_value):
+    weights = {}
+    for weight, quantity in cart:
+        weights[weight] = weights.get(weight, 0) + quantity
+    return get_parcels(weights, max_value)
+
+
+def benchmark(parser, options):
+    max_value = decimal(30)
+    print '%10s %14s %14s %10s' % ('units', 'by unit', 'by weight',
+                                   'parcels')
+    nb_units = 10
+    while nb_units <= options.units:
+        cart = get_cart(nb_units, options.products)
+        times = []
+        for pack in [pack_units, pack_weights]:
+            t0 = time()
+            for i in range(options.repeat):
+                result = pack(cart, max_value)
+            times.append((time() - t0) / options.repeat)
+        nb_parcels = sum([ nb for value, nb in result ])
+        print '%10d %11.3f ms %11.3f ms %10d' % (
+            nb_units, times[0] * 1000, times[1] * 1000, nb_parcels)
+        nb_units *= 10
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS]'
+    version = 'itools %s' % itools.__version__
+    description = ('Measures the time to split a cart into shipping'
+                   ' parcels, one unit at a time (as before) and by'
+                   ' weight, for carts of 10 to 100000 units.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--units', type='int', default=100000,
+        help="number of units of the largest cart (default 100000)")
+    parser.add_option('--products', type='int', default=5,
+        help="number of distinct products of the carts (default 5)")
+    parser.add_option('--repeat', type='int', default=3,
+        help="number of times each cart is packed (default 3)")
+
+    options, args = parser.parse_args()
+    if args:
+        parser.error('incorrect number of arguments')
+
+    benchmark(parser, options)
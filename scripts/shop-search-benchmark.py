@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from optparse import OptionParser
+from random import choice, randint, random, seed
+from time import time
+
+# Import from itools
+import itools
+
+# Import from ikaaro
+from ikaaro.server import Server, get_fake_context
+
+# Import from shop
+from shop.autocomplete import AutocompleteIndex, get_keys
+from shop.product_search import ProductSearchIndex, REFERENCE_WEIGHT
+from shop.product_search import TEXT_WEIGHT, TITLE_WEIGHT
+
+
+# A vocabulary of 5000 words, the first ones are the most frequent
+syllables = [u'ba', u'ch', u'de', u'f\xe9', u'go', u'ka', u'li', u'mo',
+             u'n\xe8', u'pa', u'ri', u'sa', u'tu', u'v\xea', u'zo']
+seed(0)
+words = []
+while len(words) < 5000:
+    word = u''.join([ choice(syllables) for i in range(randint(2, 4)) ])
+    if word not in words:
+        words.append(word)
+
+
+def choose_word():
+    # Zipf-like distribution
+    return words[int(len(words) ** random()) - 1]
+
+
+def get_text(n):
+    return u' '.join([ choose_word() for i in range(n) ])
+
+
+def build_index(nb_products):
+    index = ProductSearchIndex()
+    categories = [ '/shop/categories/%d' % x for x in range(10) ]
+    for i in range(nb_products):
+        abspath = '/shop/products/product-%d' % i
+        reference = 'REF-%06d' % i
+        fields = [(TITLE_WEIGHT, 'fr', get_text(3)),
+                  (TEXT_WEIGHT, 'fr', get_text(30)),
+                  (REFERENCE_WEIGHT, None, unicode(reference))]
+        info = {'is_public': True,
+                'parent_paths': ['/', '/shop', '/shop/categories',
+                                 choice(categories)],
+                'title': abspath,
+                'mtime': i,
+                'ctime': i,
+                'stored_price': randint(100, 100000),
+                'stored_note': randint(0, 500),
+                'nb_reviews': randint(0, 20)}
+        index.index_product(abspath, fields, [reference], info)
+    index.is_built = True
+    return index
+
+
+def build_autocomplete_index(nb_products):
+    index = AutocompleteIndex()
+    index.is_building = True
+    categories = [ '/shop/categories/%d' % x for x in range(10) ]
+    for i in range(nb_products):
+        abspath = '/shop/products/product-%d' % i
+        title = get_text(3)
+        index.index_item(abspath, 'product', title, abspath,
+                         get_keys(title) + [u'ref-%06d' % i],
+                         reference='REF-%06d' % i,
+                         categories=[choice(categories)],
+                         popularity=randint(0, 1000))
+    index.end_rebuild()
+    return index
+
+
+def print_times(name, search, texts):
+    t0 = time()
+    nb_results = 0
+    for text in texts:
+        nb_results += len(search(text))
+    t = (time() - t0) / len(texts)
+    print '%-10s %8.2f ms/query %10d results/query' % (
+        name, t * 1000, nb_results / len(texts))
+
+
+def benchmark_rebuild(target):
+    """Measure the time to build the indexes of the shops of the instance
+    (as the server does in the background when it starts).
+    """
+    server = Server(target, read_only=True)
+    context = get_fake_context()
+    server.init_context(context)
+    root = server.root
+    for brain in root.search(format='shop').get_documents():
+        shop = root.get_resource(brain.abspath)
+        t0 = time()
+        index = ProductSearchIndex()
+        index.rebuild(shop)
+        print 'Index of %s: %d products built in %.2fs (%d terms)' % (
+            brain.abspath, len(index.products), time() - t0,
+            len(index.postings))
+        t0 = time()
+        index = AutocompleteIndex()
+        index.rebuild(shop)
+        print 'Autocomplete index of %s: %d items built in %.2fs' % (
+            brain.abspath, len(index.items), time() - t0)
+
+
+def benchmark(parser, options):
+    t0 = time()
+    index = build_index(options.products)
+    print 'Index of %d products built in %.2fs (%d terms)' % (
+        options.products, time() - t0, len(index.postings))
+    queries = [
+        ('1 word', lambda: get_text(1)),
+        ('2 words', lambda: get_text(2)),
+        ('3 words', lambda: get_text(3)),
+        ('typo', lambda: choose_word()[:-1] + u'x'),
+        ('reference', lambda: u'REF-%06d' % randint(0, options.products-1))]
+    for name, get_query in queries:
+        texts = [ get_query() for i in range(options.queries) ]
+        print_times(name, lambda x: index.search(x, ['fr']), texts)
+
+    # Autocomplete (without the cache of the results, see
+    # benchmark_rebuild for the time to build the index of an instance)
+    t0 = time()
+    index = build_autocomplete_index(options.products)
+    print 'Autocomplete index built in %.2fs' % (time() - t0)
+    def search(text):
+        index.cache.clear()
+        return index.search(text)['product']
+    queries = [
+        ('2 letters', lambda: choose_word()[:2]),
+        ('3 letters', lambda: choose_word()[:3]),
+        ('1 word', lambda: choose_word()),
+        ('2 words', lambda: u'%s %s' % (choose_word(), choose_word()[:3])),
+        ('reference',
+         lambda: u'REF-%04d' % (randint(0, options.products-1) / 100))]
+    for name, get_query in queries:
+        texts = [ get_query() for i in range(options.queries) ]
+        print_times(name, search, texts)
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS] [TARGET]'
+    version = 'itools %s' % itools.__version__
+    description = ('Measures the time of the products search and of the'
+                   ' autocomplete on a synthetic catalog, or the time to'
+                   ' build the indexes of the TARGET instance.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--products', type='int', default=100000,
+        help="number of products of the catalog (default 100000)")
+    parser.add_option('--queries', type='int', default=20,
+        help="number of queries of each kind (default 20)")
+
+    options, args = parser.parse_args()
+    if len(args) > 1:
+        parser.error('incorrect number of arguments')
+
+    if args:
+        benchmark_rebuild(args[0])
+    else:
+        benchmark(parser, options)
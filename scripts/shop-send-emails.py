@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from optparse import OptionParser
+from time import sleep
+
+# Import from itools
+import itools
+
+# Import from ikaaro
+from ikaaro.config import get_config
+
+# Import from shop
+from shop.outbox import get_outbox
+
+
+def send_emails(parser, options, target):
+    outbox = get_outbox(target)
+    # Stats
+    if options.stats:
+        stats = outbox.get_stats()
+        for key in ['queued', 'ready', 'deferred', 'failed', 'oldest']:
+            print '%s: %s' % (key, stats[key])
+        return
+    # Send
+    config = get_config(target)
+    smtp_host = config.get_value('smtp-host')
+    if not smtp_host:
+        parser.error('"smtp-host" is not set in config.conf')
+    smtp_login = config.get_value('smtp-login').strip()
+    smtp_password = config.get_value('smtp-password').strip()
+    while True:
+        n = outbox.send(smtp_host, smtp_login, smtp_password,
+                        options.batch_size)
+        if options.once:
+            break
+        # Wait only if there is nothing more to send
+        if n < options.batch_size:
+            sleep(options.interval)
+
+
+
+if __name__ == '__main__':
+    # The command line parser
+    usage = '%prog [OPTIONS] TARGET'
+    version = 'itools %s' % itools.__version__
+    description = ('Sends the emails of the outbox of the instance, by'
+                   ' batches, with the SMTP server of config.conf.')
+    parser = OptionParser(usage, version=version, description=description)
+    parser.add_option('--once', action='store_true', default=False,
+        help="send one batch of emails then stop")
+    parser.add_option('--interval', type='int', default=30,
+        help="seconds to wait when the outbox is empty (default 30)")
+    parser.add_option('--batch-size', type='int', default=50,
+        help="emails sent by SMTP connection (default 50)")
+    parser.add_option('--stats', action='store_true', default=False,
+        help="print the number of queued and failed emails")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('incorrect number of arguments')
+
+    target = args[0]
+    send_emails(parser, options, target)
@@ -14,13 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+# Import from standard library
+from json import dumps
+
 # Import from itools
 from itools.datatypes import Unicode, Enumerate
 from itools.gettext import MSG
-from itools.handlers import checkid
 from itools.xapian import OrQuery, PhraseQuery, AndQuery, split_unicode
 from itools.xapian import RangeQuery
-from itools.web import get_context
+from itools.web import BaseView, get_context
 
 # Import from ikaaro
 from ikaaro.folder import Folder
@@ -30,7 +32,10 @@ from ikaaro.registry import register_resource_class
 from itws.bar import SideBarAware
 
 # Import from shop
+from autocomplete import AUTOCOMPLETE_SIZES, get_autocomplete_index
 from categories_views import Category_View
+from product_search import get_product_search_index
+from utils import get_group_name
 
 
 class Shop_CategoriesEnumerate(Enumerate):
@@ -102,34 +107,40 @@ class Shop_ProductSearch(Category_View):
     def get_items(self, resource, context):
         site_root = resource.get_site_root()
         shop = site_root.get_resource('shop')
+        category = context.query['category']
+        if category == '*':
+            category = None
+        search_word = context.query['product_search_text']
+        index = None
+        if search_word:
+            # Ranked by the search index (see product_search), once built
+            index = get_product_search_index(shop)
+        if index is not None:
+            languages = site_root.get_property('website_languages')
+            sort_by = reverse = None
+            if context.uri.query.has_key('sort_by'):
+                sort_by = context.query['sort_by']
+                reverse = context.query['reverse']
+            results = index.search(search_word, languages,
+                                   parent_path=category,
+                                   stored_price=context.query['stored_price'],
+                                   sort_by=sort_by, reverse=reverse)
+            # XXX Hack results
+            self.nb_results = len(results)
+            return results
         abspath = site_root.get_canonical_path()
         query = [PhraseQuery('parent_paths', str(abspath)),
                  PhraseQuery('format', shop.product_class.class_id),
                  PhraseQuery('workflow_state', 'public')]
-        category = context.query['category']
-        if category and category != '*':
+        if category:
             query.append(PhraseQuery('parent_paths', category))
-        search_word = context.query['product_search_text']
         if search_word:
+            # Until the search index is built
             for word in split_unicode(search_word):
-                alternative = (word + u"s" if not word.endswith(u's')
-                                            else word[:-1])
-                plain_text = OrQuery(
-                                # By reference
-                                #PhraseQuery('reference', word.upper()), #encode('utf-8')), #.upper()),
-                                # On product
-                                PhraseQuery('title', word),
-                                PhraseQuery('description', word),
-                                PhraseQuery('data', word),
-                                PhraseQuery('text', word),
-                                # XXX Hack manufacturer
-                                #PhraseQuery('manufacturer', checkid(word)),
-                                # Alternative
-                                PhraseQuery('title', alternative),
-                                PhraseQuery('description', alternative),
-                                PhraseQuery('data', alternative),
-                                PhraseQuery('text', alternative))
-                query.append(plain_text)
+                query.append(OrQuery(PhraseQuery('title', word),
+                                     PhraseQuery('description', word),
+                                     PhraseQuery('data', word),
+                                     PhraseQuery('text', word)))
         # Add query of filter
         for key, datatype in self.get_query_schema().items():
             value = context.query[key]
@@ -142,6 +153,56 @@ class Shop_ProductSearch(Category_View):
         return results
 
 
+    def sort_and_batch(self, resource, context, results):
+        if not isinstance(results, list):
+            return Category_View.sort_and_batch(self, resource, context,
+                                                results)
+        # The abspaths of the products found, by relevance
+        shop = resource.get_site_root().get_resource('shop')
+        start = context.query['batch_start']
+        size = shop.get_property('categories_batch_size')
+        user = context.user
+        root = context.root
+        allowed_items = []
+        for abspath in results[start:start+size]:
+            product = root.get_resource(abspath)
+            ac = product.get_access_control()
+            if ac.is_allowed_to_view(user, product):
+                allowed_items.append(product)
+        return allowed_items
+
+
+
+class Shop_Autocomplete(BaseView):
+    """The categories, manufacturers and products starting with the
+    words typed in the search box (JSON).
+    """
+
+    access = True
+    query_schema = {'q': Unicode}
+
+    def GET(self, resource, context):
+        shop = resource.get_site_root().get_resource('shop')
+        group_name = None
+        if shop.get_property('hide_not_buyable_products') is True:
+            group_name = get_group_name(shop, context)
+        index = get_autocomplete_index(shop)
+        if index is None:
+            # Not built yet (see shop.indexes)
+            results = dict([ (x, []) for x in AUTOCOMPLETE_SIZES ])
+        else:
+            results = index.search(context.query['q'] or u'', group_name)
+        language = resource.get_content_language(context)
+        kw = {}
+        for kind, items in results.iteritems():
+            kw[kind] = [ {'title': x['titles'].get(language) or x['title'],
+                          'href': x['href'],
+                          'reference': x['reference']}
+                         for x in items ]
+        context.set_content_type('application/json')
+        return dumps(kw)
+
+
 
 class ShopSearch(SideBarAware, Folder):
 
@@ -150,6 +211,7 @@ class ShopSearch(SideBarAware, Folder):
     class_views = ['view', 'edit'] + SideBarAware.class_views
 
     view = Shop_ProductSearch()
+    autocomplete = Shop_Autocomplete()
 
 
     @staticmethod
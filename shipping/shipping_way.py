@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from standard library
-from copy import deepcopy
+from bisect import bisect_left
 from decimal import Decimal as decimal
 
 # Import from itools
@@ -27,7 +27,6 @@ from itools.gettext import MSG
 from itools.handlers import ro_database
 from itools.i18n import format_datetime
 from itools.web import get_context
-from itools.xapian import PhraseQuery
 
 # Import from ikaaro
 from ikaaro.file import Image
@@ -37,9 +36,11 @@ from ikaaro.registry import register_resource_class
 from ikaaro.table import Table
 
 # Import from shop
-from shop.cart import ProductCart
+from shop.cart import get_cart
 from shop.enumerates import CountriesZonesEnumerate
 from shop.folder import ShopFolder
+from shop.shipping_quotes import get_shipping_quotes
+from shop.shipping_quotes import invalidate_shipping_quotes
 from shop.utils import format_price, get_shop
 from shop.utils_views import SearchTable_View
 
@@ -50,6 +51,54 @@ from shipping_way_views import ShippingWay_Configure, ShippingWay_RecordAdd
 from shipping_way_views import ShippingWay_RecordEdit, ShippingWay_RecordView
 
 
+def get_parcels(weights, max_value):
+    """Split the products into parcels, the weights being given as
+    {weight: number of products}.
+    The parcels are filled with the lightest products first, a new parcel
+    is started when the next product does not fit. The products of the
+    same weight are packed at once, so the cost depends on the number of
+    distinct weights, not on the number of products.
+    Return the parcels as [(weight of the parcel, number of parcels)], or
+    None if a product is heavier than the max value.
+    """
+    parcels = []
+    def add_parcel(value, nb=1):
+        if parcels and parcels[-1][0] == value:
+            nb += parcels[-1][1]
+            parcels.pop()
+        parcels.append((value, nb))
+
+    current_value = decimal(0)
+    is_empty = True
+    for weight in sorted(weights):
+        nb = weights[weight]
+        if nb <= 0:
+            continue
+        is_empty = False
+        if weight > max_value:
+            return None
+        if weight == 0:
+            current_value += weight * nb
+            continue
+        # Fill the current parcel
+        n = min(nb, int((max_value - current_value) // weight))
+        current_value += weight * n
+        nb -= n
+        if nb == 0:
+            continue
+        add_parcel(current_value)
+        # Full parcels, the last one stays open
+        by_parcel = int(max_value // weight)
+        nb_full = (nb - 1) // by_parcel
+        if nb_full:
+            add_parcel(weight * by_parcel, nb_full)
+        current_value = weight * (nb - nb_full * by_parcel)
+    if not is_empty:
+        add_parcel(current_value)
+    return parcels
+
+
+
 class ShippingWayBaseTable(BaseTable):
 
     record_properties = {
@@ -112,6 +161,48 @@ class ShippingPricesTable(BaseTable):
       'max-quantity': Integer(is_indexed=True),
       'price': Decimal(mandatory=True)}
 
+    # Compiled prices (see get_prices)
+    compiled_prices = None
+
+
+    def reset(self):
+        BaseTable.reset(self)
+        self.compiled_prices = None
+
+
+    def set_changed(self):
+        BaseTable.set_changed(self)
+        # The prices have changed, they must be compiled again
+        self.compiled_prices = None
+        invalidate_shipping_quotes()
+
+
+    def get_prices(self, zone, mode):
+        """Return the prices of the zone as two lists sorted by max value
+        (weight or quantity): the max values and the prices.
+        The lists of all the zones are compiled at once.
+        """
+        if self.compiled_prices is None:
+            self.compiled_prices = {}
+        compiled_prices = self.compiled_prices
+        if mode not in compiled_prices:
+            get_value = self.get_record_value
+            # {zone: {max value: price}} (the last record wins)
+            zones = {}
+            for record in self.get_records():
+                max_value = get_value(record, 'max-%s' % mode)
+                if max_value is None:
+                    continue
+                prices = zones.setdefault(str(get_value(record, 'zone')), {})
+                prices[max_value] = get_value(record, 'price')
+            compiled = {}
+            for key, prices in zones.items():
+                max_values = sorted(prices)
+                compiled[key] = (max_values,
+                                 [ prices[x] for x in max_values ])
+            compiled_prices[mode] = compiled
+        return compiled_prices[mode].get(str(zone), ([], []))
+
 
 
 class ShippingPrices(Table):
@@ -187,84 +278,84 @@ class ShippingWay(ShopFolder):
         return merge_dicts(ShopFolder.get_metadata_schema(), delivery_schema)
 
 
-    def get_price(self, country, list_weight):
-        list_weight = deepcopy(list_weight)
+    def _get_catalog_values(self):
+        # The configuration of the shipping way may have changed
+        invalidate_shipping_quotes()
+        return ShopFolder._get_catalog_values(self)
+
+
+    def get_price(self, country, weights):
+        details = self.get_price_details(country, weights)
+        if details is None:
+            return None
+        return details['price']
+
+
+    def get_price_details(self, country, weights):
+        """The details of the price are computed once by cart
+        (see shop.shipping_quotes).
+        """
+        return get_shipping_quotes().get_price_details(self, country, weights)
+
+
+    def _get_price_details(self, country, weights):
+        """Return the price of the shipping of the given weights
+        ({weight: number of products}) and the parcels, as a dict:
+          {'price': total price,
+           'parcels': [{'value': weight or quantity, 'nb': number of parcels,
+                        'price': price of one parcel}]}
+        Return None if the products cannot be shipped.
+        """
         shop = get_shop(self)
         # Is Free ?
         if self.get_property('is_free'):
-            return decimal(0)
+            return {'price': decimal(0), 'parcels': []}
         # Transform country to zone
         countries = shop.get_resource('countries').handler
         country_record = countries.get_record(int(country))
         if countries.get_record_value(country_record, 'enabled') is False:
             return None
         zone = countries.get_record_value(country_record, 'zone')
-        # XXX to refactor
         # Max value
         mode = self.get_property('mode')
-        if mode == 'weight':
-            list_weight.sort(reverse=True)
-            list_values = list_weight
-        elif mode == 'quantity':
-            list_values = [1] * len(list_weight)
+        if mode == 'quantity':
+            weights = {decimal(1): sum(weights.values())}
         # XXX limit by models
         only_this_models = self.get_property('only_this_models')
         if only_this_models:
-            cart = ProductCart(get_context())
+            cart = get_cart(get_context())
             for product_cart in cart.products:
                 product = shop.get_resource(product_cart['name'], soft=True)
                 if product.get_property('product_model') not in only_this_models:
                     return None
 
-        # Get corresponding weight/quantity in table of price
-        list_price_ok = {}
-        prices = self.get_resource('prices').handler
-        min_value = 0
-        for record in prices.search(PhraseQuery('zone', zone),
-                                    sort_by='max-%s' % mode):
-            max_value = prices.get_record_value(record, 'max-%s' % mode)
-            price = prices.get_record_value(record, 'price')
-            list_price_ok[max_value] = {'min': min_value,
-                                        'max': max_value,
-                                        'price': price}
-            min_value = max_value
+        # Get corresponding weight/quantity in table of price
+        table = self.get_resource('prices').handler
+        max_values, prices = table.get_prices(zone, mode)
         # No price ?
-        if len(list_price_ok.keys()) == 0:
+        if len(max_values) == 0:
+            return None
+        # Make the parcels
+        parcels = get_parcels(weights, max_values[-1])
+        if parcels is None:
             return None
-        # Check all weigh if < max_weight
-        if mode == 'weight':
-            max_value = max(list_price_ok.keys())
-            for key in list_weight:
-                if key > max_value:
-                    return None
-        # On crée une partition de poids
-        current_value = decimal(0)
-        partition = []
-        list_values.sort(reverse=True)
-        while list_values:
-            if current_value + list_values[-1] <= max_value:
-                current_value += list_values.pop()
-            else:
-                partition.append(current_value)
-                current_value = decimal(0)
-            if len(list_values) == 0:
-                partition.append(current_value)
         # Calcul total price
+        # (the price of a parcel is the one of the first max value >= p)
         total_price = decimal(0)
-        for p in partition:
-            for value in list_price_ok.values():
-                if p >= value['min'] and p <= value['max']:
-                    total_price += value['price']
-                    break
+        parcels_ns = []
+        for value, nb in parcels:
+            price = prices[bisect_left(max_values, value)]
+            total_price += price * nb
+            parcels_ns.append({'value': value, 'nb': nb, 'price': price})
         # Add insurance
         if self.get_property('insurance') > decimal(0):
             context = get_context()
-            cart = ProductCart(context)
+            cart = get_cart(context)
             products_price = cart.get_total_price(shop,
                                 with_delivery=False, pretty=False)
             percent = self.get_property('insurance') / 100
             total_price += products_price['with_tax'] * percent
-        return total_price
+        return {'price': total_price, 'parcels': parcels_ns}
 
 
 
@@ -289,7 +380,7 @@ class ShippingWay(ShopFolder):
 
 
 
-    def get_widget_namespace(self, context, country, list_weight):
+    def get_widget_namespace(self, context, country, weights):
         # Is enabled ?
         if not self.get_property('enabled'):
             return None
@@ -299,15 +390,24 @@ class ShippingWay(ShopFolder):
            context.user.get_property('user_group') not in shipping_groups):
             return None
         # Get price of shipping
-        price = self.get_price(country, list_weight)
-        if price is None:
+        details = self.get_price_details(country, weights)
+        if details is None:
             return None
+        price = details['price']
         language = self.get_content_language(context)
+        is_weight = (self.get_property('mode') == 'weight')
+        parcels = []
+        for parcel in details['parcels']:
+            parcels.append({'nb': parcel['nb'],
+                            'value': parcel['value'],
+                            'is_weight': is_weight,
+                            'pretty_price': format_price(parcel['price'])})
         ns = {'name': self.name,
               'img': self.get_logo(context),
               'title': self.get_title(language),
               'pretty_price': format_price(price),
-              'price': price}
+              'price': price,
+              'parcels': parcels}
         for key in ['description', 'enabled']:
             ns[key] = self.get_property(key, language)
         return ns
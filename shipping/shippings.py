@@ -63,7 +63,7 @@ class Shippings(ShopFolder):
         namespace = []
         # Always add withdrawal if enabled
         for mode in self.search_resources(cls=Withdrawal):
-            widget = mode.get_widget_namespace(context, country, [])
+            widget = mode.get_widget_namespace(context, country, {})
             if widget is not None:
                 namespace.append(widget)
         # Specific shipping way ?
@@ -72,14 +72,16 @@ class Shippings(ShopFolder):
             if name != 'default':
                 mode = context.root.get_resource(name)
                 widget = mode.get_widget_namespace(
-                            context, country, kw['list_weight'])
+                            context, country, kw['weights'])
                 if widget is not None:
                     specific_delivery_widgets.append(widget)
                 else:
                     if infos.get('default') is None:
-                        infos['default'] = {'list_weight': [],
+                        infos['default'] = {'weights': {},
                                             'nb_products': 0}
-                    infos['default']['list_weight'].extend(kw['list_weight'])
+                    weights = infos['default']['weights']
+                    for weight, nb in kw['weights'].items():
+                        weights[weight] = weights.get(weight, 0) + nb
                     infos['default']['nb_products'] += kw['nb_products']
         # Get default delivery
         # (Products for wich we don't asign a specific delivery)
@@ -92,7 +94,7 @@ class Shippings(ShopFolder):
                 if mode.class_id == Withdrawal.class_id:
                     continue
                 widget = mode.get_widget_namespace(context, country,
-                    default_delivery['list_weight'])
+                    default_delivery['weights'])
                 if widget is not None:
                     default_delivery_widgets.append(widget)
         # If has specific shipping way, we only select
@@ -116,8 +118,10 @@ class Shippings(ShopFolder):
         if len(widgets) == 1:
             return widgets[0]
         price = decimal('0')
+        parcels = []
         for widget in widgets:
             price += widget['price']
+            parcels.extend(widget['parcels'])
         logo_uri = self.get_property('default_shipping_way_logo')
         if logo_uri is not None:
             logo = self.get_resource(logo_uri, soft=True)
@@ -131,17 +135,18 @@ class Shippings(ShopFolder):
             'img': img,
             'name': 'default',
             'pretty_price': format_price(price),
-            'price': price}
+            'price': price,
+            'parcels': parcels}
 
 
-    def get_price(self, shipping_way, country, purchase_weight):
+    def get_price(self, shipping_way, country, weights):
         shipping_way = self.get_resource(shipping_way)
-        return shipping_way.get_price(country, purchase_weight)
+        return shipping_way.get_price(country, weights)
 
 
-    def get_namespace_shipping_way(self, context, name, country, weight):
+    def get_namespace_shipping_way(self, context, name, country, weights):
         shipping = self.get_resource(name)
-        return shipping.get_widget_namespace(context, country, weight)
+        return shipping.get_widget_namespace(context, country, weights)
 
 
     def get_shippings_records(self, context, ref=None):
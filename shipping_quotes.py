@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from standard library
+from time import time
+
+# Import from itools
+from itools.core import LRUCache
+from itools.web import get_context
+
+# Import from shop
+from utils import get_group_name, get_shippings_details, get_shop
+
+
+# Number of seconds a quote is kept across requests
+QUOTES_TTL = 300
+
+# {key: (expiration time, details)} (see ShippingQuotes.get_price_details)
+shipping_quotes = LRUCache(1000, 1200)
+
+
+class ShippingQuotes(object):
+    """
+    The shipping quotes of the cart of the request.
+    The price of a shipping way (see ShippingWay.get_price_details) is
+    computed once by (cart fingerprint, country, user group, weights). It
+    is kept for the request and, for QUOTES_TTL seconds, across requests.
+    The quotes are dropped when the shipping configuration changes (see
+    invalidate_shipping_quotes).
+    """
+
+    def __init__(self, context):
+        self.context = context
+        # {key: details}
+        self.quotes = {}
+        # {(fingerprint, country): shipping ways namespace}
+        self.shipping_ways = {}
+
+
+    def get_fingerprint(self, shop):
+        """The products of the cart (with their total price, used by the
+        insurance) and the group of the user.
+        """
+        from cart import get_cart
+        cart = get_cart(self.context)
+        products = [ (x['name'], x['declination'], x['quantity'])
+                     for x in cart.products ]
+        products.sort()
+        total_price = cart.get_total_price(shop, with_delivery=False,
+                                           pretty=False)
+        return (str(shop.get_abspath()), tuple(products),
+                total_price['with_tax'], get_group_name(shop, self.context))
+
+
+    def get_price_details(self, shipping_way, country, weights):
+        shop = get_shop(shipping_way)
+        weights = tuple(sorted(weights.items()))
+        key = (self.get_fingerprint(shop), str(shipping_way.get_abspath()),
+               str(country), weights)
+        # Cached for the request ?
+        if key in self.quotes:
+            return self.quotes[key]
+        # Cached by a previous request ?
+        now = time()
+        if key in shipping_quotes:
+            expiration, details = shipping_quotes[key]
+            if expiration > now:
+                shipping_quotes.touch(key)
+                self.quotes[key] = details
+                return details
+            del shipping_quotes[key]
+        # Compute
+        details = shipping_way._get_price_details(country, dict(weights))
+        self.quotes[key] = details
+        shipping_quotes[key] = (now + QUOTES_TTL, details)
+        return details
+
+
+    def get_shipping_ways(self, shop, country):
+        """Return the namespace of the shipping ways available for the cart
+        (see Shippings.get_namespace_shipping_ways).
+        """
+        from cart import get_cart
+        key = (self.get_fingerprint(shop), str(country))
+        namespace = self.shipping_ways.get(key)
+        if namespace is None:
+            cart = get_cart(self.context)
+            shippings_details = get_shippings_details(cart, self.context)
+            shippings = shop.get_resource('shippings')
+            namespace = shippings.get_namespace_shipping_ways(self.context,
+                            country, shippings_details)
+            self.shipping_ways[key] = namespace
+        return namespace
+
+
+
+def get_shipping_quotes(context=None):
+    if context is None:
+        context = get_context()
+    quotes = getattr(context, '_shipping_quotes', None)
+    if quotes is None:
+        quotes = ShippingQuotes(context)
+        context._shipping_quotes = quotes
+    return quotes
+
+
+def invalidate_shipping_quotes():
+    """To call when the configuration of the shippings (shipping ways,
+    prices, countries) changes.
+    """
+    shipping_quotes.clear()
+    context = get_context()
+    if context is not None:
+        context._shipping_quotes = None
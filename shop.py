@@ -45,7 +45,8 @@ from shop_views import Shop_Delivery, Shop_ViewCart, Shop_Configure
 from shop_views import Shop_RegisterProgress, Shop_AddAddressProgress
 from shop_views import Shop_ShowRecapitulatif, Shop_EditAddressProgress
 from shop_views import Shop_GetProductStock, Shop_Configuration
-from shop_views import Shop_Administration
+from shop_views import Shop_Administration, Shop_RebuildProductsCounts
+from shop_views import Shop_Barcode, Shop_PregenerateBarcodes
 from suppliers import Suppliers, Supplier
 from user import ShopUser, Customers
 from user_group import ShopUser_Groups
@@ -59,7 +60,7 @@ class Shop(ShopFolder):
     class_id = 'shop'
     class_title = MSG(u'Shop')
     class_views = ['view_cart']
-    class_version = '20100622'
+    class_version = '20110412'
 
     __fixed_handlers__ = ShopFolder.__fixed_handlers__ + ['addresses',
                           'categories', 'customers', 'groups',
@@ -91,6 +92,9 @@ class Shop(ShopFolder):
     get_product_stock = Shop_GetProductStock()
     configure = Shop_Configure()
     editorial = Shop_EditorialView()
+    rebuild_products_counts = Shop_RebuildProductsCounts()
+    barcode = Shop_Barcode()
+    pregenerate_barcodes = Shop_PregenerateBarcodes()
 
     #------------------------------
     # 6 Steps for payment process
@@ -205,9 +209,11 @@ class Shop(ShopFolder):
         schema['barcode_format'] = BarcodesFormat
         schema['show_sub_categories'] = Boolean
         schema['hide_not_buyable_products'] = Boolean
+        schema['categories_viewbox_from_catalog'] = Boolean
         schema['product_cover_is_mandatory'] = Boolean
         schema['log_authentification'] = Boolean
         schema['registration_need_email_validation'] = Boolean
+        schema['last_order_number'] = Integer(default=0)
         return schema
 
 
@@ -226,6 +232,19 @@ class Shop(ShopFolder):
             return context.database.fs.get_absolute_path(key)
         return None
 
+    def get_new_order_reference(self):
+        """Allocate the reference of a new order.
+        The last order number is stored in the shop metadata, so it's
+        committed with the order (transactions are serialized).
+        """
+        orders = self.get_resource('orders')
+        ref = self.get_property('last_order_number') + 1
+        # Check the reference is not used (just to be sure)
+        while orders.get_resource(str(ref), soft=True) is not None:
+            ref += 1
+        self.set_property('last_order_number', ref)
+        return str(ref)
+
     ##############################
     # XXX To deplace
     ##############################
@@ -259,5 +278,17 @@ class Shop(ShopFolder):
         search = root.search(AndQuery(*query))
         return len(search) > 0
 
+    ##############################
+    # Updates
+    ##############################
+    def update_20110412(self):
+        # Initialize the last order number from existing orders
+        last_order_number = 0
+        orders = self.get_resource('orders')
+        for name in orders.get_names():
+            if name.isdigit():
+                last_order_number = max(last_order_number, int(name))
+        self.set_property('last_order_number', last_order_number)
+
 
 register_resource_class(Shop)
@@ -22,7 +22,7 @@ from itools.stl import stl
 from itools.web import STLView, STLForm
 
 # Import from shop
-from cart import ProductCart
+from cart import get_cart
 from utils import format_price, get_skin_template
 
 
@@ -55,7 +55,7 @@ class Cart_View(STLView):
                      'see_actions': self.see_actions}
         abspath = resource.get_abspath()
         # Get cart
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Get products informations
         total_weight = decimal(0)
         total = {'with_tax': decimal(0),
@@ -123,14 +123,14 @@ class Cart_Viewbox(STLView):
 
 
     def GET(self, resource, context):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         if cart.get_nb_products() <= 0:
             return
         return STLView.GET(self, resource, context)
 
 
     def get_namespace(self, resource, context):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         return cart.get_namespace(resource)
 
 
@@ -34,7 +34,7 @@ from itools.xapian import AndQuery, PhraseQuery
 from itools.xml import XMLError, XMLParser
 
 # Import from ikaaro
-from ikaaro.forms import BooleanRadio
+from ikaaro.forms import AutoForm, BooleanRadio
 from ikaaro.forms import MultilineWidget, ImageSelectorWidget
 from ikaaro.forms import SelectRadio, SelectWidget
 from ikaaro.forms import TextWidget, PasswordWidget, HiddenWidget
@@ -49,16 +49,21 @@ from ikaaro.website_views import RegisterForm
 from addresses import Addresses_Enumerate
 from addresses_views import Addresses_Book, Addresses_AddAddress
 from addresses_views import Addresses_EditAddress
-from cart import ProductCart
+from barcodes import get_barcodes_cache
+from cart import get_cart
+from catalog_export import iter_products
 from countries import CountriesEnumerate
 from datatypes import Civilite, ImagePathDataType
 from enumerates import BarcodesFormat, SortBy_Enumerate, CountriesZonesEnumerate
 from enumerates import Devises
+from jobs import get_job_queue
 from modules import ModuleLoader
 from payments.payments_views import Payments_ChoosePayment
 from products.declination import Declination
+from products_counts import get_products_counts
+from shipping_quotes import get_shipping_quotes
 from shop_utils_views import Cart_View, Shop_Progress, RealRessource_Form
-from utils import datetime_to_ago, get_shippings_details, get_skin_template
+from utils import datetime_to_ago, get_skin_template
 from utils import get_shop, get_arrondi
 
 
@@ -103,6 +108,7 @@ class Shop_Configure(DBResource_Edit):
               'devise': Devises(mandatory=True),
               'hide_not_buyable_products': Boolean(mandatory=True),
               'categories_batch_size': Integer(mandatory=True),
+              'categories_viewbox_from_catalog': Boolean,
               'show_sub_categories': Boolean,
               'product_cover_is_mandatory': Boolean,
               'log_authentification': Boolean,
@@ -126,6 +132,11 @@ class Shop_Configure(DBResource_Edit):
                      has_empty_option=False),
         BooleanRadio('shop_sort_reverse', title=MSG(u'Reverse sort ?')),
         BooleanRadio('show_sub_categories', title=MSG(u'Show sub categories ?')),
+        BooleanRadio('categories_viewbox_from_catalog',
+            title=MSG(u'Render the products of the categories from the '
+                      u'catalog (faster, the skin can only use title, href, '
+                      u'cover, description, manufacturer, price, reference '
+                      u'and reviews) ?')),
         BooleanRadio('product_cover_is_mandatory', title=MSG(u'Product cover is mandatory ?')),
         BooleanRadio('hide_not_buyable_products',
                       title=MSG(u'Hide not buyable products ?')),
@@ -186,7 +197,7 @@ class Shop_ViewCart(STLForm):
 
 
     def get_namespace(self, resource, context):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.clean()
         cart_is_empty = cart.products == []
         if cart_is_empty:
@@ -199,12 +210,12 @@ class Shop_ViewCart(STLForm):
 
 
     def action_delete(self, resource, context, form):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.delete_a_product(form['id'])
 
 
     def action_add(self, resource, context, form):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         product_name = cart.get_product_name(form['id'])
         quantity_in_cart = cart.get_product_quantity_in_cart(product_name)
         product = resource.get_resource(product_name)
@@ -213,12 +224,12 @@ class Shop_ViewCart(STLForm):
 
 
     def action_remove(self, resource, context, form):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.remove_a_product(form['id'])
 
 
     def action_clear(self, resource, context, form):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.clear()
 
 #-------------------------------------
@@ -392,7 +403,7 @@ class Shop_Register(RegisterForm):
             addresses.handler.add_record(kw)
 
         # Clean cart, if another user already login before
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.clean()
 
         # Set the role
@@ -572,7 +583,7 @@ class Shop_ChooseAddress(STLForm):
 
     def get_namespace(self, resource, context):
         namespace = {}
-        cart = ProductCart(context)
+        cart = get_cart(context)
         widget = SelectWidget('delivery_address', has_empty_option=False)
         namespace['delivery_address'] = widget.to_html(Addresses_Enumerate,
                                           cart.addresses['delivery_address'])
@@ -583,7 +594,7 @@ class Shop_ChooseAddress(STLForm):
 
 
     def action(self, resource, context, form):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Set addresses
         cart._set_addresses(form['delivery_address'], form['bill_address'])
         # Set delivery zone
@@ -604,7 +615,7 @@ class Shop_Addresses(STLForm):
 
     def GET(self, resource, context):
         # If user has no addresses, redirect to edit_address view
-        cart = ProductCart(context)
+        cart = get_cart(context)
         delivery_address = cart.addresses['delivery_address']
         if delivery_address==None:
             delivery_address = resource.get_user_main_address(context.user.name)
@@ -630,7 +641,7 @@ class Shop_Addresses(STLForm):
         # Progress bar
         ns['progress'] = Shop_Progress(index=3).GET(resource, context)
         # Get cart
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Delivery address
         delivery_address = cart.addresses['delivery_address']
         ns['delivery_address']  = resource.get_user_address_namespace(delivery_address)
@@ -657,7 +668,7 @@ class Shop_Delivery(STLForm):
 
     def get_namespace(self, resource, context):
         ns = {}
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Progress
         ns['progress'] = Shop_Progress(index=4).GET(resource, context)
         # Get user delivery country
@@ -667,10 +678,9 @@ class Shop_Delivery(STLForm):
         country = addresses.get_record_value(record, 'country')
 
         # Guess shipping posibilities
-        shippings_details = get_shippings_details(cart, context)
         shippings = resource.get_resource('shippings')
-        ns['shipping'] = shippings.get_namespace_shipping_ways(context,
-                                            country, shippings_details)
+        quotes = get_shipping_quotes(context)
+        ns['shipping'] = quotes.get_shipping_ways(resource, country)
         # If no shipping
         ns['msg_if_no_shipping'] = shippings.get_property('msg_if_no_shipping')
         return ns
@@ -680,7 +690,7 @@ class Shop_Delivery(STLForm):
         # We save option, if user choose it
         option = ''
         # We save shipping mode/option choosen by user
-        cart = ProductCart(context)
+        cart = get_cart(context)
         cart.set_shipping(form['shipping'], option)
         # Goto recapitulatif
         return context.uri.resolve(';show_recapitulatif')
@@ -705,7 +715,7 @@ class Shop_ShowRecapitulatif(STLForm):
               'cgv': Boolean} # XXX (mandatory=True)}
 
     def GET(self, resource, context):
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Check if cart is valid
         if not cart.is_valid():
             return context.come_back(CART_ERROR, goto='/')
@@ -714,7 +724,7 @@ class Shop_ShowRecapitulatif(STLForm):
 
     def get_namespace(self, resource, context):
         abspath = resource.get_abspath()
-        cart = ProductCart(context)
+        cart = get_cart(context)
         # Base namespace
         namespace = STLForm.get_namespace(self, resource, context)
         # Choose payments
@@ -746,8 +756,7 @@ class Shop_ShowRecapitulatif(STLForm):
 
     def action_pay(self, resource, context, form):
         from orders import Order
-        cart = ProductCart(context)
-        root = context.root
+        cart = get_cart(context)
         # Check if cart is valid
         if not cart.is_valid():
             return context.come_back(CART_ERROR, goto='/')
@@ -771,15 +780,8 @@ class Shop_ShowRecapitulatif(STLForm):
         # Arrondi
         total_price_with_tax = get_arrondi(total_price_with_tax)
         total_price_without_tax = get_arrondi(total_price_without_tax)
-        # Guess ref number
-        # We take last order name + 1
-        search = root.search(format='order')
-        orders =  search.get_documents(sort_by='creation_datetime',
-                                       reverse=True)
-        if orders:
-            ref = str(int(orders[0].name) + 1)
-        else:
-            ref = '1'
+        # Get a new ref number
+        ref = resource.get_new_order_reference()
         # We create a new order
         kw = {'user': context.user,
               'payment_mode': form['payment'],
@@ -900,6 +902,97 @@ class Shop_GetProductStock(BaseView):
 
 
 
+class Shop_Barcode(BaseView):
+    """The image of the barcode of a reference, from the barcodes cache.
+    The image of a (format, reference) never changes, so it can be cached
+    by the browsers.
+    Only the barcodes of the references of the catalog, in the format of
+    the shop, are served (a new barcode runs elaphe and ghostscript).
+    """
+
+    access = 'is_allowed_to_edit'
+    query_schema = {'reference': String(mandatory=True),
+                    'format': String}
+
+    def not_found(self, context):
+        context.status = 404
+        context.set_content_type('text/plain')
+        return 'No barcode'
+
+
+    def GET(self, resource, context):
+        reference = context.query['reference']
+        format = resource.get_property('barcode_format')
+        if context.query['format'] not in (None, format):
+            return self.not_found(context)
+        query = AndQuery(
+            PhraseQuery('reference', reference),
+            PhraseQuery('parent_paths', str(context.site_root.get_abspath())))
+        if len(context.root.search(query)) == 0:
+            return self.not_found(context)
+        cache = get_barcodes_cache(context.server.target)
+        etag = '"%s"' % cache.get_key(format, reference)
+        context.set_header('Cache-Control', 'public, max-age=31536000')
+        context.set_header('ETag', etag)
+        if context.get_header('If-None-Match') == etag:
+            context.status = 304
+            return None
+        barcode = cache.get_barcode(format, reference)
+        if barcode is None:
+            context.set_header('Cache-Control', 'no-cache')
+            return self.not_found(context)
+        context.set_content_type('image/png')
+        return barcode
+
+
+
+class Shop_PregenerateBarcodes(AutoForm):
+    """Generate the barcodes of the products and of their declinations
+    not in the cache yet (with the jobs worker).
+    """
+
+    access = 'is_admin'
+    title = MSG(u'Generate the barcodes')
+    submit_value = MSG(u'Generate')
+    batch_size = 100
+
+    def action(self, resource, context, form):
+        format = resource.get_property('barcode_format')
+        if format == '0':
+            msg = ERROR(u'No barcode format is configured.')
+            return context.come_back(msg, goto=';administration')
+        queue = get_job_queue(context.server.target)
+        target = context.server.target
+        references = []
+        for brain, declinations in iter_products(resource):
+            references.extend([ x.reference for x in [brain] + declinations
+                                if x.reference ])
+            if len(references) >= self.batch_size:
+                queue.add_job('barcodes', None, (target, format, references))
+                references = []
+        if references:
+            queue.add_job('barcodes', None, (target, format, references))
+        msg = INFO(u'The barcodes will be generated.')
+        return context.come_back(msg, goto=';administration')
+
+
+
+class Shop_RebuildProductsCounts(AutoForm):
+    """Rebuild the number of products by category from the catalog.
+    """
+
+    access = 'is_admin'
+    title = MSG(u'Rebuild the number of products by category')
+    submit_value = MSG(u'Rebuild')
+
+    def action(self, resource, context, form):
+        counts = get_products_counts(resource)
+        counts.rebuild(resource)
+        msg = INFO(u'The number of products by category has been rebuilt.')
+        return context.come_back(msg, goto=';administration')
+
+
+
 class Shop_Administration(STLView):
 
     access= 'is_allowed_to_edit'
@@ -28,7 +28,7 @@ from itws.repository import Box, register_box
 from itws.repository_views import Box_View
 
 # Import from shop
-from shop.cart import ProductCart
+from shop.cart import get_cart
 
 
 
@@ -38,7 +38,7 @@ class CartBox_View(Box_View):
 
     def get_namespace(self, resource, context):
         show_if_empty = resource.get_property('show_if_empty')
-        cart = ProductCart(context)
+        cart = get_cart(context)
         if (self.is_admin(resource, context) is False and
             cart.get_nb_products() == 0 and
             show_if_empty is False):
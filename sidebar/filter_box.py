@@ -41,6 +41,7 @@ from itws.views import AutomaticEditView
 
 # Import from shop
 from shop.datatypes import IntegerRange
+from shop.facets import count_facets
 from shop.enumerate_table import EnumerateTable_to_Enumerate
 from shop.products.enumerate import CategoriesEnumerate
 from shop.utils import get_skin_template
@@ -255,7 +256,6 @@ class FilterBox_View(Box_View):
 
 
     def get_namespace(self, resource, context):
-        root = context.root
         # Categories
         filters = []
         order = resource.get_resource('order')
@@ -275,12 +275,18 @@ class FilterBox_View(Box_View):
                 if item['selected'] and item['query']:
                     query[item['criterium']] = item['query']
         # Count each item
+        # (One base query by criterium)
         for f in filters:
+            items_by_criterium = {}
             for item in f['items']:
-                s = [y for x,y in query.items() if x != item['criterium']]
-                if item['query']:
-                    s.append(item['query'])
-                item['nb_products'] = len(root.search(AndQuery(*s)))
+                criterium = item['criterium']
+                items_by_criterium.setdefault(criterium, []).append(item)
+            for criterium, items in items_by_criterium.items():
+                s = [y for x,y in query.items() if x != criterium]
+                counts = count_facets(context, AndQuery(*s),
+                                      [x['query'] for x in items])
+                for item, nb_products in zip(items, counts):
+                    item['nb_products'] = nb_products
         # Return namespace
         return {'title': resource.get_title(),
                 'filters': filters}
@@ -19,8 +19,6 @@ from itools.datatypes import Boolean
 from itools.gettext import MSG
 from itools.handlers import checkid
 from itools.stl import stl
-from itools.uri import Path
-from itools.xapian import AndQuery, PhraseQuery
 
 # Import from ikaaro
 from ikaaro.forms import BooleanRadio
@@ -30,6 +28,10 @@ from ikaaro.registry import register_resource_class
 from itws.repository import Box, register_box
 from itws.repository_views import Box_View
 
+# Import from shop
+from shop.categories_tree import get_categories_tree
+from shop.products_counts import get_products_counts
+
 
 
 class SubCategoriesBox_View(Box_View):
@@ -39,7 +41,6 @@ class SubCategoriesBox_View(Box_View):
 
 
     def get_namespace(self, resource, context):
-        root = context.root
         here = context.resource
         site_root = here.get_site_root()
         site_root_abspath = site_root.get_abspath()
@@ -75,58 +76,37 @@ class SubCategoriesBox_View(Box_View):
                 here_abspath_level = here_abspath.count('/')
                 max_level_deploy = categories_abspath.count('/') + 1
 
-        here_abspath_p = Path(here_abspath)
-
-        # Get search with all publics products
-        all_products = root.search(AndQuery(
-                          PhraseQuery('format', shop.product_class.class_id),
-                          PhraseQuery('workflow_state', 'public')))
-        # Get search with all categories
-        all_categories = root.search(AndQuery(
-                            PhraseQuery('parent_paths', categories_abspath),
-                            PhraseQuery('format', 'category')))
+        # Categories tree (cached) and number of products
+        categories_tree = get_categories_tree(site_root)
+        counts = get_products_counts(shop)
+        first_category = categories_tree.get_first_category()
 
-        # Build a dict with brains by level
+        # Build a dict with categories by level
+        # We only take the branch of the current category
         cat_per_level = {}
-        for index, cat in enumerate(all_categories.get_documents(
-                                        sort_by='abspath')):
+        for cat in categories_tree.get_branch(here_abspath):
             # Skip first category --> /categories
-            if index == 0 and show_first_category is False:
+            if cat is first_category and show_first_category is False:
                 continue
 
-            level = cat.abspath.count('/')
+            level = cat['level']
 
             # Skip second level (if we are not on level /categories/')
             if (show_second_level is False and current_level > 2 and
                 level == 3 and
-                not here_real_abspath == cat.abspath and
-                not here_parent_abspath == cat.abspath):
+                not here_real_abspath == cat['abspath'] and
+                not here_parent_abspath == cat['abspath']):
                 continue
 
             # Skip bad level
             if level > max_level_deploy:
                 continue
 
-            diff_level = here_abspath_level - level
-            path_to_resolve = [ '..' for x in range(diff_level) ]
-            path_to_resolve = '/'.join(path_to_resolve)
-            # Path uses to compute the prefix with the current category
-            here_prefix = here_abspath_p.resolve2(path_to_resolve)
-            # Compute the prefix
-            prefix = here_prefix.get_prefix(cat.abspath)
-
-            if prefix == here_prefix:
-                # special case when prefix equals here_prefix
-                pass
-            elif len(prefix) != level-1:
-                # bad, not in the same arborescence
-                continue
-
             # Get the product number in the category
-            sub_results = all_products.search(PhraseQuery('parent_paths',
-                                                          cat.abspath))
+            nb_products = counts.get_nb_products(cat['abspath'],
+                                                 only_public=True)
             cats = cat_per_level.setdefault(level, [])
-            cats.append({'doc': cat, 'nb_products': len(sub_results)})
+            cats.append({'doc': cat, 'nb_products': nb_products})
 
         # Build the tree starting with the higher level
         tree_template = resource.get_resource(self.tree_template)
@@ -136,21 +116,24 @@ class SubCategoriesBox_View(Box_View):
             items = []
             for data in cat_per_level[level]:
                 doc = data['doc']
-                if here_abspath.startswith(doc.abspath):
+                if here_abspath.startswith(doc['abspath']):
                     sub_tree = tree
                     css = 'in-path '
                 else:
                     sub_tree = None
                     css = ''
-                css = 'active ' if here_abspath == doc.abspath else css
+                css = 'active ' if here_abspath == doc['abspath'] else css
                 # Href (get_link emulation)
-                href = str(site_root_abspath.get_pathto(doc.abspath))
+                href = str(site_root_abspath.get_pathto(doc['abspath']))
                 css += checkid(href)
                 css = css.replace('.', '-dot-')
+                m_title = categories_tree.get_title(doc, 'm_title')
                 if resource.get_property('use_small_title'):
-                    title = doc.m_breadcrumb_title or doc.m_title or doc.name
+                    m_breadcrumb_title = categories_tree.get_title(doc,
+                                                'm_breadcrumb_title')
+                    title = m_breadcrumb_title or m_title or doc['name']
                 else:
-                    title = doc.m_title or doc.name
+                    title = m_title or doc['name']
                 d = {'title': title,
                      'href': '/%s' % href,
                      'sub_tree': sub_tree,
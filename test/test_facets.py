@@ -0,0 +1,174 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from random import choice, randint, random, seed
+from unittest import TestCase, main
+
+# Import from itools
+from itools.datatypes import Integer, String
+from itools.xapian import make_catalog
+from itools.xapian import AndQuery, OrQuery, PhraseQuery, RangeQuery
+
+# Import from shop
+from shop.facets import FacetsCounter, count_facets, facets_cache
+
+
+# The fields of the catalog used by the filter box
+fields = {
+    'abspath': String(is_key_field=True, is_stored=True, is_indexed=True),
+    'format': String(is_indexed=True),
+    'workflow_state': String(is_indexed=True),
+    'parent_paths': String(is_indexed=True, multiple=True),
+    'DFT-color': String(is_indexed=True),
+    'DFT-size': String(is_indexed=True),
+    'stored_price': Integer(is_indexed=False, is_stored=True),
+    'stored_weight': Integer(is_indexed=False, is_stored=True)}
+
+colors = ['red', 'green', 'blue', 'black']
+categories = ['/shop/categories/%d' % x for x in range(5)]
+
+
+class TestDatabase(object):
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+
+
+class TestRoot(object):
+
+    def __init__(self, catalog):
+        self.search = catalog.search
+
+
+
+class TestContext(object):
+
+    def __init__(self, catalog):
+        self.database = TestDatabase(catalog)
+        self.root = TestRoot(catalog)
+
+
+
+class FacetsTestCase(TestCase):
+
+    def setUp(self):
+        seed(0)
+        catalog = self.catalog = make_catalog(None, fields)
+        for i in range(500):
+            category = choice(categories)
+            values = {
+                'abspath': '/shop/products/%d' % i,
+                'format': 'product' if i % 10 else 'category',
+                'workflow_state': 'public' if random() < 0.8 else 'private',
+                'parent_paths': ['/', '/shop', '/shop/categories', category,
+                                 '%s/%d' % (category, randint(0, 2))],
+                'stored_price': randint(0, 20000),
+                'stored_weight': randint(0, 1000)}
+            # Not every product has a color
+            if random() < 0.9:
+                values['DFT-color'] = choice(colors)
+            catalog.index_document(values)
+        facets_cache.clear()
+
+
+    def get_base_queries(self):
+        base = [PhraseQuery('format', 'product'),
+                PhraseQuery('workflow_state', 'public')]
+        return [
+            AndQuery(*base),
+            AndQuery(PhraseQuery('DFT-color', 'red'), *base),
+            AndQuery(PhraseQuery('parent_paths', categories[1]), *base),
+            AndQuery(RangeQuery('stored_price', 5000, 15000), *base)]
+
+
+    def get_facets(self):
+        # As built by FilterBox_View
+        facets = [None]
+        facets.extend([ PhraseQuery('DFT-color', x) for x in colors ])
+        # A value no product has, a field no product has
+        facets.append(PhraseQuery('DFT-color', 'white'))
+        facets.append(PhraseQuery('DFT-size', 'XL'))
+        facets.append(PhraseQuery('DFT-material', 'wood'))
+        # Categories and sub-categories
+        facets.extend([ PhraseQuery('parent_paths', x) for x in categories ])
+        facets.extend([ PhraseQuery('parent_paths', '%s/1' % x)
+                        for x in categories ])
+        # Ranges
+        for name in ['stored_price', 'stored_weight']:
+            facets.extend([RangeQuery(name, None, 100),
+                           RangeQuery(name, 100, 500),
+                           RangeQuery(name, 500, None),
+                           RangeQuery(name, None, None)])
+        # Counted with the catalog
+        facets.append(OrQuery(PhraseQuery('DFT-color', 'red'),
+                              PhraseQuery('DFT-color', 'blue')))
+        return facets
+
+
+    def search(self, base_query, query):
+        """The number of products as counted before (one catalog search
+        by value).
+        """
+        if query is None:
+            return len(self.catalog.search(base_query))
+        return len(self.catalog.search(AndQuery(base_query, query)))
+
+
+    def test_counter(self):
+        context = TestContext(self.catalog)
+        facets = self.get_facets()
+        for base_query in self.get_base_queries():
+            counter = FacetsCounter(context, base_query)
+            for query in facets:
+                self.assertEqual(counter.count(query),
+                                 self.search(base_query, query),
+                                 '%r AND %r' % (base_query, query))
+
+
+    def test_count_facets(self):
+        context = TestContext(self.catalog)
+        facets = self.get_facets()
+        base_query = self.get_base_queries()[0]
+        expected = [ self.search(base_query, x) for x in facets ]
+        self.assertEqual(count_facets(context, base_query, facets), expected)
+        # From the cache
+        self.assertEqual(count_facets(context, base_query, facets), expected)
+
+
+    def test_cache(self):
+        """The counts change once a document is indexed.
+        """
+        context = TestContext(self.catalog)
+        base_query = self.get_base_queries()[0]
+        facets = [PhraseQuery('DFT-color', 'white')]
+        self.assertEqual(count_facets(context, base_query, facets), [0])
+        self.catalog.index_document({
+            'abspath': '/shop/products/white',
+            'format': 'product',
+            'workflow_state': 'public',
+            'parent_paths': ['/', '/shop'],
+            'DFT-color': 'white',
+            'stored_price': 100,
+            'stored_weight': 100})
+        context = TestContext(self.catalog)
+        self.assertEqual(count_facets(context, base_query, facets), [1])
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from cPickle import load
+from decimal import Decimal as decimal
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+# Import from itools
+from itools.i18n import AcceptLanguageType
+from itools.web import del_context, set_context
+from itools.xml import XMLParser
+
+# Import from shop
+from shop.datatypes import Civilite
+from shop.jobs import JobQueue
+from shop.orders import orders
+from shop.orders.orders import Order
+from shop.utils import format_price
+
+
+class TestServer(object):
+
+    def __init__(self, target):
+        self.target = target
+
+
+
+class TestContext(object):
+    """A request without database (the jobs are added right away).
+    """
+
+    def __init__(self, target):
+        self.server = TestServer(target)
+        self.accept_language = AcceptLanguageType.decode('fr')
+
+
+
+class TestShop(object):
+
+    def get_pdf_logo_key(self, context):
+        return None
+
+
+    def get_property(self, name):
+        return {'pdf_signature': u'My shop\n1 rue de la Paix'}[name]
+
+
+
+class TestOrder(Order):
+    """The namespace of the order comes from the records of the order,
+    the rest of get_pdf_namespace is not changed.
+    """
+
+    name = '1'
+
+    def __init__(self):
+        pass
+
+
+    def get_resource(self, path, soft=False):
+        return None
+
+
+    def get_namespace(self, context):
+        address = {'gender': Civilite.get_value('madam'),
+                   'firstname': u'Marie',
+                   'lastname': u'Curie',
+                   'address_1': u'11 rue Pierre et Marie Curie',
+                   'zipcode': '75005',
+                   'town': u'Paris',
+                   'country': u'France'}
+        price = format_price(decimal('12.5'))
+        return {'products': [{'id': 0,
+                              'reference': 'REF-1',
+                              'title': u'Product',
+                              'quantity': 1,
+                              'price': {'unit': {'with_tax': price},
+                                        'total': {'with_tax': price}}}],
+                'reference': '1',
+                'creation_date': u'18/10/2010',
+                'price': {'total': {'with_tax': price}},
+                'customer': {'id': '0', 'title': u'Marie Curie',
+                             'email': 'marie@example.com'},
+                'delivery_address': address,
+                'bill_address': dict(address)}
+
+
+
+class JobsTestCase(TestCase):
+
+    def setUp(self):
+        self.target = mkdtemp()
+        self.queue = JobQueue(self.target)
+        self.context = TestContext(self.target)
+        set_context(self.context)
+        self.get_shop = orders.get_shop
+        orders.get_shop = lambda resource: TestShop()
+
+
+    def tearDown(self):
+        orders.get_shop = self.get_shop
+        del_context()
+        rmtree(self.target)
+
+
+    def load_jobs(self):
+        return [ load(open(join(self.queue.path, x[0])))
+                 for x in self.queue.get_jobs() ]
+
+
+    def test_pdf_namespace(self):
+        """The namespace of the PDF goes through the queue unchanged.
+        """
+        order = TestOrder()
+        namespace = order.get_pdf_namespace(self.context)
+        key = order.get_artefact_key('bill')
+        self.queue.add_job('pdf', key, ('order_facture.xml', namespace))
+        jobs = self.load_jobs()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['args'], ('order_facture.xml', namespace))
+        self.assertEqual(self.queue.get_status(key), 'pending')
+        # Plain data, formatted or translated by the request
+        job_namespace = jobs[0]['args'][1]
+        self.assertEqual(job_namespace['pdf_signature'],
+                         u'My shop\n1 rue de la Paix')
+        gender = job_namespace['delivery_address']['gender']
+        self.assert_(isinstance(gender, unicode))
+
+
+    def test_after_commit(self):
+        """Without a transaction the job is added right away.
+        """
+        order = TestOrder()
+        key = order.get_artefact_key('order')
+        namespace = order.get_pdf_namespace(self.context)
+        self.queue.add_job_after_commit('pdf', key,
+                                        ('order_pdf.xml', namespace))
+        self.assertEqual(len(self.load_jobs()), 1)
+        self.assertEqual(self.queue.get_status(key), 'pending')
+
+
+    def test_not_picklable(self):
+        """A job which cannot be pickled is not added, and the artefact is
+        not marked as pending.
+        """
+        key = 'orders/1/bill.pdf'
+        namespace = {'pdf_signature': XMLParser('<b>My shop</b>')}
+        self.assertRaises(Exception, self.queue.add_job, 'pdf', key,
+                          ('order_facture.xml', namespace))
+        self.assertEqual(self.queue.get_status(key), None)
+        self.assertEqual(self.load_jobs(), [])
+        self.assertEqual(listdir(self.queue.tmp_path), [])
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from asyncore import loop
+from email.mime.text import MIMEText
+from shutil import rmtree
+from smtpd import SMTPServer
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase, main
+
+# Import from itools
+from itools.web import del_context, set_context
+
+# Import from shop
+from shop.outbox import Outbox, outboxes, send_email
+from shop.transactions import run_after_abort, run_after_commit
+
+
+class TestSMTPServer(SMTPServer):
+    """A local SMTP server which keeps the messages it receives.
+    """
+
+    def __init__(self):
+        SMTPServer.__init__(self, ('localhost', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+
+class TestServer(object):
+
+    smtp_host = 'localhost'
+
+    def __init__(self, target):
+        self.target = target
+
+
+
+class TestDatabase(object):
+    pass
+
+
+
+class TestContext(object):
+
+    def __init__(self, method):
+        self.method = method
+        self.database = TestDatabase()
+        self.entity = None
+
+
+
+class OutboxTestCase(TestCase):
+
+    def setUp(self):
+        self.target = mkdtemp()
+        self.server = TestServer(self.target)
+        self.outbox = Outbox(self.target)
+        outboxes[self.target] = self.outbox
+        # The SMTP stub
+        self.smtp = TestSMTPServer()
+        self.thread = Thread(target=loop, kwargs={'timeout': 0.1})
+        self.thread.start()
+
+
+    def tearDown(self):
+        self.smtp.close()
+        self.thread.join()
+        del outboxes[self.target]
+        del_context()
+        rmtree(self.target)
+
+
+    def get_message(self, subject):
+        message = MIMEText('Hello')
+        message['Subject'] = subject
+        message['From'] = 'shop@example.com'
+        message['To'] = 'customer@example.com'
+        return message
+
+
+    def send(self):
+        return self.outbox.send('localhost:%d' % self.smtp.port)
+
+
+    def test_post(self):
+        """The email of a POST is sent once the transaction is committed.
+        """
+        context = TestContext('POST')
+        set_context(context)
+        send_email(self.server, self.get_message('Order'))
+        self.assertEqual(self.outbox.get_messages(), [])
+        run_after_commit(context.database)
+        self.assertEqual(len(self.outbox.get_messages()), 1)
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(self.outbox.get_messages(), [])
+        self.assertEqual(len(self.smtp.messages), 1)
+        mailfrom, rcpttos, data = self.smtp.messages[0]
+        self.assertEqual(mailfrom, 'shop@example.com')
+        self.assertEqual(rcpttos, ['customer@example.com'])
+        self.assert_('Subject: Order' in data)
+
+
+    def test_post_aborted(self):
+        """The email of an aborted transaction is not sent.
+        """
+        context = TestContext('POST')
+        set_context(context)
+        send_email(self.server, self.get_message('Order'))
+        run_after_abort(context.database)
+        self.assertEqual(self.outbox.get_messages(), [])
+        self.assertEqual(self.send(), 0)
+
+
+    def test_get(self):
+        """A GET does not commit (as Paybox_End): its email is written into
+        the outbox right away, and the abort does not drop it.
+        """
+        context = TestContext('GET')
+        set_context(context)
+        send_email(self.server, self.get_message('Payment error'))
+        run_after_abort(context.database)
+        self.assertEqual(len(self.outbox.get_messages()), 1)
+        self.assertEqual(self.send(), 1)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self.assert_('Subject: Payment error' in self.smtp.messages[0][2])
+
+
+    def test_no_commit(self):
+        """Neither a POST with "context.commit" False, nor the postponed
+        render of a view.
+        """
+        context = TestContext('POST')
+        context.commit = False
+        set_context(context)
+        send_email(self.server, self.get_message('No commit'))
+        context = TestContext('POST')
+        context.entity = lambda resource, context: 'Postponed'
+        set_context(context)
+        send_email(self.server, self.get_message('Postponed'))
+        self.assertEqual(len(self.outbox.get_messages()), 2)
+        self.assertEqual(self.send(), 2)
+        self.assertEqual(len(self.smtp.messages), 2)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from decimal import Decimal as decimal
+from random import choice, randint, seed
+from unittest import TestCase, main
+
+# Import from shop
+from shop.shipping.shipping_way import get_parcels
+
+
+def get_parcels_greedy(list_weight, max_value):
+    """The parcels as they were made before, one product at a time
+    (ShippingWay.get_price), grouped as get_parcels does.
+    """
+    for key in list_weight:
+        if key > max_value:
+            return None
+    current_value = decimal(0)
+    partition = []
+    list_values = sorted(list_weight, reverse=True)
+    while list_values:
+        if current_value + list_values[-1] <= max_value:
+            current_value += list_values.pop()
+        else:
+            partition.append(current_value)
+            current_value = decimal(0)
+        if len(list_values) == 0:
+            partition.append(current_value)
+    # [(weight of the parcel, number of parcels)]
+    parcels = []
+    for value in partition:
+        if parcels and parcels[-1][0] == value:
+            parcels[-1] = (value, parcels[-1][1] + 1)
+        else:
+            parcels.append((value, 1))
+    return parcels
+
+
+def get_weights(list_weight):
+    weights = {}
+    for weight in list_weight:
+        weights[weight] = weights.get(weight, 0) + 1
+    return weights
+
+
+
+class ParcelsTestCase(TestCase):
+
+    def assertSameParcels(self, list_weight, max_value):
+        self.assertEqual(get_parcels(get_weights(list_weight), max_value),
+                         get_parcels_greedy(list_weight, max_value),
+                         '%s (max %s)' % (list_weight, max_value))
+
+
+    def test_empty(self):
+        self.assertEqual(get_parcels({}, decimal(30)), [])
+        self.assertEqual(get_parcels({decimal(1): 0}, decimal(30)), [])
+
+
+    def test_too_heavy(self):
+        weights = {decimal(1): 2, decimal(31): 1}
+        self.assertEqual(get_parcels(weights, decimal(30)), None)
+        self.assertSameParcels([decimal(1), decimal(31)], decimal(30))
+
+
+    def test_simple(self):
+        weights = {decimal(10): 7}
+        self.assertEqual(get_parcels(weights, decimal(30)),
+                         [(decimal(30), 2), (decimal(10), 1)])
+        self.assertSameParcels([decimal(10)] * 7, decimal(30))
+
+
+    def test_edge_cases(self):
+        max_value = decimal(30)
+        for list_weight in [
+            [decimal(0)],
+            [decimal(0)] * 5 + [decimal(30)],
+            [decimal(30)] * 3,
+            [decimal(15)] * 4 + [decimal(30)],
+            [decimal(1)] * 29 + [decimal(2)],
+            [decimal('0.5'), decimal('29.5'), decimal('29.5')],
+            [decimal('0.1')] * 301]:
+            self.assertSameParcels(list_weight, max_value)
+
+
+    def test_random_carts(self):
+        """The same parcels as before on random carts, as weights (with
+        decimals) and as quantities (mode "quantity").
+        """
+        seed(0)
+        for i in range(500):
+            max_value = decimal(randint(1, 50))
+            products = [ decimal(randint(0, int(max_value) * 100)) / 100
+                         for j in range(randint(1, 8)) ]
+            list_weight = []
+            for j in range(randint(1, 200)):
+                list_weight.append(choice(products))
+            self.assertSameParcels(list_weight, max_value)
+            # Quantities
+            list_weight = [decimal(1)] * randint(1, 200)
+            self.assertSameParcels(list_weight, max_value)
+
+
+
+if __name__ == '__main__':
+    main()
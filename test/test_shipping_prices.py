@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Import from the Standard Library
+from bisect import bisect_left
+from decimal import Decimal as decimal
+from os.path import dirname, join
+from random import randint, seed
+from unittest import TestCase, main
+
+# Import from itools
+from itools.handlers import ro_database
+from itools.xapian import PhraseQuery
+
+# Import from shop
+from shop.shipping.shipping_way import ShippingPricesCSV, ShippingPricesTable
+
+
+def get_price_linear(table, zone, mode, value):
+    """The price of a parcel as it was computed before the prices were
+    compiled: a scan of the ranges [previous max value, max value].
+    """
+    ranges = []
+    min_value = 0
+    for record in table.search(PhraseQuery('zone', zone),
+                               sort_by='max-%s' % mode):
+        max_value = table.get_record_value(record, 'max-%s' % mode)
+        price = table.get_record_value(record, 'price')
+        ranges.append((min_value, max_value, price))
+        min_value = max_value
+    for min_value, max_value, price in ranges:
+        if value >= min_value and value <= max_value:
+            return price
+    return None
+
+
+
+class ShippingPricesTestCase(TestCase):
+
+    def setUp(self):
+        # Load the prices of colissimo (as ShippingWay._make_resource)
+        path = join(dirname(__file__), '..', 'data', 'colissimo.csv')
+        csv = ro_database.get_handler(path, ShippingPricesCSV)
+        zones = []
+        self.table = ShippingPricesTable()
+        for row in csv.get_rows():
+            zone = row.get_value('zone')
+            if zone not in zones:
+                zones.append(zone)
+            self.table.add_record(
+              {'zone': str(zones.index(zone)),
+               'max-weight': row.get_value('max-weight'),
+               'price': row.get_value('price')})
+        self.zones = [ str(x) for x in range(len(zones)) ]
+
+
+    def test_compiled(self):
+        for zone in self.zones:
+            max_values, prices = self.table.get_prices(zone, 'weight')
+            self.assertNotEqual(max_values, [])
+            self.assertEqual(max_values, sorted(max_values))
+            self.assertEqual(len(max_values), len(prices))
+
+
+    def test_unknown_zone(self):
+        self.assertEqual(self.table.get_prices('999', 'weight'), ([], []))
+
+
+    def test_same_prices(self):
+        """The bisection gives the same price as the scan of the ranges,
+        at the breakpoints, around them and on random weights.
+        """
+        seed(0)
+        step = decimal('0.01')
+        for zone in self.zones:
+            max_values, prices = self.table.get_prices(zone, 'weight')
+            values = [decimal(0)]
+            for max_value in max_values:
+                values.extend([max_value - step, max_value])
+                if max_value < max_values[-1]:
+                    values.append(max_value + step)
+            max_cents = int(max_values[-1] * 100)
+            values.extend([ decimal(randint(1, max_cents)) / 100
+                            for i in range(1000) ])
+            for value in values:
+                expected = get_price_linear(self.table, zone, 'weight', value)
+                price = prices[bisect_left(max_values, value)]
+                self.assertEqual(price, expected, '%s kg (zone %s)' %
+                                 (value, zone))
+
+
+    def test_changed(self):
+        """The prices are compiled again once the table changes.
+        """
+        zone = self.zones[0]
+        max_values, prices = self.table.get_prices(zone, 'weight')
+        self.table.add_record({'zone': zone,
+                               'max-weight': max_values[-1] + 1,
+                               'price': decimal('99.99')})
+        max_values, prices = self.table.get_prices(zone, 'weight')
+        self.assertEqual(prices[-1], decimal('99.99'))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+# Copyright (C) 2010 Sylvain Taverne <sylvain@itaapy.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#######################################################################
+# The in-memory structures of the shop (number of products by category,
+# search indexes...) and the queues of the instance (jobs, emails) must
+# only see the committed changes: the changes made during a transaction
+# are registered with "after_commit", then they are applied once the
+# database is committed, or forgotten if the transaction is aborted.
+# The structures built from the changes of a transaction are dropped
+# with "after_abort" if it is aborted.
+#######################################################################
+
+# Import from standard library
+from traceback import format_exc
+
+# Import from itools
+from itools.log import log_error
+from itools.web import get_context
+
+# Import from ikaaro
+from ikaaro.database import Database
+
+
+def after_commit(function, *args):
+    """Call the function with the given arguments once the current
+    transaction is committed (never if it is aborted). Without a
+    transaction (no context) the function is called right away.
+    """
+    context = get_context()
+    database = getattr(context, 'database', None)
+    if database is None:
+        function(*args)
+        return
+    actions = database.__dict__.setdefault('shop_after_commit', [])
+    actions.append((function, args))
+
+
+def after_abort(function, *args):
+    """Call the function with the given arguments if the current
+    transaction is aborted.
+    """
+    context = get_context()
+    database = getattr(context, 'database', None)
+    if database is None:
+        return
+    actions = database.__dict__.setdefault('shop_after_abort', [])
+    actions.append((function, args))
+
+
+def run_actions(database, name):
+    actions = database.__dict__.pop(name, [])
+    for function, args in actions:
+        try:
+            function(*args)
+        except Exception:
+            # The transaction is over, do not abort it
+            log_error('Transaction action failed:\n%s' % format_exc(),
+                      domain='shop')
+
+
+def run_after_commit(database):
+    database.__dict__.pop('shop_after_abort', None)
+    run_actions(database, 'shop_after_commit')
+
+
+def run_after_abort(database):
+    database.__dict__.pop('shop_after_commit', None)
+    run_actions(database, 'shop_after_abort')
+
+
+
+#######################################################################
+# Hooks into the ikaaro database (see shop/__init__)
+# (the transactions without changes are committed too)
+#######################################################################
+Database_save_changes = Database.save_changes
+Database_abort_changes = Database.abort_changes
+
+def save_changes(self):
+    try:
+        Database_save_changes(self)
+    except:
+        # The transaction has been aborted
+        run_after_abort(self)
+        raise
+    run_after_commit(self)
+
+
+def abort_changes(self):
+    Database_abort_changes(self)
+    run_after_abort(self)
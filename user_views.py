@@ -346,7 +346,7 @@ class ShopUser_OrderView(STLForm):
         namespace['is_payed'] = order.get_property('is_payed')
         namespace['is_sent'] = order.get_property('is_sent')
         # Bill
-        has_bill = order.get_resource('bill', soft=True) is not None
+        has_bill = order.get_artefact_status('bill') == 'done'
         namespace['has_bill'] = has_bill
         # Payments
         payments = shop.get_resource('payments')
@@ -18,6 +18,7 @@
 from cStringIO import StringIO
 from datetime import datetime, timedelta
 from decimal import Decimal as decimal
+from random import sample, shuffle
 
 # Import from itools
 from itools.datatypes import Boolean, Enumerate, String, LanguageTag, Tokens
@@ -64,6 +65,31 @@ def get_shop(resource):
     return shop
 
 
+def get_catalog_revision(context):
+    """Return a value which changes each time the catalog is modified
+    (every indexation adds a new document to the xapian database).
+    """
+    db = context.database.catalog._db
+    return (db.get_lastdocid(), db.get_doccount())
+
+
+def get_random_documents(results, size):
+    """Return "size" documents picked at random from the search results.
+    Only the picked documents are loaded, one by one, by their position in
+    the results.
+    """
+    total = len(results)
+    if size < total:
+        positions = sample(xrange(total), size)
+    else:
+        positions = range(total)
+        shuffle(positions)
+    documents = []
+    for position in positions:
+        documents.extend(results.get_documents(start=position, size=1))
+    return documents
+
+
 def get_module(resource, class_id):
     site_root = resource.get_site_root()
     # XXX use parent_paths
@@ -103,14 +129,18 @@ def format_price(price):
 
 
 
+barcode_options = {'scale': 1, 'height': 0.5}
+
 def generate_barcode(format, code):
+    """Use the barcodes cache instead (see shop.barcodes).
+    """
     if format == '0':
         return
     try:
         # Try to import elaphe
         from elaphe import barcode
         # Generate barcode
-        img = barcode(format, code, options={'scale': 1, 'height': 0.5})
+        img = barcode(format, code, options=barcode_options)
         # Format PNG
         f = StringIO()
         img.save(f, 'png')
@@ -170,12 +200,14 @@ def get_shippings_details(cart, context):
         else:
             mode = 'default'
         # Add to list of shippings
+        # (weights are stored as {weight: number of products})
         if shippings_details.has_key(mode) is False:
-            shippings_details[mode] = {'list_weight': [],
+            shippings_details[mode] = {'weights': {},
                                        'nb_products': 0}
-        for i in range(0, cart_elt['quantity']):
-            shippings_details[mode]['list_weight'].append(unit_weight)
-        shippings_details[mode]['nb_products'] += cart_elt['quantity']
+        quantity = cart_elt['quantity']
+        weights = shippings_details[mode]['weights']
+        weights[unit_weight] = weights.get(unit_weight, 0) + quantity
+        shippings_details[mode]['nb_products'] += quantity
     return shippings_details
 
 